@@ -5,66 +5,275 @@ Analytics module with NumPy for numerical operations
 import database as db
 from datetime import datetime, timedelta
 import numpy as np
+import simulation
 
-def get_study_statistics(deck_id=None):
-    conn = db.get_connection()
-    cursor = conn.cursor()
+# Fixed bins for easiness factor quantiles: 0.001 wide from the SM-2 floor
+# up (higher values count in the last bin). Shared with the trigger-maintained
+# analytics_histogram, so both give the same answers.
+EF_HISTOGRAM_RANGE = db.ANALYTICS_EF_RANGE
+EF_HISTOGRAM_BINS = db.ANALYTICS_EF_BINS
+
+# A variance below this share of the mean square is rounding noise left by
+# subtracting raw sums (sum of squares - sum^2 / n), and is taken as 0
+VARIANCE_EPSILON = 1e-9
+
+class RunningMoments:
+    """
+    Count, means and co-moments of several columns, fed chunk by chunk
+    
+    Chunks are merged with the pairwise update of Chan et al., which stays
+    accurate where summing squares would cancel. Memory is O(columns^2)
+    however many rows go in.
+    """
+
+    def __init__(self, columns):
+        self.count = 0
+        self.mean = np.zeros(columns)
+        self.comoment = np.zeros((columns, columns))
+
+    def add(self, chunk):
+        """Add a (rows, columns) array"""
+        rows = len(chunk)
+        if rows == 0:
+            return
+        chunk_mean = chunk.mean(axis=0)
+        centered = chunk - chunk_mean
+        delta = chunk_mean - self.mean
+        total = self.count + rows
+        self.comoment += centered.T @ centered + np.outer(delta, delta) * (self.count * rows / total)
+        self.mean += delta * (rows / total)
+        self.count = total
+
+    @classmethod
+    def from_sums(cls, count, sums, products):
+        """
+        Build from a row count, column sums and the matrix of summed products
+        
+        Subtracting the raw sums cancels badly when a column barely varies,
+        so columns whose variance is within VARIANCE_EPSILON of their mean
+        square are taken as constant (no variance or covariance).
+        """
+        moments = cls(len(sums))
+        if count > 0:
+            sums = np.asarray(sums, dtype=np.float64)
+            products = np.asarray(products, dtype=np.float64)
+            comoment = products - np.outer(sums, sums) / count
+            constant = np.diag(comoment) <= VARIANCE_EPSILON * np.diag(products)
+            comoment[constant, :] = 0
+            comoment[:, constant] = 0
+            moments.count = count
+            moments.mean = sums / count
+            moments.comoment = comoment
+        return moments
+
+    def std(self):
+        """Population standard deviation of each column"""
+        return np.sqrt(np.maximum(np.diag(self.comoment), 0) / self.count)
+
+    def correlation(self):
+        """Pearson correlation matrix (0 where a column is constant)"""
+        scale = np.sqrt(np.maximum(np.diag(self.comoment), 0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            correlation = self.comoment / np.outer(scale, scale)
+        return np.nan_to_num(correlation, nan=0.0, posinf=0.0, neginf=0.0)
+
+def _histogram_percentiles(counts, value_range, percentiles):
+    """
+    Percentiles (linear interpolation, like np.percentile) from fixed-width bin counts
     
+    Values are taken as spread evenly through their bin, so results are
+    within one bin width of the exact percentile.
+    """
+    low, high = value_range
+    width = (high - low) / len(counts)
+    cumulative = np.cumsum(counts)
+    results = []
+    for percentile in percentiles:
+        rank = percentile / 100 * (cumulative[-1] - 1)
+        index = int(np.searchsorted(cumulative, rank, side='right'))
+        before = cumulative[index - 1] if index else 0
+        results.append(low + width * (index + (rank - before + 0.5) / counts[index]))
+    return results
+
+# Card summary: everything the card statistics below are derived from.
+# It comes from the trigger-maintained analytics tables (load_card_summary,
+# O(decks)) or a bounded-memory scan of the cards table (stream_card_summary,
+# used by verify_card_summary() to check the first).
+# analytics_histogram kind -> card summary key
+HISTOGRAM_KINDS = {'interval': 'interval_counts', 'easiness': 'ef_counts',
+                   'repetitions': 'repetition_counts'}
+
+def _empty_summary():
+    return {
+        'card_count': 0,
+        'sum_ef': 0.0,                  # over all cards
+        'total_interval': 0.0,          # over all cards
+        'total_reviews': 0,
+        'due_cards': 0,
+        'moments': RunningMoments(3),   # ef, interval, repetitions of studied cards
+        'interval_counts': np.zeros(len(INTERVAL_LABELS), dtype=np.int64),
+        'ef_counts': np.zeros(EF_HISTOGRAM_BINS, dtype=np.int64),  # studied cards
+        'repetition_counts': np.zeros(db.ANALYTICS_MAX_REPETITIONS + 1, dtype=np.int64)
+    }
+
+def _add_chunk(summary, chunk, now):
+    """Add a (rows, 4) chunk of easiness_factor, interval, repetitions, due_at"""
+    ef, interval, repetitions, due_at = chunk.T
+    studied = repetitions > 0
+    summary['card_count'] += len(chunk)
+    summary['sum_ef'] += float(ef.sum())
+    summary['total_interval'] += float(interval.sum())
+    summary['total_reviews'] += int(repetitions.sum())
+    summary['due_cards'] += int(np.count_nonzero(due_at <= now))
+    summary['moments'].add(chunk[studied, :3])
+    summary['interval_counts'] += np.bincount(
+        np.searchsorted(db.ANALYTICS_INTERVAL_BOUNDS, interval, side='left'),
+        minlength=len(INTERVAL_LABELS))
+    # Same bucketing as the analytics_histogram triggers
+    low, high = EF_HISTOGRAM_RANGE
+    ef_bins = np.clip(((ef[studied] - low) * (EF_HISTOGRAM_BINS / (high - low))).astype(np.int64),
+                      0, EF_HISTOGRAM_BINS - 1)
+    summary['ef_counts'] += np.bincount(ef_bins, minlength=EF_HISTOGRAM_BINS)
+    summary['repetition_counts'] += np.bincount(
+        np.minimum(repetitions, db.ANALYTICS_MAX_REPETITIONS).astype(np.int64),
+        minlength=db.ANALYTICS_MAX_REPETITIONS + 1)
+
+def stream_card_summary(deck_id=None):
+    """Card summary computed from the cards table in fixed-size chunks (memory stays flat)"""
+    summary = _empty_summary()
+    now = db.now_epoch()
+    conn = db.get_connection()
+    cursor = db.raw_cursor(conn)
     if deck_id:
         cursor.execute('''
-            SELECT 
-                COUNT(*) as total_cards,
-                SUM(CASE WHEN repetitions > 0 THEN 1 ELSE 0 END) as studied_cards,
-                AVG(easiness_factor) as avg_easiness,
-                SUM(CASE WHEN next_review <= datetime('now') THEN 1 ELSE 0 END) as due_cards,
-                AVG(interval) as avg_interval,
-                SUM(repetitions) as total_reviews
-            FROM cards
-            WHERE deck_id = ?
+            SELECT easiness_factor, interval, repetitions, due_at FROM cards WHERE deck_id = ?
         ''', (deck_id,))
     else:
-        cursor.execute('''
-            SELECT 
-                COUNT(*) as total_cards,
-                SUM(CASE WHEN repetitions > 0 THEN 1 ELSE 0 END) as studied_cards,
-                AVG(easiness_factor) as avg_easiness,
-                SUM(CASE WHEN next_review <= datetime('now') THEN 1 ELSE 0 END) as due_cards,
-                AVG(interval) as avg_interval,
-                SUM(repetitions) as total_reviews
-            FROM cards
-        ''')
-    
-    result = cursor.fetchone()
+        cursor.execute('SELECT easiness_factor, interval, repetitions, due_at FROM cards')
+    for chunk in db.iter_chunks(cursor, 4):
+        _add_chunk(summary, chunk, now)
+    conn.close()
+    return summary
+
+def load_card_summary(deck_id=None):
+    """
+    Card summary read from deck_counters and the analytics snapshot tables
+    
+    Costs O(decks + histogram buckets) plus an index count of the cards
+    that came due today, whatever the number of cards.
+    """
+    summary = _empty_summary()
+    deck_filter = 'WHERE deck_id = ?' if deck_id else ''
+    params = (deck_id,) if deck_id else ()
+    names = [name for name, _ in db.ANALYTICS_COLUMNS]
+    
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT TOTAL(card_count), TOTAL(sum_ef), TOTAL(total_reviews)
+        FROM deck_counters {deck_filter}
+    ''', params)
+    card_count, sum_ef, total_reviews = cursor.fetchone()
+    summary['card_count'] = int(card_count)
+    summary['sum_ef'] = sum_ef
+    summary['total_reviews'] = int(total_reviews)
+    
+    cursor.execute(f'''
+        SELECT TOTAL({db.DECK_DUE_COUNT_SQL}) FROM decks d {'WHERE d.id = :deck_id' if deck_id else ''}
+    ''', dict(db.due_count_params(), deck_id=deck_id))
+    summary['due_cards'] = int(cursor.fetchone()[0])
+    
+    products = [f'TOTAL(sum_{a}_{b})' for i, a in enumerate(names) for b in names[i:]]
+    cursor.execute(f'''
+        SELECT TOTAL(total_interval), TOTAL(studied_count),
+               {', '.join(f'TOTAL(sum_{name})' for name in names)}, {', '.join(products)}
+        FROM analytics_moments {deck_filter}
+    ''', params)
+    row = cursor.fetchone()
+    summary['total_interval'] = row[0]
+    sums = np.array(row[2:2 + len(names)])
+    matrix = np.zeros((len(names), len(names)))
+    matrix[np.triu_indices(len(names))] = row[2 + len(names):]
+    matrix = matrix + np.triu(matrix, 1).T
+    summary['moments'] = RunningMoments.from_sums(int(round(row[1])), sums, matrix)
+    
+    cursor.execute(f'''
+        SELECT kind, bucket, SUM(card_count) FROM analytics_histogram {deck_filter}
+        GROUP BY kind, bucket
+    ''', params)
+    for kind, bucket, count in cursor.fetchall():
+        summary[HISTOGRAM_KINDS[kind]][bucket] += count
     conn.close()
+    return summary
+
+def verify_card_summary(deck_id=None):
+    """
+    Compare load_card_summary() with stream_card_summary() over the cards table
+    
+    Returns:
+        list: Summary keys that disagree (sums and moments within 1e-6 relative)
+    """
+    loaded, streamed = load_card_summary(deck_id), stream_card_summary(deck_id)
+    mismatches = [key for key in ('card_count', 'total_reviews', 'due_cards', *HISTOGRAM_KINDS.values())
+                  if not np.array_equal(loaded[key], streamed[key])]
+    mismatches += [key for key in ('sum_ef', 'total_interval')
+                   if not np.isclose(loaded[key], streamed[key], rtol=1e-6)]
+    moments, exact = loaded['moments'], streamed['moments']
+    if moments.count != exact.count:
+        mismatches.append('moments')
+    elif exact.count and not (np.allclose(moments.mean, exact.mean, rtol=1e-6)
+                              and np.allclose(moments.std(), exact.std(), rtol=1e-6,
+                                              atol=1e-6 * np.abs(exact.mean).max())):
+        mismatches.append('moments')
+    return mismatches
+
+def verify_moments_from_sums(rows=1000, seed=0):
+    """
+    Regression check: RunningMoments.from_sums() agrees with the chunked
+    update on columns that are constant or vary little around a large mean
     
-    total_cards = result['total_cards'] or 0
-    studied_cards = result['studied_cards'] or 0
+    Returns:
+        int: Number of std/correlation entries that are nan or disagree
+    """
+    rng = np.random.default_rng(seed)
+    columns = np.column_stack([
+        np.full(rows, 2.36),                            # every card at the same EF
+        3650 + rng.integers(0, 3, rows),                # small spread, large mean
+        rng.integers(1, 9, rows).astype(np.float64)
+    ])
+    exact = RunningMoments(columns.shape[1])
+    exact.add(columns)
+    moments = RunningMoments.from_sums(rows, columns.sum(axis=0), columns.T @ columns)
+    wrong = ~np.isclose(moments.std(), exact.std(), rtol=1e-6, atol=1e-9)
+    off_diagonal = ~np.eye(columns.shape[1], dtype=bool)
+    wrong_correlation = ~np.isclose(moments.correlation(), np.nan_to_num(exact.correlation()),
+                                    atol=1e-6) & off_diagonal
+    return int(np.count_nonzero(wrong)) + int(np.count_nonzero(wrong_correlation))
+
+def get_study_statistics(deck_id=None, summary=None):
+    if summary is None:
+        summary = load_card_summary(deck_id)
+    total_cards = summary['card_count']
+    studied_cards = summary['moments'].count
     
     return {
         'total_cards': total_cards,
         'studied_cards': studied_cards,
         'unstudied_cards': total_cards - studied_cards,
-        'due_cards': result['due_cards'] or 0,
-        'avg_easiness': round(result['avg_easiness'] or 2.5, 2),
-        'avg_interval': round(result['avg_interval'] or 0, 1),
-        'total_reviews': result['total_reviews'] or 0,
+        'due_cards': summary['due_cards'],
+        'avg_easiness': round(summary['sum_ef'] / total_cards if total_cards else 2.5, 2),
+        'avg_interval': round(summary['total_interval'] / total_cards if total_cards else 0, 1),
+        'total_reviews': summary['total_reviews'],
         'retention_rate': round((studied_cards / total_cards * 100) if total_cards > 0 else 0, 1)
     }
 
-def get_numerical_statistics(deck_id=None):
-    """Uses NumPy for advanced numerical operations"""
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    
-    if deck_id:
-        cursor.execute('SELECT easiness_factor, interval, repetitions FROM cards WHERE deck_id = ? AND repetitions > 0', (deck_id,))
-    else:
-        cursor.execute('SELECT easiness_factor, interval, repetitions FROM cards WHERE repetitions > 0')
-    
-    results = cursor.fetchall()
-    conn.close()
+def get_numerical_statistics(deck_id=None, summary=None):
+    """Mean, spread and quartiles of studied cards (see load_card_summary)"""
+    if summary is None:
+        summary = load_card_summary(deck_id)
+    moments = summary['moments']
     
-    if not results:
+    if moments.count == 0:
         return {
             'ef_mean': 2.5, 'ef_std': 0.0, 'ef_median': 2.5,
             'ef_25th': 2.5, 'ef_75th': 2.5,
@@ -72,41 +281,31 @@ def get_numerical_statistics(deck_id=None):
             'reps_mean': 0.0, 'reps_std': 0.0
         }
     
-    # NumPy arrays for numerical operations
-    easiness_factors = np.array([row['easiness_factor'] for row in results])
-    intervals = np.array([row['interval'] for row in results])
-    repetitions = np.array([row['repetitions'] for row in results])
-    
-    # NumPy numerical operations
+    mean, std = moments.mean, moments.std()
+    ef_25th, ef_median, ef_75th = _histogram_percentiles(summary['ef_counts'], EF_HISTOGRAM_RANGE,
+                                                         [25, 50, 75])
     return {
-        'ef_mean': round(float(np.mean(easiness_factors)), 2),
-        'ef_std': round(float(np.std(easiness_factors)), 2),
-        'ef_median': round(float(np.median(easiness_factors)), 2),
-        'ef_25th': round(float(np.percentile(easiness_factors, 25)), 2),
-        'ef_75th': round(float(np.percentile(easiness_factors, 75)), 2),
-        'interval_mean': round(float(np.mean(intervals)), 1),
-        'interval_std': round(float(np.std(intervals)), 1),
-        'reps_mean': round(float(np.mean(repetitions)), 1),
-        'reps_std': round(float(np.std(repetitions)), 1)
+        'ef_mean': round(float(mean[0]), 2),
+        'ef_std': round(float(std[0]), 2),
+        'ef_median': round(float(ef_median), 2),
+        'ef_25th': round(float(ef_25th), 2),
+        'ef_75th': round(float(ef_75th), 2),
+        'interval_mean': round(float(mean[1]), 1),
+        'interval_std': round(float(std[1]), 1),
+        'reps_mean': round(float(mean[2]), 1),
+        'reps_std': round(float(std[2]), 1)
     }
 
-def calculate_correlation_matrix():
-    """Calculate correlations using NumPy"""
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT easiness_factor, interval, repetitions FROM cards WHERE repetitions > 0')
-    results = cursor.fetchall()
-    conn.close()
+def calculate_correlation_matrix(summary=None):
+    """Correlations between easiness factor, interval and repetitions of studied cards"""
+    if summary is None:
+        summary = load_card_summary()
+    moments = summary['moments']
     
-    if len(results) < 3:
+    if moments.count < 3:
         return {'ef_interval': 0.0, 'ef_reps': 0.0, 'interval_reps': 0.0}
     
-    ef = np.array([row['easiness_factor'] for row in results])
-    intervals = np.array([row['interval'] for row in results])
-    reps = np.array([row['repetitions'] for row in results])
-    
-    data_matrix = np.array([ef, intervals, reps])
-    correlation_matrix = np.corrcoef(data_matrix)
+    correlation_matrix = moments.correlation()
     
     return {
         'ef_interval': round(float(correlation_matrix[0, 1]), 3),
@@ -114,115 +313,296 @@ def calculate_correlation_matrix():
         'interval_reps': round(float(correlation_matrix[1, 2]), 3)
     }
 
-# Keep original functions
+def _grouped_ef_percentiles(sparse, group_count, percentiles):
+    """
+    _histogram_percentiles() of the EF histogram for many groups at once
+    
+    Args:
+        sparse: (groups, bins, counts) arrays, one entry per non-empty
+                (group, bin), sorted by group then bin
+        group_count: Number of groups
+    
+    Returns:
+        numpy array: (group_count, len(percentiles)), nan for empty groups
+    """
+    groups, bins, counts = sparse
+    low, high = EF_HISTOGRAM_RANGE
+    width = (high - low) / EF_HISTOGRAM_BINS
+    results = np.full((group_count, len(percentiles)), np.nan)
+    if len(counts) == 0:
+        return results
+    cumulative = np.cumsum(counts)
+    totals = np.bincount(groups, weights=counts, minlength=group_count)
+    starts = np.cumsum(totals) - totals
+    present = np.flatnonzero(totals)
+    for k, percentile in enumerate(percentiles):
+        # Rank within each group, moved into the running count of all groups
+        target = starts[present] + percentile / 100 * (totals[present] - 1)
+        index = np.searchsorted(cumulative, target, side='right')
+        before = np.where(index > 0, cumulative[index - 1], 0)
+        results[present, k] = low + width * (bins[index] + (target - before + 0.5) / counts[index])
+    return results
+
+def _deck_groups_from_tables(cursor):
+    """Per-deck sums and histograms from deck_counters and the analytics snapshot tables"""
+    names = [name for name, _ in db.ANALYTICS_COLUMNS]
+    products = [f'sum_{a}_{b}' for i, a in enumerate(names) for b in names[i:]]
+    cursor.execute(f'''
+        SELECT d.id, d.name, dc.card_count, dc.sum_ef, dc.total_reviews,
+               {db.DECK_DUE_COUNT_SQL} as due,
+               am.total_interval, am.studied_count,
+               {', '.join(f'am.sum_{name}' for name in names)}, {', '.join(f'am.{p}' for p in products)}
+        FROM decks d
+        LEFT JOIN deck_counters dc ON dc.deck_id = d.id
+        LEFT JOIN analytics_moments am ON am.deck_id = d.id
+        ORDER BY d.name
+    ''', db.due_count_params())
+    rows = cursor.fetchall()
+    decks = [(row[0], row[1]) for row in rows]
+    values = np.array([[value or 0 for value in row[2:]] for row in rows],
+                      dtype=np.float64).reshape(len(rows), -1)
+    
+    groups = {
+        'card_count': values[:, 0], 'sum_ef': values[:, 1], 'total_reviews': values[:, 2],
+        'due_cards': values[:, 3], 'total_interval': values[:, 4], 'studied': values[:, 5],
+        'sums': values[:, 6:6 + len(names)]
+    }
+    upper = np.zeros((len(rows), len(names), len(names)))
+    upper[:, np.triu_indices(len(names))[0], np.triu_indices(len(names))[1]] = values[:, 6 + len(names):]
+    groups['products'] = upper + np.triu(upper, 1).transpose(0, 2, 1)
+    
+    deck_ids = np.array([deck_id for deck_id, _ in decks], dtype=np.int64)
+    order = np.argsort(deck_ids)
+    cursor.execute('''
+        SELECT deck_id, kind, bucket, card_count FROM analytics_histogram
+        WHERE card_count > 0 AND deck_id IN (SELECT id FROM decks)
+        ORDER BY deck_id, kind, bucket
+    ''')
+    histogram = cursor.fetchall()
+    for kind, key in HISTOGRAM_KINDS.items():
+        entries = np.array([(deck_id, bucket, count) for deck_id, row_kind, bucket, count in histogram
+                            if row_kind == kind], dtype=np.int64).reshape(-1, 3)
+        positions = order[np.searchsorted(deck_ids[order], entries[:, 0])]
+        groups[key] = _sort_groups(positions, entries[:, 1], entries[:, 2])
+    return decks, groups
+
+def _sort_groups(positions, bins, counts):
+    """Sparse (group, bin, count) entries, sorted by group then bin"""
+    order = np.lexsort((bins, positions))
+    return positions[order], bins[order], counts[order]
+
+def _dense(sparse, group_count, width):
+    """(groups, width) matrix from sparse (group, bin, count) entries"""
+    positions, bins, counts = sparse
+    return np.bincount(positions * width + bins, weights=counts,
+                       minlength=group_count * width).reshape(group_count, width).astype(np.int64)
+
 def get_deck_statistics():
+    """
+    Statistics of every deck, computed for all decks at once
+    
+    Per-deck sums and histograms come from the trigger-maintained tables;
+    means, spreads, quartiles and distributions are then derived for every
+    deck in a few vectorized steps.
+    
+    Returns:
+        list: One dict per deck, ordered by name
+    """
     conn = db.get_connection()
     cursor = conn.cursor()
-    cursor.execute('''
-        SELECT d.id, d.name, COUNT(c.id) as total_cards,
-               SUM(CASE WHEN c.repetitions > 0 THEN 1 ELSE 0 END) as studied,
-               SUM(CASE WHEN c.next_review <= datetime('now') THEN 1 ELSE 0 END) as due,
-               AVG(c.easiness_factor) as avg_ef,
-               SUM(c.repetitions) as total_reviews
-        FROM decks d
-        LEFT JOIN cards c ON d.id = c.deck_id
-        GROUP BY d.id ORDER BY d.name
-    ''')
+    decks, groups = _deck_groups_from_tables(cursor)
+    conn.close()
+    
+    deck_count = len(decks)
+    studied = groups['studied']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = groups['sums'] / studied[:, None]
+        squares = np.diagonal(groups['products'], axis1=1, axis2=2)
+        variance = (squares - groups['sums'] ** 2 / studied[:, None]) / studied[:, None]
+        variance[variance <= VARIANCE_EPSILON * squares / studied[:, None]] = 0
+        std = np.sqrt(variance)
+        avg_ef = groups['sum_ef'] / groups['card_count']
+    quartiles = _grouped_ef_percentiles(groups['ef_counts'], deck_count, [25, 50, 75])
+    interval_counts = _dense(groups['interval_counts'], deck_count, len(INTERVAL_LABELS))
+    repetition_counts = _dense(groups['repetition_counts'], deck_count,
+                               db.ANALYTICS_MAX_REPETITIONS + 1)
+    positions, bins, counts = groups['ef_counts']
+    easiness_buckets = np.searchsorted(_easiness_first_bins(), bins, side='right') - 1
+    easiness_counts = _dense((positions, easiness_buckets, counts), deck_count, len(EASINESS_BUCKETS))
     
-    decks = []
-    for row in cursor.fetchall():
-        total = row['total_cards'] or 0
-        studied = row['studied'] or 0
-        decks.append({
-            'id': row['id'],
-            'name': row['name'],
+    results = []
+    for i, (deck_id, name) in enumerate(decks):
+        total = int(groups['card_count'][i])
+        studied_cards = int(studied[i])
+        has_studied = studied_cards > 0
+        results.append({
+            'id': deck_id,
+            'name': name,
             'total_cards': total,
-            'studied_cards': studied,
-            'due_cards': row['due'] or 0,
-            'avg_easiness': round(row['avg_ef'] or 2.5, 2),
-            'total_reviews': row['total_reviews'] or 0,
-            'progress': round((studied / total * 100) if total > 0 else 0, 1)
+            'studied_cards': studied_cards,
+            'due_cards': int(groups['due_cards'][i]),
+            'avg_easiness': round(float(avg_ef[i]) if total else 2.5, 2),
+            'total_reviews': int(groups['total_reviews'][i]),
+            'progress': round((studied_cards / total * 100) if total > 0 else 0, 1),
+            'ef_mean': round(float(mean[i, 0]), 2) if has_studied else 2.5,
+            'ef_std': round(float(std[i, 0]), 2) if has_studied else 0.0,
+            'ef_25th': round(float(quartiles[i, 0]), 2) if has_studied else 2.5,
+            'ef_median': round(float(quartiles[i, 1]), 2) if has_studied else 2.5,
+            'ef_75th': round(float(quartiles[i, 2]), 2) if has_studied else 2.5,
+            'interval_mean': round(float(mean[i, 1]), 1) if has_studied else 0.0,
+            'interval_std': round(float(std[i, 1]), 1) if has_studied else 0.0,
+            'reps_mean': round(float(mean[i, 2]), 1) if has_studied else 0.0,
+            'mature_cards': int(repetition_counts[i, db.ANALYTICS_MAX_REPETITIONS]),
+            'interval_distribution': _distribution(INTERVAL_LABELS, interval_counts[i]),
+            'easiness_distribution': _distribution([label for label, _ in EASINESS_BUCKETS],
+                                                   easiness_counts[i])
         })
-    conn.close()
-    return decks
+    return results
 
-def get_interval_distribution(deck_id=None):
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    query = '''
-        SELECT 
-            CASE 
-                WHEN interval = 0 THEN 'New'
-                WHEN interval = 1 THEN '1 day'
-                WHEN interval <= 7 THEN '2-7 days'
-                WHEN interval <= 30 THEN '1-4 weeks'
-                WHEN interval <= 90 THEN '1-3 months'
-                ELSE '3+ months'
-            END as interval_group,
-            COUNT(*) as count
-        FROM cards
-        {} GROUP BY interval_group
-    '''.format('WHERE deck_id = ?' if deck_id else '')
+# Distribution labels. Interval buckets follow db.ANALYTICS_INTERVAL_BOUNDS
+# (<= bound); easiness buckets are "< bound" and fall on EF histogram bin edges.
+INTERVAL_LABELS = ('New', '1 day', '2-7 days', '1-4 weeks', '1-3 months', '3+ months')
+EASINESS_BUCKETS = (('Very Hard', 1.8), ('Hard', 2.2), ('Medium', 2.8), ('Easy', None))
+
+def _distribution(labels, counts):
+    """Labels and counts, leaving out empty buckets"""
+    data = {'labels': [], 'values': []}
+    for label, count in zip(labels, counts):
+        if count:
+            data['labels'].append(label)
+            data['values'].append(int(count))
+    return data
+
+def _easiness_first_bins():
+    """First EF histogram bin of each easiness bucket"""
+    low, high = EF_HISTOGRAM_RANGE
+    return [0] + [int(round((bound - low) * EF_HISTOGRAM_BINS / (high - low)))
+                  for _, bound in EASINESS_BUCKETS[:-1]]
+
+def get_interval_distribution(deck_id=None, summary=None):
+    if summary is None:
+        summary = load_card_summary(deck_id)
+    return _distribution(INTERVAL_LABELS, summary['interval_counts'])
+
+def get_easiness_distribution(deck_id=None, summary=None):
+    if summary is None:
+        summary = load_card_summary(deck_id)
+    counts = np.add.reduceat(summary['ef_counts'], _easiness_first_bins())
+    return _distribution([label for label, _ in EASINESS_BUCKETS], counts)
+
+MAX_FORECAST_DAYS = 365
+
+def _day_edges(days):
+    """Local midnights from today through days ahead (days + 1 datetimes)"""
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return [today + timedelta(days=i) for i in range(days + 1)]
+
+def _day_index_sql(edges):
+    """
+    SQL expression for the index of the local day due_at falls on
     
-    cursor.execute(query, (deck_id,) if deck_id else ())
-    results = cursor.fetchall()
-    conn.close()
-    return {
-        'labels': [row['interval_group'] for row in results],
-        'values': [row['count'] for row in results]
-    }
+    Days are 86400 seconds except around DST changes, so the range is split
+    into runs of regular days (index by division) and the odd days between
+    them (a constant index). Cards due before edges[0] get -1.
+    
+    Returns:
+        tuple: (sql, params)
+    """
+    branches = ['WHEN due_at < ? THEN -1']
+    params = [edges[0]]
+    first = 0
+    for i in range(1, len(edges)):
+        regular = edges[i] - edges[i - 1] == db.SECONDS_PER_DAY
+        if not regular and first < i - 1:
+            branches.append('WHEN due_at < ? THEN ? + (due_at - ?) / 86400')
+            params += [edges[i - 1], first, edges[first]]
+        if not regular:
+            branches.append('WHEN due_at < ? THEN ?')
+            params += [edges[i], i - 1]
+            first = i
+    if first < len(edges) - 1:
+        branches.append('ELSE ? + (due_at - ?) / 86400')
+        params += [first, edges[first]]
+    return 'CASE ' + ' '.join(branches) + ' END', params
 
-def get_easiness_distribution(deck_id=None):
+def get_review_forecast(days=7, deck_id=None, by_deck=False, overdue=False):
+    """
+    Number of cards coming due on each of the next days
+    
+    This is one range query over idx_cards_due (or
+    idx_cards_deck_due for a single deck) grouped by local day, so the cost
+    depends on the cards in the range rather than on the number of days.
+    
+    Args:
+        days: Days to forecast, today included (1 to MAX_FORECAST_DAYS)
+        deck_id: Only count this deck's cards
+        by_deck: Also break the counts down per deck
+        overdue: Also count cards that were due before today
+    
+    Returns:
+        dict: labels and values per day, plus overdue (int) when requested and
+              decks (deck_id -> {values, overdue}) when by_deck is set
+    """
+    days = min(max(int(days), 1), MAX_FORECAST_DAYS)
+    dates = _day_edges(days)
+    edges = [db.to_epoch(date) for date in dates]
+    
+    day_sql, params = _day_index_sql(edges)
+    conditions = ['due_at < ?']
+    params.append(edges[-1])
+    if not overdue:
+        conditions.append('due_at >= ?')
+        params.append(edges[0])
+    if deck_id:
+        conditions.append('deck_id = ?')
+        params.append(deck_id)
     conn = db.get_connection()
     cursor = conn.cursor()
-    query = '''
-        SELECT 
-            CASE 
-                WHEN easiness_factor < 1.8 THEN 'Very Hard'
-                WHEN easiness_factor < 2.2 THEN 'Hard'
-                WHEN easiness_factor < 2.8 THEN 'Medium'
-                ELSE 'Easy'
-            END as difficulty,
-            COUNT(*) as count
+    cursor.execute(f'''
+        SELECT {day_sql} as day, {'deck_id' if by_deck else '0'} as deck, COUNT(*)
         FROM cards
-        WHERE repetitions > 0 {}
-        GROUP BY difficulty
-    '''.format('AND deck_id = ?' if deck_id else '')
-    
-    cursor.execute(query, (deck_id,) if deck_id else ())
-    results = cursor.fetchall()
+        WHERE {' AND '.join(conditions)}
+        GROUP BY day, deck
+    ''', params)
+    rows = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 3)
     conn.close()
-    return {
-        'labels': [row['difficulty'] for row in results],
-        'values': [row['count'] for row in results]
+    day_index, deck_ids, counts = rows[:, 0], rows[:, 1], rows[:, 2]
+    
+    # Shift by one so the overdue bucket (-1) lands in slot 0
+    slots = day_index + 1
+    totals = np.bincount(slots, weights=counts, minlength=days + 1).astype(np.int64)
+    forecast = {
+        'labels': [date.strftime('%b %d') for date in dates[:-1]],
+        'values': totals[1:].tolist()
     }
+    if overdue:
+        forecast['overdue'] = int(totals[0])
+    if by_deck:
+        # One bincount over (deck, slot) pairs, reshaped to a row per deck
+        decks, deck_pos = np.unique(deck_ids, return_inverse=True)
+        per_deck = np.bincount(deck_pos * (days + 1) + slots, weights=counts,
+                               minlength=len(decks) * (days + 1))
+        per_deck = per_deck.astype(np.int64).reshape(len(decks), days + 1)
+        forecast['decks'] = {}
+        for deck, row in zip(decks.tolist(), per_deck):
+            forecast['decks'][deck] = {'values': row[1:].tolist()}
+            if overdue:
+                forecast['decks'][deck]['overdue'] = int(row[0])
+    return forecast
 
 def get_upcoming_reviews(days=7):
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    data = {'labels': [], 'values': []}
-    for i in range(days):
-        date = datetime.now() + timedelta(days=i)
-        cursor.execute('SELECT COUNT(*) as count FROM cards WHERE DATE(next_review) = ?', 
-                      (date.strftime('%Y-%m-%d'),))
-        result = cursor.fetchone()
-        data['labels'].append(date.strftime('%b %d'))
-        data['values'].append(result['count'] or 0)
-    conn.close()
-    return data
+    """Cards due on each of the next days (see get_review_forecast)"""
+    return get_review_forecast(days)
 
-def calculate_retention_metrics():
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    cursor = cursor.execute('SELECT COUNT(*) FROM cards WHERE repetitions >= 1')
-    passed_first = cursor.fetchone()[0] or 0
-    cursor.execute('SELECT COUNT(*) FROM cards WHERE repetitions >= 2')
-    passed_second = cursor.fetchone()[0] or 0
-    cursor.execute('SELECT COUNT(*) FROM cards WHERE repetitions >= 3')
-    mature_cards = cursor.fetchone()[0] or 0
-    cursor.execute('SELECT COUNT(*) FROM cards WHERE repetitions > 0')
-    total_studied = cursor.fetchone()[0] or 1
-    conn.close()
+def calculate_retention_metrics(summary=None):
+    if summary is None:
+        summary = load_card_summary()
+    # repetition_counts[i] counts cards with i repetitions (the last one: or more)
+    at_least = np.cumsum(summary['repetition_counts'][::-1])[::-1]
+    passed_first = int(at_least[1])
+    passed_second = int(at_least[2])
+    mature_cards = int(at_least[3])
+    total_studied = passed_first or 1
     
     return {
         'first_review_retention': round((passed_first / total_studied * 100), 1),
@@ -231,3 +611,145 @@ def calculate_retention_metrics():
         'mature_cards': mature_cards,
         'total_studied': total_studied
     }
+
+ACTIVITY_DAYS = 365
+
+def get_daily_activity(days=ACTIVITY_DAYS, deck_id=None):
+    """
+    Review activity on each of the last days, today included, from daily_rollups
+    
+    Returns:
+        dict: dates (datetime per day), reviews, again, hard, good, easy,
+              new_cards and minutes (lists, one entry per day), accuracy
+              (share of Good/Easy, None on days without reviews),
+              days_studied and streak (consecutive days up to today or
+              yesterday with reviews)
+    """
+    days = min(max(int(days), 1), MAX_FORECAST_DAYS)
+    last_day = db.local_day(db.now_epoch())
+    first_day = last_day - days + 1
+    rows = np.array(db.get_daily_rollups(first_day, last_day, deck_id),
+                    dtype=np.int64).reshape(-1, 8)
+    totals = np.zeros((days, 7), dtype=np.int64)
+    totals[rows[:, 0] - first_day] = rows[:, 1:]
+    reviews, again, hard, good, easy, new_cards, time_ms = totals.T
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        accuracy = (good + easy) / reviews
+    studied = reviews > 0
+    # A streak still counts when today has no reviews yet
+    streak_days = studied if studied[-1] else studied[:-1]
+    streak = len(streak_days) - (np.flatnonzero(~streak_days)[-1] + 1 if not streak_days.all()
+                                 else 0)
+    return {
+        'dates': [db.day_to_date(day) for day in range(first_day, last_day + 1)],
+        'reviews': reviews.tolist(),
+        'again': again.tolist(),
+        'hard': hard.tolist(),
+        'good': good.tolist(),
+        'easy': easy.tolist(),
+        'new_cards': new_cards.tolist(),
+        'minutes': np.round(time_ms / 60000, 1).tolist(),
+        'accuracy': [None if not day_studied else round(float(value), 3)
+                     for value, day_studied in zip(accuracy, studied)],
+        'days_studied': int(studied.sum()),
+        'streak': int(streak)
+    }
+
+def get_statistics_page_data():
+    """
+    Every metric shown on the statistics page
+    
+    Card statistics come from one load_card_summary() (the trigger-maintained
+    analytics tables) and the forecast from one range query, so no part of
+    the page scans the cards table.
+    
+    Returns:
+        dict: stats, deck_stats, retention_metrics, numerical_stats, correlations,
+              interval_distribution, easiness_distribution, upcoming_reviews and activity
+    """
+    summary = load_card_summary()
+    return {
+        'stats': get_study_statistics(summary=summary),
+        'deck_stats': get_deck_statistics(),
+        'retention_metrics': calculate_retention_metrics(summary),
+        'numerical_stats': get_numerical_statistics(summary=summary),
+        'correlations': calculate_correlation_matrix(summary),
+        'interval_distribution': get_interval_distribution(summary=summary),
+        'easiness_distribution': get_easiness_distribution(summary=summary),
+        'upcoming_reviews': get_upcoming_reviews(7),
+        'activity': get_daily_activity()
+    }
+
+def get_scheduling_state(deck_id=None):
+    """
+    Load the scheduling state of every card as NumPy arrays for the workload simulator
+    
+    Returns:
+        dict: easiness_factor, interval, repetitions and due_day arrays,
+              due_day counted in days from today (negative when overdue)
+    """
+    today = db.now_epoch() // db.SECONDS_PER_DAY
+    deck_filter = 'WHERE deck_id = ?' if deck_id else ''
+    params = (deck_id,) if deck_id else ()
+    conn = db.get_connection()
+    cursor = db.raw_cursor(conn)
+    cursor.execute(f'SELECT TOTAL(card_count) FROM deck_counters {deck_filter}', params)
+    card_count = cursor.fetchone()[0]
+    cursor.execute(f'''
+        SELECT easiness_factor, interval, repetitions, due_at / 86400 - ?
+        FROM cards {deck_filter}
+    ''', (today,) + params)
+    easiness_factor, interval, repetitions, due_day = db.read_columns(
+        cursor, (np.float64, np.int64, np.int64, np.int64), card_count)
+    conn.close()
+    
+    return {
+        'easiness_factor': easiness_factor,
+        'interval': interval,
+        'repetitions': repetitions,
+        'due_day': due_day
+    }
+
+def get_rating_probabilities(deck_id=None, min_reviews=50):
+    """
+    Observed share of Again/Hard/Good/Easy ratings from the review log
+    
+    Returns:
+        tuple: Four probabilities, or None when there are fewer than min_reviews reviews
+    """
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    if deck_id:
+        cursor.execute('''
+            SELECT rating, COUNT(*) FROM review_log WHERE deck_id = ? GROUP BY rating
+        ''', (deck_id,))
+    else:
+        cursor.execute('SELECT rating, COUNT(*) FROM review_log GROUP BY rating')
+    counts = np.zeros(4)
+    for rating, count in cursor.fetchall():
+        if 0 <= rating <= 3:
+            counts[rating] = count
+    conn.close()
+    
+    if counts.sum() < min_reviews:
+        return None
+    return tuple((counts / counts.sum()).tolist())
+
+def get_workload_forecast(days=90, deck_id=None, runs=simulation.DEFAULT_RUNS, processes=None):
+    """
+    Simulated daily review load for the next days, with confidence bands
+    
+    Uses the rating mix from the review log when there is enough history,
+    otherwise simulation.DEFAULT_RATING_PROBABILITIES
+    """
+    state = get_scheduling_state(deck_id)
+    probabilities = get_rating_probabilities(deck_id)
+    forecast = simulation.simulate_workload(state, days=days, runs=runs,
+                                            rating_probabilities=probabilities,
+                                            processes=processes)
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    forecast['labels'] = [(today + timedelta(days=i)).strftime('%b %d')
+                          for i in range(forecast['days'])]
+    forecast['cards'] = len(state['due_day'])
+    return forecast
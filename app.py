@@ -1,16 +1,23 @@
 from flask import Flask, render_template, request, redirect, url_for, jsonify, session
+from markupsafe import Markup, escape
 import database as db
 import ai_generator
 from tts_player import TTSPlayer
-from spaced_repetition import calculate_next_review, get_quality_from_rating
+from spaced_repetition import get_quality_from_rating, fuzz_window, balance_interval
 from hotkeys import HotkeyListener
+from review_queue import ReviewQueue
+from due_queue import DueQueue
 import PyPDF2
 import io
 import os
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta
 import logger
 import analytics
 import visualizations
+import simulation
+import schedulers
 import matplotlib
 
 matplotlib.use('Agg')
@@ -18,12 +25,45 @@ matplotlib.use('Agg')
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this-in-production'
 
-# Global instances
-tts_player = TTSPlayer()
-hotkey_listener = HotkeyListener()
+# Global instances, created by init_app()
+tts_player = None
+hotkey_listener = None
+review_queue = None
+due_queue = None
 
-# Initialize database
-db.init_db()
+_init_lock = threading.Lock()
+_initialized = False
+
+def init_app():
+    """
+    Start the server's workers and services and initialize the database
+    
+    Runs once per serving process, whatever started it (python app.py,
+    flask run, a WSGI server): on the first request at the latest, and
+    never on import, since pool workers import this module too. Safe to
+    call again or from several threads.
+    """
+    global tts_player, hotkey_listener, review_queue, due_queue, _initialized
+    with _init_lock:
+        if _initialized:
+            return
+        visualizations.start_render_pool()
+        simulation.start_pool()
+        
+        tts_player = TTSPlayer()
+        hotkey_listener = HotkeyListener()
+        review_queue = ReviewQueue()
+        due_queue = DueQueue()
+        
+        db.init_db()
+        due_queue.load()
+        _initialized = True
+
+@app.before_request
+def ensure_initialized():
+    """Initialize the app in this process before it serves its first request"""
+    if not _initialized:
+        init_app()
 
 # Study session state
 study_session = {
@@ -32,51 +72,138 @@ study_session = {
     'cards': [],
     'current_index': 0,
     'current_card': None,
+    'card_shown_at': None,
     'should_reload': False
 }
 
 @app.route('/')
 def index():
     """Home page"""
-    decks = db.get_all_decks()
+    due_counts = due_queue.due_counts()
+    decks = [dict(deck, due_count=due_counts.get(deck['id'], 0))
+             for deck in db.get_all_decks(with_due_counts=False)]
     return render_template('index.html', decks=decks)
 
 @app.route('/statistics')
 def statistics():
    """Statistics and analytics page"""
    try:
-       stats = analytics.get_study_statistics()
-       deck_stats = analytics.get_deck_statistics()
-       retention_metrics = analytics.calculate_retention_metrics()
-       numerical_stats = analytics.get_numerical_statistics()
-       correlations = analytics.calculate_correlation_matrix()
+       data = analytics.get_statistics_page_data()
+       stats = data['stats']
+       retention_metrics = data['retention_metrics']
+       numerical_stats = data['numerical_stats']
+       correlations = data['correlations']
        
-       charts = {
-           'summary': visualizations.generate_overall_summary_chart(stats),
-           'deck_progress': visualizations.generate_deck_progress_chart(deck_stats),
-           'interval_dist': visualizations.generate_interval_distribution_chart(
-               analytics.get_interval_distribution()
-           ),
-           'difficulty_dist': visualizations.generate_difficulty_distribution_chart(
-               analytics.get_easiness_distribution()
-           ),
-           'upcoming': visualizations.generate_upcoming_reviews_chart(
-               analytics.get_upcoming_reviews(7)
-           ),
-           'retention': visualizations.generate_retention_metrics_chart(retention_metrics)
-       }
+       charts = visualizations.render_charts({
+           'summary': (visualizations.generate_overall_summary_chart, stats),
+           'deck_progress': (visualizations.generate_deck_progress_chart, data['deck_stats']),
+           'interval_dist': (visualizations.generate_interval_distribution_chart,
+                             data['interval_distribution']),
+           'difficulty_dist': (visualizations.generate_difficulty_distribution_chart,
+                               data['easiness_distribution']),
+           'upcoming': (visualizations.generate_upcoming_reviews_chart, data['upcoming_reviews']),
+           'retention': (visualizations.generate_retention_metrics_chart, retention_metrics),
+           'activity_heatmap': (visualizations.generate_activity_heatmap, data['activity']),
+           'activity_trend': (visualizations.generate_activity_trend_chart, data['activity'])
+       })
        
        logger.log_user_action("VIEW_STATISTICS")
+       logger.log_debug(f"Chart cache: {visualizations.chart_cache_stats()}")
        
        return render_template('statistics.html', 
                             stats=stats, 
                             charts=charts,
                             retention_metrics=retention_metrics,
                             numerical_stats=numerical_stats,
-                            correlations=correlations)
+                            correlations=correlations,
+                            deck_stats=data['deck_stats'])
    except Exception as e:
        logger.log_error("Error generating statistics", e)
 
+@app.route('/statistics/workload')
+def workload_forecast():
+    """Simulated review load for the coming days (JSON)"""
+    days = request.args.get('days', 90, type=int)
+    deck_id = request.args.get('deck_id', type=int)
+    runs = min(max(request.args.get('runs', simulation.DEFAULT_RUNS, type=int), 1), 100)
+    try:
+        forecast = analytics.get_workload_forecast(days, deck_id, runs, processes=os.cpu_count())
+    except Exception as e:
+        logger.log_error("Error simulating workload", e)
+        return jsonify({'error': str(e)}), 500
+    return jsonify(forecast)
+
+# JSON statistics API. Responses carry an ETag made of the process's boot id,
+# the database data version (bumped by every write) and the current minute
+# (due counts and forecasts move with the clock), so a client repeating a
+# request with If-None-Match gets 304 Not Modified before anything is computed.
+STATS_BOOT_ID = f'{os.getpid():x}-{time.time_ns():x}'
+STATS_ETAG_SECONDS = 60
+
+def _stats_forecast(args):
+    return analytics.get_review_forecast(args.get('days', 7, type=int),
+                                         args.get('deck_id', type=int),
+                                         by_deck=args.get('by_deck', 0, type=int) == 1,
+                                         overdue=args.get('overdue', 0, type=int) == 1)
+
+def _stats_activity(args):
+    activity = analytics.get_daily_activity(args.get('days', analytics.ACTIVITY_DAYS, type=int),
+                                            args.get('deck_id', type=int))
+    activity['dates'] = [date.strftime('%Y-%m-%d') for date in activity['dates']]
+    return activity
+
+STATS_ENDPOINTS = {
+    'summary': lambda args: analytics.get_study_statistics(args.get('deck_id', type=int)),
+    'decks': lambda args: analytics.get_deck_statistics(),
+    'numerical': lambda args: analytics.get_numerical_statistics(args.get('deck_id', type=int)),
+    'correlations': lambda args: analytics.calculate_correlation_matrix(),
+    'retention': lambda args: analytics.calculate_retention_metrics(),
+    'intervals': lambda args: analytics.get_interval_distribution(args.get('deck_id', type=int)),
+    'easiness': lambda args: analytics.get_easiness_distribution(args.get('deck_id', type=int)),
+    'forecast': _stats_forecast,
+    'activity': _stats_activity
+}
+
+def stats_etag():
+    """ETag shared by every /api/stats response until the data or the minute changes"""
+    return f'{STATS_BOOT_ID}-{db.data_version()}-{int(time.time()) // STATS_ETAG_SECONDS}'
+
+def _json_safe(value):
+    """Replace NaN (e.g. the correlation of a constant column) with None, which JSON can carry"""
+    if isinstance(value, float) and value != value:
+        return None
+    if isinstance(value, dict):
+        return {key: _json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(item) for item in value]
+    return value
+
+@app.route('/api/stats')
+def stats_api_index():
+    """Names of the /api/stats endpoints (JSON)"""
+    return jsonify(sorted(STATS_ENDPOINTS))
+
+@app.route('/api/stats/<name>')
+def stats_api(name):
+    """Analytics results as JSON, answered with 304 while the ETag still matches"""
+    compute = STATS_ENDPOINTS.get(name)
+    if compute is None:
+        return jsonify({'error': f'Unknown statistics endpoint: {name}'}), 404
+
+    etag = stats_etag()
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        try:
+            response = jsonify(_json_safe(compute(request.args)))
+        except Exception as e:
+            logger.log_error(f"Error computing statistics ({name})", e)
+            return jsonify({'error': str(e)}), 500
+    response.set_etag(etag)
+    # Let clients keep the body but make them revalidate every time
+    response.cache_control.no_cache = True
+    return response
+
 @app.route('/create_deck', methods=['GET', 'POST'])
 def create_deck():
     """Create a new deck"""
@@ -102,10 +229,78 @@ def view_deck(deck_id):
     if not deck:
         return redirect(url_for('index'))
     
-    cards = db.get_cards_by_deck(deck_id)
-    due_cards = db.get_due_cards(deck_id)
+    cards, next_cursor = db.get_cards_page(deck_id)
+    
+    return render_template('view_deck.html', deck=deck, cards=cards,
+                           schedulers=schedulers.SCHEDULERS.values(),
+                           card_count=db.count_cards(deck_id),
+                           due_count=due_queue.due_count(deck_id),
+                           next_cursor=encode_cursor(next_cursor))
+
+@app.route('/deck/<int:deck_id>/cards')
+def deck_cards_page(deck_id):
+    """Get the next page of a deck's cards as JSON (infinite scroll)"""
+    try:
+        after = decode_cursor(request.args.get('after'))
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    limit = min(request.args.get('limit', db.CARDS_PAGE_SIZE, type=int), 200)
     
-    return render_template('view_deck.html', deck=deck, cards=cards, due_count=len(due_cards))
+    cards, next_cursor = db.get_cards_page(deck_id, limit=max(limit, 1), after=after)
+    return jsonify({
+        'cards': [dict(card) for card in cards],
+        'next_cursor': encode_cursor(next_cursor)
+    })
+
+def encode_cursor(cursor):
+    """Encode a (created_at, id) or (rank, id) page cursor as a URL-friendly string"""
+    if cursor is None:
+        return None
+    created_at, card_id = cursor
+    return f"{created_at}|{card_id}"
+
+def decode_cursor(value):
+    """Decode a page cursor produced by encode_cursor (None for the first page)"""
+    if not value:
+        return None
+    created_at, card_id = value.rsplit('|', 1)
+    return created_at, int(card_id)
+
+def decode_search_cursor(value):
+    """Decode a search page cursor, (rank, id) (None for the first page)"""
+    cursor = decode_cursor(value)
+    return cursor and (float(cursor[0]), cursor[1])
+
+@app.route('/deck/<int:deck_id>/scheduler', methods=['POST'])
+def set_deck_scheduler(deck_id):
+    """Choose the scheduler for a deck"""
+    scheduler = request.form.get('scheduler')
+    if scheduler in schedulers.SCHEDULERS:
+        db.set_deck_scheduler(deck_id, scheduler)
+        logger.log_user_action("SET_SCHEDULER", f"| Deck: {deck_id} | Scheduler: {scheduler}")
+    return redirect(url_for('view_deck', deck_id=deck_id))
+
+@app.route('/reschedule', methods=['POST'])
+@app.route('/deck/<int:deck_id>/reschedule', methods=['POST'])
+def reschedule(deck_id=None):
+    """Bulk reschedule a deck, or the whole collection (JSON)"""
+    action = request.form.get('action')
+    days = request.form.get('days', type=int)
+    factor = request.form.get('factor', type=float)
+    
+    if action == 'shift' and days:
+        count = db.shift_due_dates(days, deck_id)
+    elif action == 'spread' and days and days > 0:
+        count = db.spread_overdue(days, deck_id)
+    elif action == 'scale' and factor and factor > 0:
+        count = db.scale_intervals(factor, deck_id)
+    elif action == 'reset' and deck_id:
+        count = db.reset_deck(deck_id)
+    else:
+        return jsonify({'error': 'Invalid reschedule request'}), 400
+    
+    logger.log_user_action("RESCHEDULE", f"| Deck: {deck_id or 'all'} | Action: {action} | Cards: {count}")
+    return jsonify({'success': True, 'count': count})
 
 @app.route('/deck/<int:deck_id>/delete', methods=['POST'])
 def delete_deck(deck_id):
@@ -157,16 +352,49 @@ def generate_cards(deck_id):
             
             logger.log_cards_generated(deck_id, len(flashcards), settings['api_provider'])
 
-            # Save flashcards to database
-            db.add_cards_bulk(deck_id, flashcards)
+            # Save flashcards to database, skipping cards the deck already has
+            new_ids = db.add_cards_bulk(deck_id, flashcards, on_duplicate='skip')
+            duplicates = len(flashcards) - len(new_ids)
+            if duplicates:
+                logger.log_info(f"DUPLICATES_SKIPPED - Deck ID: {deck_id}, Count: {duplicates}")
             
-            return jsonify({'success': True, 'count': len(flashcards)})
+            return jsonify({'success': True, 'count': len(new_ids), 'duplicates': duplicates})
         
         except Exception as e:
             return jsonify({'error': str(e)}), 400
     
     return render_template('view_deck.html', deck=deck)
 
+@app.route('/search')
+def search():
+    """Full-text search over all cards, or one deck's cards"""
+    query = request.args.get('q', '').strip()
+    deck_id = request.args.get('deck_id', type=int)
+    try:
+        after = decode_search_cursor(request.args.get('after'))
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    results, next_cursor = db.search_cards(query, deck_id=deck_id, after=after)
+    
+    for result in results:
+        result['question'] = highlight_snippet(result['question'])
+        result['answer'] = highlight_snippet(result['answer'])
+    
+    if request.args.get('format') == 'json':
+        return jsonify({'results': results, 'next_cursor': encode_cursor(next_cursor),
+                        'has_more': next_cursor is not None})
+    
+    return render_template('search.html', query=query, deck_id=deck_id, first_page=after is None,
+                           results=results, next_cursor=encode_cursor(next_cursor),
+                           decks=db.get_all_decks())
+
+def highlight_snippet(snippet):
+    """HTML-escape a search snippet and turn its match markers into <mark> tags"""
+    html = str(escape(snippet))
+    html = html.replace(db.SNIPPET_START, '<mark>').replace(db.SNIPPET_END, '</mark>')
+    return Markup(html)
+
 @app.route('/card/<int:card_id>/edit', methods=['GET', 'POST'])
 def edit_card(card_id):
     """Edit a card"""
@@ -202,7 +430,7 @@ def study(deck_id):
     if not deck:
         return redirect(url_for('index'))
     
-    due_cards = db.get_due_cards(deck_id)
+    due_cards = db.get_cards_by_ids(due_queue.next_due(deck_id))
     
     if not due_cards:
         return render_template('study.html', deck=deck, no_cards=True)
@@ -215,6 +443,7 @@ def study(deck_id):
     study_session['cards'] = [dict(card) for card in due_cards]
     study_session['current_index'] = 0
     study_session['current_card'] = study_session['cards'][0]
+    study_session['card_shown_at'] = time.monotonic()
     
     # Get hotkey settings
     settings = db.get_settings()
@@ -300,17 +529,12 @@ def rate_card_hotkey(rating):
         
         card = study_session['current_card']
         
-        # Calculate next review using SM-2
+        # Calculate next review with the deck's scheduler
         quality = get_quality_from_rating(rating)
-        new_ef, new_interval, new_reps, next_review = calculate_next_review(
-            quality,
-            card['easiness_factor'],
-            card['interval'],
-            card['repetitions']
-        )
+        result = schedule_review(card, quality)
         
-        # Update card in database
-        db.update_card_review(card['id'], new_ef, new_interval, new_reps, next_review)
+        # Queue the card update and review log entry for writing
+        queue_review(card, quality, result)
         logger.log_card_rated(card['id'], rating)
         
         # Stop current TTS
@@ -322,6 +546,7 @@ def rate_card_hotkey(rating):
         if study_session['current_index'] < len(study_session['cards']):
             # Load next card
             study_session['current_card'] = study_session['cards'][study_session['current_index']]
+            study_session['card_shown_at'] = time.monotonic()
             study_session['should_reload'] = True
             print(f"✅ Next card loaded. Page will reload.")
         else:
@@ -330,21 +555,57 @@ def rate_card_hotkey(rating):
             study_session['current_card'] = None
             print("✅ Session complete.")
 
+def schedule_review(card, quality):
+    """Run the deck's scheduler for a rated card, moving it to a quieter day if load balancing is on"""
+    scheduler = schedulers.for_deck(db.get_deck_by_id(card['deck_id']))
+    result = scheduler.schedule(card, quality)
+    
+    window = fuzz_window(result['interval'])
+    if window and db.get_settings()['load_balance']:
+        due_day = db.to_epoch(result['next_review']) // db.SECONDS_PER_DAY
+        loads = db.get_due_load(due_day - window, due_day + window)
+        balanced = balance_interval(result['interval'], due_day, loads)
+        if balanced != result['interval']:
+            next_review = datetime.strptime(result['next_review'], '%Y-%m-%d %H:%M:%S')
+            next_review += timedelta(days=balanced - result['interval'])
+            result['next_review'] = next_review.strftime('%Y-%m-%d %H:%M:%S')
+            result['interval'] = balanced
+    
+    return result
+
+def queue_review(card, quality, result):
+    """Hand a rated card and its new schedule to the write-behind review queue"""
+    shown_at = study_session['card_shown_at']
+    due_at = db.to_epoch(result['next_review'])
+    # The card leaves the due queue now, not when the review is written
+    due_queue.update(card['id'], card['deck_id'], due_at)
+    review_queue.submit({
+        'card_id': card['id'],
+        'deck_id': card['deck_id'],
+        'reviewed_at': db.now_epoch(),
+        'rating': quality,
+        'old_ef': card['easiness_factor'],
+        'new_ef': result['easiness_factor'],
+        'old_interval': card['interval'],
+        'new_interval': result['interval'],
+        'repetitions': result['repetitions'],
+        'next_review': result['next_review'],
+        'due_at': due_at,
+        'stability': result['stability'],
+        'difficulty': result['difficulty'],
+        'latency_ms': int((time.monotonic() - shown_at) * 1000) if shown_at else None
+    })
+
 def process_rating(rating):
     """Process card rating and update database"""
     card = study_session['current_card']
     
-    # Calculate next review using SM-2
+    # Calculate next review with the deck's scheduler
     quality = get_quality_from_rating(rating)
-    new_ef, new_interval, new_reps, next_review = calculate_next_review(
-        quality,
-        card['easiness_factor'],
-        card['interval'],
-        card['repetitions']
-    )
+    result = schedule_review(card, quality)
     
-    # Update card in database
-    db.update_card_review(card['id'], new_ef, new_interval, new_reps, next_review)
+    # Queue the card update and review log entry for writing
+    queue_review(card, quality, result)
 
     logger.log_card_rated(card['id'], rating)
     
@@ -357,6 +618,7 @@ def process_rating(rating):
     if study_session['current_index'] < len(study_session['cards']):
         # Load next card
         study_session['current_card'] = study_session['cards'][study_session['current_index']]
+        study_session['card_shown_at'] = time.monotonic()
         
         # Auto-play next card
         card = study_session['current_card']
@@ -391,11 +653,15 @@ def end_study_session():
     tts_player.stop()
     hotkey_listener.unregister_hotkeys()
     
+    # Make the session's ratings visible to the deck list right away
+    review_queue.flush()
+    
     study_session['active'] = False
     study_session['deck_id'] = None
     study_session['cards'] = []
     study_session['current_index'] = 0
     study_session['current_card'] = None
+    study_session['card_shown_at'] = None
     logger.log_study_session_completed(study_session['deck_id'], study_session['current_index'])
 
 @app.route('/settings', methods=['GET', 'POST'])
@@ -408,13 +674,29 @@ def settings():
         hotkey_hard = request.form.get('hotkey_hard')
         hotkey_good = request.form.get('hotkey_good')
         hotkey_easy = request.form.get('hotkey_easy')
+        load_balance = request.form.get('load_balance') == 'on'
         
-        db.update_settings(api_provider, api_key, hotkey_again, hotkey_hard, hotkey_good, hotkey_easy)
+        db.update_settings(api_provider, api_key, hotkey_again, hotkey_hard, hotkey_good, hotkey_easy,
+                           load_balance)
+        
+        if request.form.get('rebalance') == 'on':
+            moved = db.rebalance_due_dates()
+            logger.log_info(f"REBALANCED | Cards moved: {moved}")
         
         return redirect(url_for('settings'))
     
     current_settings = db.get_settings()
-    return render_template('settings.html', settings=current_settings)
+    return render_template('settings.html', settings=current_settings,
+                           fsrs_fit=db.get_scheduler_params(schedulers.FSRSScheduler.name))
+
+@app.route('/settings/fit_fsrs', methods=['POST'])
+def fit_fsrs():
+    """Fit the FSRS scheduler's parameters to the review log"""
+    result = schedulers.optimize_fsrs()
+    if result is None:
+        return jsonify({'error': 'Not enough reviews yet to fit FSRS'}), 400
+    logger.log_info(f"FSRS_FITTED | Reviews: {result['review_count']} | Log loss: {result['log_loss']:.4f}")
+    return jsonify({'success': True, **result})
 
 @app.route('/algorithm')
 def algorithm():
@@ -431,4 +713,10 @@ def check_update():
     return jsonify({'reload': False})
 
 if __name__ == '__main__':
+    from werkzeug.serving import is_running_from_reloader
+    # In debug mode this process only watches for changes and restarts the
+    # server in a child process: start up there ahead of the first request,
+    # not here
+    if is_running_from_reloader():
+        init_app()
     app.run(debug=True, port=5000)
\ No newline at end of file
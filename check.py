@@ -90,6 +90,123 @@ try:
 except ImportError as e:
     print(f"  ❌ Cannot import visualizations: {e}")
 
+# Check the schema version, reading the live database without migrating it
+print("\n🧱 CHECKING SCHEMA:")
+pending_migrations = None
+try:
+    import database
+    database.set_read_only(True)
+    conn = database.get_connection()
+    try:
+        pending_migrations = database.pending_migrations(conn)
+    finally:
+        conn.close()
+    for version, description in pending_migrations:
+        print(f"  ❌ migration {version} - NOT APPLIED ({description})")
+    if not pending_migrations:
+        print(f"  ✅ schema version {database.MIGRATIONS[-1][0]}")
+except Exception as e:
+    print(f"  ❌ Cannot read the database: {e}")
+
+# The checks below read the live database and expect the current schema
+schema_current = pending_migrations == []
+
+# Check that hot queries stay on their indexes
+print("\n🗂️  CHECKING QUERY PLANS:")
+slow_queries = []
+try:
+    import database
+    if not schema_current:
+        print("  ⏭️  skipped (schema not current)")
+    else:
+        for name, (ok, plan) in database.check_query_plans().items():
+            if ok:
+                print(f"  ✅ {name}")
+            else:
+                print(f"  ❌ {name} - NOT USING ITS INDEX")
+                for line in plan:
+                    print(f"       {line}")
+                slow_queries.append(name)
+except Exception as e:
+    print(f"  ❌ Cannot check query plans: {e}")
+
+# Check the trigger-maintained analytics snapshot against the cards table
+print("\n📈 CHECKING ANALYTICS SNAPSHOT:")
+stale_analytics = []
+try:
+    import database
+    if not schema_current:
+        print("  ⏭️  skipped (schema not current)")
+    else:
+        stale_analytics = database.check_analytics_snapshot()
+        if stale_analytics:
+            print(f"  ❌ analytics snapshot - OUT OF DATE for decks {', '.join(map(str, stale_analytics))}")
+        else:
+            print("  ✅ analytics snapshot")
+except Exception as e:
+    print(f"  ❌ Cannot check analytics snapshot: {e}")
+
+# Check the card summary read from the analytics tables against a scan of cards
+print("\n🧾 CHECKING CARD SUMMARY:")
+summary_mismatches = []
+try:
+    import analytics
+    if not schema_current:
+        print("  ⏭️  skipped (schema not current)")
+    else:
+        summary_mismatches = analytics.verify_card_summary()
+        if analytics.verify_moments_from_sums():
+            summary_mismatches.append('moments of a constant column')
+        if summary_mismatches:
+            print(f"  ❌ load_card_summary - DISAGREES WITH stream_card_summary on {', '.join(summary_mismatches)}")
+        else:
+            print("  ✅ load_card_summary")
+except Exception as e:
+    print(f"  ❌ Cannot check card summary: {e}")
+
+# Check the batch scheduler against the per-card one
+print("\n🧮 CHECKING BATCH SCHEDULER:")
+scheduler_mismatches = 0
+try:
+    import spaced_repetition
+    scheduler_mismatches = spaced_repetition.verify_batch_matches_scalar(20000)
+    if scheduler_mismatches:
+        print(f"  ❌ calculate_next_review_batch - {scheduler_mismatches} MISMATCHES")
+    else:
+        print("  ✅ calculate_next_review_batch")
+except Exception as e:
+    print(f"  ❌ Cannot check batch scheduler: {e}")
+
+# Check that duplicate detection keeps cards differing only in their symbols apart
+print("\n🧬 CHECKING DUPLICATE DETECTION:")
+duplicate_failures = []
+try:
+    import database
+    duplicate_failures = database.verify_duplicate_detection()
+    for failure in duplicate_failures:
+        print(f"  ❌ content_hash - {failure}")
+    if not duplicate_failures:
+        print("  ✅ content_hash")
+except Exception as e:
+    print(f"  ❌ Cannot check duplicate detection: {e}")
+
+# Check bulk rescheduling speed on a scratch database (slow: only with --benchmark)
+print("\n⏱️  CHECKING BULK RESCHEDULE SPEED:")
+slow_reschedules = []
+try:
+    import database
+    if '--benchmark' in sys.argv:
+        for name, seconds in database.benchmark_reschedule().items():
+            if seconds > database.RESCHEDULE_SECONDS:
+                print(f"  ❌ {name} - {seconds:.2f}s for {database.BENCHMARK_CARDS} cards")
+                slow_reschedules.append(name)
+            else:
+                print(f"  ✅ {name} ({seconds:.2f}s for {database.BENCHMARK_CARDS} cards)")
+    else:
+        print("  ⏭️  skipped (run: python check.py --benchmark)")
+except Exception as e:
+    print(f"  ❌ Cannot check bulk rescheduling: {e}")
+
 # Summary
 print("\n" + "=" * 60)
 print("SUMMARY")
@@ -110,7 +227,41 @@ if missing_imports:
     if 'NumPy' in missing_imports:
         print("\n   → Run: pip install numpy")
 
-if not missing_files and not missing_imports:
+if pending_migrations:
+    print(f"\n❌ PENDING MIGRATIONS ({len(pending_migrations)}):")
+    for version, description in pending_migrations:
+        print(f"   - {version}: {description}")
+    print("\n   → Run: python database.py migrate")
+
+if slow_queries:
+    print(f"\n❌ QUERIES NOT USING INDEXES ({len(slow_queries)}):")
+    for name in slow_queries:
+        print(f"   - {name}")
+    print("\n   → Run: python database.py migrate")
+
+if stale_analytics:
+    print(f"\n❌ ANALYTICS SNAPSHOT OUT OF DATE ({len(stale_analytics)} decks)")
+    print("\n   → Run: python database.py rebuild-analytics")
+
+if summary_mismatches:
+    print(f"\n❌ CARD SUMMARY DISAGREES WITH THE CARDS TABLE ({', '.join(summary_mismatches)})")
+    print("\n   → Run: python database.py rebuild-analytics")
+
+if scheduler_mismatches:
+    print(f"\n❌ BATCH SCHEDULER DISAGREES WITH calculate_next_review ({scheduler_mismatches} cards)")
+
+if duplicate_failures:
+    print(f"\n❌ DUPLICATE DETECTION WRONG ({len(duplicate_failures)} card pairs)")
+    print("\n   → Fix normalize_card_text in database.py, then add a migration rehashing cards")
+
+if slow_reschedules:
+    print(f"\n❌ BULK RESCHEDULING TOO SLOW ({len(slow_reschedules)}):")
+    for name in slow_reschedules:
+        print(f"   - {name}")
+
+if (not missing_files and not missing_imports and not pending_migrations and not slow_queries and not stale_analytics
+        and not summary_mismatches and not scheduler_mismatches and not duplicate_failures
+        and not slow_reschedules):
     print("\n✅ ALL DEPENDENCIES FOUND!")
     print("\nIf statistics page still fails:")
     print("1. Check Python console for error messages")
@@ -1,12 +1,729 @@
 import sqlite3
 from datetime import datetime, timedelta
+from contextlib import contextmanager
+from collections import OrderedDict
+import threading
+import atexit
+import time
+import hashlib
+import unicodedata
 import json
+import os
+import re
+import tempfile
+import numpy as np
+import spaced_repetition as sr
 
 DATABASE_NAME = 'flashcards.db'
 
+# Connection pooling: closed connections go back to an idle pool instead of
+# being torn down. Set the LAZYSTUDY_DB_POOL=0 environment variable (or call
+# set_connection_pooling(False)) to get a fresh connection per call, e.g. in tests.
+USE_CONNECTION_POOL = os.environ.get('LAZYSTUDY_DB_POOL', '1') != '0'
+
+# Open DATABASE_NAME read-only (set_read_only()), e.g. for diagnostics that
+# must not migrate or otherwise write to the live database
+READ_ONLY = False
+
+# Maximum number of idle connections kept open
+POOL_SIZE = 8
+
+# Prepared statements kept per connection (sqlite3's statement cache)
+STATEMENT_CACHE_SIZE = 256
+
+# Rows per executemany() call in the bulk card operations
+BULK_CHUNK_SIZE = 5000
+
+# Cards per page in the deck view
+CARDS_PAGE_SIZE = 50
+
+# Read-through cache for rarely-changing rows (settings, decks, single cards).
+# Set LAZYSTUDY_DB_CACHE=0 to disable it.
+CACHE_ENABLED = os.environ.get('LAZYSTUDY_DB_CACHE', '1') != '0'
+CACHE_SIZE = 2048
+
+# Pragmas applied to every new connection
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode = WAL',         # readers don't block the writer
+    'PRAGMA synchronous = NORMAL',       # fsync on checkpoint only, safe with WAL
+    'PRAGMA cache_size = -16000',        # 16 MB page cache
+    'PRAGMA mmap_size = 268435456',      # 256 MB memory-mapped I/O
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA foreign_keys = ON',
+)
+
+_pool_lock = threading.Lock()
+_idle_connections = []
+
+
+class PooledConnection(sqlite3.Connection):
+    """SQLite connection whose close() returns it to the idle pool"""
+
+    pooled = False
+    checked_out = False
+    database = None
+
+    def close(self):
+        if not self.pooled:
+            super().close()
+            return
+        if not self.checked_out:
+            return
+        self.checked_out = False
+        try:
+            # Discard anything the caller left uncommitted
+            if self.in_transaction:
+                self.rollback()
+        except sqlite3.Error:
+            super().close()
+            return
+        with _pool_lock:
+            if (USE_CONNECTION_POOL and len(_idle_connections) < POOL_SIZE
+                    and self.database == DATABASE_NAME):
+                _idle_connections.append(self)
+                return
+        super().close()
+
+    def close_for_real(self):
+        """Actually close the underlying connection"""
+        super().close()
+
+
+def _open_connection(database=None):
+    """Open and configure a new connection (to DATABASE_NAME unless another path is given)"""
+    read_only = READ_ONLY and database is None
+    database = database or DATABASE_NAME
+    conn = sqlite3.connect(f'file:{database}?mode=ro' if read_only else database,
+                           factory=PooledConnection, uri=read_only,
+                           cached_statements=STATEMENT_CACHE_SIZE,
+                           check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.database = database
+    for pragma in CONNECTION_PRAGMAS:
+        # Switching the journal mode is a write
+        if not (read_only and pragma.startswith('PRAGMA journal_mode')):
+            conn.execute(pragma)
+    return conn
+
+SECONDS_PER_DAY = 86400
+
+# Per-deck counters kept current by triggers on cards, so the deck list and
+# deck statistics cost O(decks) instead of a scan over every card.
+# deck_due_buckets counts cards per (deck, UTC day of due_at).
+DECK_COUNTERS_SCHEMA = [
+    '''
+        CREATE TABLE IF NOT EXISTS deck_counters (
+            deck_id INTEGER PRIMARY KEY REFERENCES decks (id) ON DELETE CASCADE,
+            card_count INTEGER NOT NULL DEFAULT 0,
+            studied_count INTEGER NOT NULL DEFAULT 0,
+            sum_ef REAL NOT NULL DEFAULT 0,
+            total_reviews INTEGER NOT NULL DEFAULT 0
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS deck_due_buckets (
+            deck_id INTEGER NOT NULL REFERENCES decks (id) ON DELETE CASCADE,
+            due_day INTEGER NOT NULL,
+            card_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (deck_id, due_day)
+        ) WITHOUT ROWID
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS cards_counters_insert AFTER INSERT ON cards
+        BEGIN
+            INSERT INTO deck_counters (deck_id, card_count, studied_count, sum_ef, total_reviews)
+            VALUES (new.deck_id, 1, new.repetitions > 0, new.easiness_factor, new.repetitions)
+            ON CONFLICT (deck_id) DO UPDATE SET
+                card_count = card_count + 1,
+                studied_count = studied_count + excluded.studied_count,
+                sum_ef = sum_ef + excluded.sum_ef,
+                total_reviews = total_reviews + excluded.total_reviews;
+            INSERT INTO deck_due_buckets (deck_id, due_day, card_count)
+            VALUES (new.deck_id, new.due_at / 86400, 1)
+            ON CONFLICT (deck_id, due_day) DO UPDATE SET card_count = card_count + 1;
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS cards_counters_delete AFTER DELETE ON cards
+        BEGIN
+            UPDATE deck_counters SET
+                card_count = card_count - 1,
+                studied_count = studied_count - (old.repetitions > 0),
+                sum_ef = sum_ef - old.easiness_factor,
+                total_reviews = total_reviews - old.repetitions
+            WHERE deck_id = old.deck_id;
+            UPDATE deck_due_buckets SET card_count = card_count - 1
+            WHERE deck_id = old.deck_id AND due_day = old.due_at / 86400;
+            DELETE FROM deck_due_buckets
+            WHERE deck_id = old.deck_id AND due_day = old.due_at / 86400 AND card_count <= 0;
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS cards_counters_update
+        AFTER UPDATE OF deck_id, easiness_factor, repetitions ON cards
+        BEGIN
+            UPDATE deck_counters SET
+                card_count = card_count - 1,
+                studied_count = studied_count - (old.repetitions > 0),
+                sum_ef = sum_ef - old.easiness_factor,
+                total_reviews = total_reviews - old.repetitions
+            WHERE deck_id = old.deck_id;
+            INSERT INTO deck_counters (deck_id, card_count, studied_count, sum_ef, total_reviews)
+            VALUES (new.deck_id, 1, new.repetitions > 0, new.easiness_factor, new.repetitions)
+            ON CONFLICT (deck_id) DO UPDATE SET
+                card_count = card_count + 1,
+                studied_count = studied_count + excluded.studied_count,
+                sum_ef = sum_ef + excluded.sum_ef,
+                total_reviews = total_reviews + excluded.total_reviews;
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS cards_due_buckets_update
+        AFTER UPDATE OF deck_id, due_at ON cards
+        WHEN old.deck_id != new.deck_id OR old.due_at / 86400 != new.due_at / 86400
+        BEGIN
+            UPDATE deck_due_buckets SET card_count = card_count - 1
+            WHERE deck_id = old.deck_id AND due_day = old.due_at / 86400;
+            DELETE FROM deck_due_buckets
+            WHERE deck_id = old.deck_id AND due_day = old.due_at / 86400 AND card_count <= 0;
+            INSERT INTO deck_due_buckets (deck_id, due_day, card_count)
+            VALUES (new.deck_id, new.due_at / 86400, 1)
+            ON CONFLICT (deck_id, due_day) DO UPDATE SET card_count = card_count + 1;
+        END
+    ''',
+]
+
+# Condition the rebuild statements below select cards with (_recount()
+# narrows it to a single deck)
+ALL_DECKS_FILTER = 'deck_id IN (SELECT id FROM decks)'
+
+# Recompute deck_counters/deck_due_buckets from cards (tables must be empty)
+DECK_COUNTERS_REBUILD = [
+    f'''
+        INSERT INTO deck_counters (deck_id, card_count, studied_count, sum_ef, total_reviews)
+        SELECT deck_id, COUNT(*), SUM(repetitions > 0), TOTAL(easiness_factor), SUM(repetitions)
+        FROM cards WHERE {ALL_DECKS_FILTER} GROUP BY deck_id
+    ''',
+    f'''
+        INSERT INTO deck_due_buckets (deck_id, due_day, card_count)
+        SELECT deck_id, due_at / 86400, COUNT(*)
+        FROM cards WHERE {ALL_DECKS_FILTER} GROUP BY deck_id, due_at / 86400
+    ''',
+]
+
+# Analytics snapshot kept current by triggers on cards, so statistics read
+# in O(decks) instead of scanning every card. analytics_moments holds per-deck
+# sums, squared sums and cross-products of (easiness_factor, interval,
+# repetitions) over studied cards (mean, std and correlations follow from
+# them); analytics_histogram holds per-deck bucket counts. The bucketing is
+# baked into the triggers, so changing it needs a new migration.
+ANALYTICS_INTERVAL_BOUNDS = (0, 1, 7, 30, 90)   # 'interval': <= bound, then one open bucket
+ANALYTICS_EF_RANGE = (1.3, 10.0)                # 'easiness': equal bins, clipped to the range
+ANALYTICS_EF_BINS = 8700
+ANALYTICS_MAX_REPETITIONS = 3                   # 'repetitions': 0, 1, 2, 3+
+
+ANALYTICS_COLUMNS = (('ef', 'easiness_factor'), ('interval', 'interval'), ('reps', 'repetitions'))
+
+def _analytics_terms(row):
+    """analytics_moments column -> SQL for one card's contribution (row is 'new', 'old' or 'cards')"""
+    studied = f'({row}.repetitions > 0)'
+    terms = {'total_interval': f'{row}.interval', 'studied_count': studied}
+    for i, (name, column) in enumerate(ANALYTICS_COLUMNS):
+        terms[f'sum_{name}'] = f'{studied} * {row}.{column}'
+        for other, other_column in ANALYTICS_COLUMNS[i:]:
+            terms[f'sum_{name}_{other}'] = f'{studied} * {row}.{column} * {row}.{other_column}'
+    return terms
+
+def _analytics_buckets(row):
+    """analytics_histogram kind -> SQL for a card's bucket"""
+    interval_case = ' '.join(f'WHEN {row}.interval <= {bound} THEN {i}'
+                             for i, bound in enumerate(ANALYTICS_INTERVAL_BOUNDS))
+    low, high = ANALYTICS_EF_RANGE
+    return {
+        'interval': f'CASE {interval_case} ELSE {len(ANALYTICS_INTERVAL_BOUNDS)} END',
+        'easiness': f'MIN(MAX(CAST(({row}.easiness_factor - {low!r}) * '
+                    f'{ANALYTICS_EF_BINS / (high - low)!r} AS INTEGER), 0), {ANALYTICS_EF_BINS - 1})',
+        'repetitions': f'MIN({row}.repetitions, {ANALYTICS_MAX_REPETITIONS})'
+    }
+
+def _analytics_add(row):
+    """Trigger statements counting one card in the analytics snapshot"""
+    terms = _analytics_terms(row)
+    buckets = _analytics_buckets(row)
+    return f'''
+            INSERT INTO analytics_moments (deck_id, {', '.join(terms)})
+            VALUES ({row}.deck_id, {', '.join(terms.values())})
+            ON CONFLICT (deck_id) DO UPDATE SET
+                {', '.join(f'{name} = {name} + excluded.{name}' for name in terms)};
+            INSERT INTO analytics_histogram (deck_id, kind, bucket, card_count)
+            VALUES ({row}.deck_id, 'interval', {buckets['interval']}, 1),
+                   ({row}.deck_id, 'repetitions', {buckets['repetitions']}, 1)
+            ON CONFLICT (deck_id, kind, bucket) DO UPDATE SET card_count = card_count + 1;
+            INSERT INTO analytics_histogram (deck_id, kind, bucket, card_count)
+            SELECT {row}.deck_id, 'easiness', {buckets['easiness']}, 1
+            WHERE {row}.repetitions > 0
+            ON CONFLICT (deck_id, kind, bucket) DO UPDATE SET card_count = card_count + 1;
+    '''
+
+def _analytics_remove(row):
+    """
+    Trigger statements uncounting one card. Plain UPDATEs, like the
+    deck_counters triggers: when a deck is deleted its snapshot rows may
+    already be gone by the time its cards are
+    """
+    terms = _analytics_terms(row)
+    buckets = _analytics_buckets(row)
+    return f'''
+            UPDATE analytics_moments SET
+                {', '.join(f'{name} = {name} - {term}' for name, term in terms.items())}
+            WHERE deck_id = {row}.deck_id;
+            UPDATE analytics_histogram SET card_count = card_count - 1
+            WHERE deck_id = {row}.deck_id AND kind = 'interval' AND bucket = {buckets['interval']};
+            UPDATE analytics_histogram SET card_count = card_count - 1
+            WHERE deck_id = {row}.deck_id AND kind = 'repetitions' AND bucket = {buckets['repetitions']};
+            UPDATE analytics_histogram SET card_count = card_count - 1
+            WHERE deck_id = {row}.deck_id AND kind = 'easiness' AND bucket = {buckets['easiness']}
+              AND {row}.repetitions > 0;
+    '''
+
+ANALYTICS_SNAPSHOT_SCHEMA = [
+    f'''
+        CREATE TABLE IF NOT EXISTS analytics_moments (
+            deck_id INTEGER PRIMARY KEY REFERENCES decks (id) ON DELETE CASCADE,
+            {', '.join(f'{name} REAL NOT NULL DEFAULT 0' for name in _analytics_terms('cards'))}
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS analytics_histogram (
+            deck_id INTEGER NOT NULL REFERENCES decks (id) ON DELETE CASCADE,
+            kind TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            card_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (deck_id, kind, bucket)
+        ) WITHOUT ROWID
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS cards_analytics_insert AFTER INSERT ON cards
+        BEGIN
+            {_analytics_add('new')}
+        END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS cards_analytics_delete AFTER DELETE ON cards
+        BEGIN
+            {_analytics_remove('old')}
+        END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS cards_analytics_update
+        AFTER UPDATE OF deck_id, easiness_factor, interval, repetitions ON cards
+        BEGIN
+            {_analytics_remove('old')}
+            {_analytics_add('new')}
+        END
+    ''',
+]
+
+# Per-deck aggregates over cards, in the shape of the analytics tables
+ANALYTICS_MOMENTS_SQL = f'''
+    SELECT deck_id, {', '.join(f'TOTAL({term}) as {name}' for name, term in _analytics_terms('cards').items())}
+    FROM cards WHERE {ALL_DECKS_FILTER} GROUP BY deck_id
+'''
+
+ANALYTICS_HISTOGRAM_QUERIES = {kind: f'''
+    SELECT deck_id, '{kind}' as kind, {bucket} as bucket, COUNT(*) as card_count
+    FROM cards WHERE {ALL_DECKS_FILTER}{' AND repetitions > 0' if kind == 'easiness' else ''}
+    GROUP BY deck_id, bucket
+''' for kind, bucket in _analytics_buckets('cards').items()}
+
+ANALYTICS_HISTOGRAM_SQL = ' UNION ALL '.join(ANALYTICS_HISTOGRAM_QUERIES.values())
+
+# Recompute the analytics snapshot from cards (tables must be empty)
+ANALYTICS_SNAPSHOT_REBUILD = [
+    f'''
+        INSERT INTO analytics_moments (deck_id, {', '.join(_analytics_terms('cards'))})
+        {ANALYTICS_MOMENTS_SQL}
+    ''',
+    f'''
+        INSERT INTO analytics_histogram (deck_id, kind, bucket, card_count)
+        {ANALYTICS_HISTOGRAM_SQL}
+    ''',
+]
+
+# Review activity per (local day, deck), kept up to date by record_reviews()
+# so activity charts read a few hundred rows instead of the review log. day
+# is the local calendar date as days since 1970-01-01. There is no foreign
+# key: like review_log, the history outlives deleted decks.
+DAILY_ROLLUPS_SCHEMA = [
+    '''
+        CREATE TABLE IF NOT EXISTS daily_rollups (
+            day INTEGER NOT NULL,
+            deck_id INTEGER NOT NULL,
+            reviews INTEGER NOT NULL DEFAULT 0,
+            again_count INTEGER NOT NULL DEFAULT 0,
+            hard_count INTEGER NOT NULL DEFAULT 0,
+            good_count INTEGER NOT NULL DEFAULT 0,
+            easy_count INTEGER NOT NULL DEFAULT 0,
+            new_cards INTEGER NOT NULL DEFAULT 0,
+            time_ms INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, deck_id)
+        ) WITHOUT ROWID
+    ''',
+]
+
+# Time counted per review is capped, so a card left open while away does
+# not add an hour of study
+MAX_REVIEW_TIME_MS = 60000
+
+# Recompute daily_rollups from review_log (table must be empty)
+DAILY_ROLLUPS_REBUILD = [
+    f'''
+        INSERT INTO daily_rollups (day, deck_id, reviews, again_count, hard_count, good_count,
+                                   easy_count, new_cards, time_ms)
+        SELECT CAST(julianday(reviewed_at, 'unixepoch', 'localtime', 'start of day')
+                    - 2440587.5 AS INTEGER) as day,
+               deck_id, COUNT(*), SUM(rating = 0), SUM(rating = 1), SUM(rating = 2),
+               SUM(rating = 3), SUM(old_interval = 0),
+               SUM(MIN(COALESCE(latency_ms, 0), {MAX_REVIEW_TIME_MS}))
+        FROM review_log GROUP BY day, deck_id
+    ''',
+]
+
+DAILY_ROLLUP_UPSERT_SQL = '''
+    INSERT INTO daily_rollups (day, deck_id, reviews, again_count, hard_count, good_count,
+                               easy_count, new_cards, time_ms)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (day, deck_id) DO UPDATE SET
+        reviews = reviews + excluded.reviews,
+        again_count = again_count + excluded.again_count,
+        hard_count = hard_count + excluded.hard_count,
+        good_count = good_count + excluded.good_count,
+        easy_count = easy_count + excluded.easy_count,
+        new_cards = new_cards + excluded.new_cards,
+        time_ms = time_ms + excluded.time_ms
+'''
+
+# Full-text index over card questions and answers. External-content FTS5
+# table: the text lives in cards only, triggers keep the index in step.
+CARDS_FTS_SCHEMA = [
+    '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS cards_fts USING fts5(
+            question, answer,
+            content='cards', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS cards_fts_insert AFTER INSERT ON cards
+        BEGIN
+            INSERT INTO cards_fts (rowid, question, answer)
+            VALUES (new.id, new.question, new.answer);
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS cards_fts_delete AFTER DELETE ON cards
+        BEGIN
+            INSERT INTO cards_fts (cards_fts, rowid, question, answer)
+            VALUES ('delete', old.id, old.question, old.answer);
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS cards_fts_update AFTER UPDATE OF question, answer ON cards
+        BEGIN
+            INSERT INTO cards_fts (cards_fts, rowid, question, answer)
+            VALUES ('delete', old.id, old.question, old.answer);
+            INSERT INTO cards_fts (rowid, question, answer)
+            VALUES (new.id, new.question, new.answer);
+        END
+    ''',
+]
+
+# Full-text index with each card's deck as a token in a third column, so a
+# search within one deck is narrowed by the index before any ranking. The
+# content is a view over cards adding that token; bm25 gives the deck
+# column no weight. Replaces CARDS_FTS_SCHEMA (migration 14).
+FTS_DECK_TOKEN = 'deck'
+CARDS_FTS_DECK_SCHEMA = [
+    'DROP TRIGGER IF EXISTS cards_fts_insert',
+    'DROP TRIGGER IF EXISTS cards_fts_delete',
+    'DROP TRIGGER IF EXISTS cards_fts_update',
+    'DROP TABLE IF EXISTS cards_fts',
+    f'''
+        CREATE VIEW IF NOT EXISTS cards_fts_content AS
+        SELECT id, question, answer, '{FTS_DECK_TOKEN}' || deck_id AS deck FROM cards
+    ''',
+    '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS cards_fts USING fts5(
+            question, answer, deck,
+            content='cards_fts_content', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS cards_fts_insert AFTER INSERT ON cards
+        BEGIN
+            INSERT INTO cards_fts (rowid, question, answer, deck)
+            VALUES (new.id, new.question, new.answer, '{FTS_DECK_TOKEN}' || new.deck_id);
+        END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS cards_fts_delete AFTER DELETE ON cards
+        BEGIN
+            INSERT INTO cards_fts (cards_fts, rowid, question, answer, deck)
+            VALUES ('delete', old.id, old.question, old.answer, '{FTS_DECK_TOKEN}' || old.deck_id);
+        END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS cards_fts_update AFTER UPDATE OF question, answer, deck_id ON cards
+        BEGIN
+            INSERT INTO cards_fts (cards_fts, rowid, question, answer, deck)
+            VALUES ('delete', old.id, old.question, old.answer, '{FTS_DECK_TOKEN}' || old.deck_id);
+            INSERT INTO cards_fts (rowid, question, answer, deck)
+            VALUES (new.id, new.question, new.answer, '{FTS_DECK_TOKEN}' || new.deck_id);
+        END
+    ''',
+    "INSERT INTO cards_fts (cards_fts) VALUES ('rebuild')",
+    "INSERT INTO cards_fts (cards_fts, rank) VALUES ('rank', 'bm25(1.0, 1.0, 0.0)')",
+]
+
+# Bulk rescheduling inserts a row into bulk_update for the length of its
+# transaction (no other connection ever sees it), which switches off the
+# per-row UPDATE triggers; the operation then brings the aggregates up to
+# date itself, in O(buckets) or one recount instead of one upsert per card.
+BULK_UPDATE_GUARD = 'NOT EXISTS (SELECT 1 FROM bulk_update)'
+GUARDED_TRIGGERS = ('cards_counters_update', 'cards_due_buckets_update', 'cards_analytics_update')
+
+def _guarded_trigger(name):
+    """SQL recreating an UPDATE trigger with BULK_UPDATE_GUARD in its WHEN clause"""
+    sql = next(sql for sql in DECK_COUNTERS_SCHEMA + ANALYTICS_SNAPSHOT_SCHEMA
+               if f'CREATE TRIGGER IF NOT EXISTS {name}\n' in sql)
+    head, body = sql.split('BEGIN', 1)
+    head, _, condition = head.partition('WHEN')
+    condition = f'{BULK_UPDATE_GUARD} AND ({condition.strip()})' if condition.strip() else BULK_UPDATE_GUARD
+    return f'{head.rstrip()}\n        WHEN {condition}\n        BEGIN{body}'
+
+# Schema migrations, applied in order by init_db(). Each entry is
+# (version, description, steps); a step is either an SQL string or a callable
+# taking a cursor. Never edit a released migration - append a new one.
+# Last review of existing cards: their latest review_log entry, else the
+# start of their current interval
+LAST_REVIEW_BACKFILL = '''
+    UPDATE cards
+    SET last_review = COALESCE(
+        (SELECT MAX(reviewed_at) FROM review_log WHERE review_log.card_id = cards.id),
+        due_at - interval * 86400
+    )
+    WHERE repetitions > 0
+'''
+
+MIGRATIONS = [
+    (1, 'Index cards by deck and next review date', [
+        'CREATE INDEX IF NOT EXISTS idx_cards_deck_next_review ON cards (deck_id, next_review)',
+    ]),
+    (2, 'Index cards by deck and creation date', [
+        'CREATE INDEX IF NOT EXISTS idx_cards_deck_created ON cards (deck_id, created_at)',
+    ]),
+    (3, 'Add integer due_at (epoch seconds) to cards', [
+        'ALTER TABLE cards ADD COLUMN due_at INTEGER NOT NULL DEFAULT 0',
+        # next_review defaults to CURRENT_TIMESTAMP (UTC) for new cards, but the
+        # scheduler writes local time
+        '''
+            UPDATE cards SET due_at = COALESCE(CAST(
+                CASE WHEN next_review = created_at THEN strftime('%s', next_review)
+                     ELSE strftime('%s', next_review, 'utc') END
+            AS INTEGER), 0)
+        ''',
+        'DROP INDEX IF EXISTS idx_cards_deck_next_review',
+        'CREATE INDEX IF NOT EXISTS idx_cards_deck_due ON cards (deck_id, due_at)',
+        'CREATE INDEX IF NOT EXISTS idx_cards_due ON cards (due_at)',
+    ]),
+    (4, 'Add trigger-maintained deck_counters and deck_due_buckets', DECK_COUNTERS_SCHEMA + [
+        'DELETE FROM deck_counters',
+        'DELETE FROM deck_due_buckets',
+    ] + DECK_COUNTERS_REBUILD),
+    (5, 'Add review_log', [
+        '''
+            CREATE TABLE IF NOT EXISTS review_log (
+                id INTEGER PRIMARY KEY,
+                card_id INTEGER NOT NULL,
+                deck_id INTEGER NOT NULL,
+                reviewed_at INTEGER NOT NULL,
+                rating INTEGER NOT NULL,
+                old_ef REAL,
+                new_ef REAL,
+                old_interval INTEGER,
+                new_interval INTEGER,
+                latency_ms INTEGER
+            )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_review_log_card ON review_log (card_id, reviewed_at)',
+        'CREATE INDEX IF NOT EXISTS idx_review_log_time ON review_log (reviewed_at)',
+    ]),
+    (6, 'Add cards_fts full-text index', CARDS_FTS_SCHEMA + [
+        "INSERT INTO cards_fts (cards_fts) VALUES ('rebuild')",
+    ]),
+    (7, 'Add cards.content_hash with a unique per-deck index', [
+        'ALTER TABLE cards ADD COLUMN content_hash TEXT',
+        lambda cursor: _backfill_content_hashes(cursor),
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_cards_deck_hash ON cards (deck_id, content_hash)',
+    ]),
+    (8, 'Add settings.load_balance and index due buckets by day', [
+        'ALTER TABLE settings ADD COLUMN load_balance INTEGER DEFAULT 0',
+        'CREATE INDEX IF NOT EXISTS idx_due_buckets_day ON deck_due_buckets (due_day, card_count)',
+    ]),
+    (9, 'Per-deck scheduler, FSRS card state and fitted scheduler parameters', [
+        "ALTER TABLE decks ADD COLUMN scheduler TEXT NOT NULL DEFAULT 'sm2'",
+        'ALTER TABLE cards ADD COLUMN stability REAL',
+        'ALTER TABLE cards ADD COLUMN difficulty REAL',
+        '''
+        CREATE TABLE IF NOT EXISTS scheduler_params (
+            name TEXT PRIMARY KEY,
+            params TEXT NOT NULL,
+            review_count INTEGER NOT NULL DEFAULT 0,
+            log_loss REAL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (10, 'Add trigger-maintained analytics_moments and analytics_histogram', ANALYTICS_SNAPSHOT_SCHEMA + [
+        'DELETE FROM analytics_moments',
+        'DELETE FROM analytics_histogram',
+    ] + ANALYTICS_SNAPSHOT_REBUILD),
+    (11, 'Add daily_rollups, backfilled from review_log', DAILY_ROLLUPS_SCHEMA + [
+        'DELETE FROM daily_rollups',
+    ] + DAILY_ROLLUPS_REBUILD),
+    (12, 'Let bulk rescheduling switch off the per-row UPDATE triggers', [
+        'CREATE TABLE IF NOT EXISTS bulk_update (active INTEGER NOT NULL)',
+    ] + [statement for name in GUARDED_TRIGGERS
+         for statement in (f'DROP TRIGGER IF EXISTS {name}', _guarded_trigger(name))]),
+    (13, 'Rehash cards keeping symbols within their text', [
+        'UPDATE cards SET content_hash = NULL',
+        lambda cursor: _backfill_content_hashes(cursor),
+    ]),
+    (14, 'Index each card\'s deck in cards_fts', CARDS_FTS_DECK_SCHEMA),
+    (15, 'Store when each card was last reviewed', [
+        'ALTER TABLE cards ADD COLUMN last_review INTEGER',
+        LAST_REVIEW_BACKFILL,
+    ]),
+]
+
+def _is_edge_character(char):
+    """Whitespace or punctuation ignored at either end of card text (dashes are kept: -5 is not 5)"""
+    category = unicodedata.category(char)
+    return char.isspace() or (category.startswith('P') and category != 'Pd')
+
+def normalize_card_text(text):
+    """
+    Normalize card text for duplicate detection: case, runs of whitespace and
+    punctuation around the text are ignored, symbols within it (2+2, x^2, 5 > 3) are not
+    """
+    text = ' '.join(unicodedata.normalize('NFKC', text or '').casefold().split())
+    start, end = 0, len(text)
+    while start < end and _is_edge_character(text[start]):
+        start += 1
+    while end > start and _is_edge_character(text[end - 1]):
+        end -= 1
+    return text[start:end]
+
+def content_hash(question, answer):
+    """Hash of a card's normalized question and answer"""
+    content = normalize_card_text(question) + '\x1f' + normalize_card_text(answer)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+def _backfill_content_hashes(cursor):
+    """Hash existing cards; later copies of a duplicate keep a NULL hash"""
+    seen = set()
+    updates = []
+    for row in cursor.execute('SELECT id, deck_id, question, answer FROM cards ORDER BY id').fetchall():
+        key = (row[1], content_hash(row[2], row[3]))
+        if key not in seen:
+            seen.add(key)
+            updates.append((key[1], row[0]))
+    cursor.executemany('UPDATE cards SET content_hash = ? WHERE id = ?', updates)
+
+# (question, answer) pairs that must hash differently, and pairs that must
+# hash the same (verify_duplicate_detection())
+DISTINCT_CARDS = [
+    (('2+2', '4'), ('2*2', '4')),
+    (('x^2', '2x'), ('x/2', '2x')),
+    (('5 > 3', 'Yes'), ('5 < 3', 'Yes')),
+    (('-5', 'Negative'), ('5', 'Negative')),
+]
+DUPLICATE_CARDS = [
+    (('What is 2+2?', '4'), ('what is  2+2', ' 4.')),
+    (('Capital of France', 'Paris'), ('CAPITAL OF FRANCE!', '"Paris"')),
+    (('ﬁve', 'Ｖ'), ('five', 'v')),
+]
+
+def verify_duplicate_detection():
+    """
+    Check content_hash() against DISTINCT_CARDS and DUPLICATE_CARDS
+    
+    Returns:
+        list: Descriptions of the pairs it gets wrong (empty if none)
+    """
+    failures = []
+    for first, second in DISTINCT_CARDS:
+        if content_hash(*first) == content_hash(*second):
+            failures.append(f'{first} and {second} treated as duplicates')
+    for first, second in DUPLICATE_CARDS:
+        if content_hash(*first) != content_hash(*second):
+            failures.append(f'{first} and {second} not treated as duplicates')
+    return failures
+
+def get_schema_version(conn):
+    """Get the highest migration version applied to the database"""
+    cursor = conn.execute('SELECT MAX(version) FROM schema_version')
+    return cursor.fetchone()[0] or 0
+
+def pending_migrations(conn):
+    """Migrations not yet applied to the database, as (version, description) pairs"""
+    versioned = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    ).fetchone()
+    current = get_schema_version(conn) if versioned else 0
+    return [(version, description) for version, description, _ in MIGRATIONS if version > current]
+
+def _apply_migrations(conn):
+    """Apply pending schema migrations, each in its own transaction"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+    
+    current = get_schema_version(conn)
+    for version, description, steps in MIGRATIONS:
+        if version <= current:
+            continue
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            for step in steps:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+            cursor.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                           (version, description))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
 def init_db():
     """Initialize database with required tables"""
-    conn = sqlite3.connect(DATABASE_NAME)
+    conn = get_connection()
+    _create_schema(conn)
+    conn.close()
+    clear_cache()
+
+def _create_schema(conn):
+    """Create the tables on a connection and bring its schema up to date"""
     cursor = conn.cursor()
     
     # Decks table
@@ -56,14 +773,296 @@ def init_db():
         ''')
     
     conn.commit()
-    conn.close()
+    _apply_migrations(conn)
 
 def get_connection():
-    """Get database connection"""
-    conn = sqlite3.connect(DATABASE_NAME)
-    conn.row_factory = sqlite3.Row
+    """Get database connection (from the idle pool when pooling is on)"""
+    if not USE_CONNECTION_POOL:
+        return _open_connection()
+    
+    conn = None
+    with _pool_lock:
+        while _idle_connections:
+            candidate = _idle_connections.pop()
+            if candidate.database == DATABASE_NAME:
+                conn = candidate
+                break
+            candidate.close_for_real()
+    if conn is None:
+        conn = _open_connection()
+        conn.pooled = True
+    conn.checked_out = True
     return conn
 
+@contextmanager
+def transaction(conn=None):
+    """
+    Run a block of statements in one write transaction (one commit, one sync),
+    on a pooled connection or on the given one (which is left open)
+    """
+    pooled = conn is None
+    if pooled:
+        conn = get_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if pooled:
+            conn.close()
+
+def close_all_connections():
+    """Close every idle pooled connection"""
+    with _pool_lock:
+        connections = list(_idle_connections)
+        _idle_connections.clear()
+    for conn in connections:
+        try:
+            conn.close_for_real()
+        except sqlite3.Error:
+            pass
+
+atexit.register(close_all_connections)
+
+def set_connection_pooling(enabled):
+    """Turn connection pooling on or off, closing any pooled connections"""
+    global USE_CONNECTION_POOL
+    close_all_connections()
+    USE_CONNECTION_POOL = enabled
+
+def set_read_only(enabled):
+    """Open the application database read-only or not, closing any pooled connections"""
+    global READ_ONLY
+    close_all_connections()
+    READ_ONLY = enabled
+
+# Cache. Each entry remembers the version it was loaded under: the version of
+# its table plus the version of its key's stripe. Writes bump the table version
+# (bulk writes) or the stripes of the keys they touch (single-row writes), so
+# stale entries simply stop matching and age out of the LRU.
+_CACHE_STRIPES = 256
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_table_versions = {'settings': 0, 'decks': 0, 'cards': 0, 'scheduler_params': 0}
+_stripe_versions = [0] * _CACHE_STRIPES
+_cache_counters = {'hits': 0, 'misses': 0}
+
+# Data version: a single counter bumped after every committed write that goes
+# through this module, so readers of derived data (the /api/stats endpoints)
+# can tell whether anything may have changed without looking at the tables
+_data_version = 0
+
+def data_version():
+    """Current data version (changes whenever decks, cards or settings were written)"""
+    return _data_version
+
+def _data_changed():
+    """Bump the data version"""
+    global _data_version
+    with _cache_lock:
+        _data_version += 1
+
+def _cache_version(table, key):
+    """Current version for a cache entry (caller holds _cache_lock)"""
+    return (_table_versions[table], _stripe_versions[hash((table, key)) % _CACHE_STRIPES])
+
+def _cached(table, key, load):
+    """Return the cached row for (table, key), calling load() on a miss"""
+    if not CACHE_ENABLED:
+        return load()
+    
+    with _cache_lock:
+        version = _cache_version(table, key)
+        entry = _cache.get((table, key))
+        if entry is not None and entry[0] == version:
+            _cache.move_to_end((table, key))
+            _cache_counters['hits'] += 1
+            return entry[1]
+        _cache_counters['misses'] += 1
+    
+    value = load()
+    # Missing rows are not cached: a later insert may create them
+    if value is not None:
+        with _cache_lock:
+            _cache[(table, key)] = (version, value)
+            _cache.move_to_end((table, key))
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+    return value
+
+def _invalidate(table, keys=None):
+    """Invalidate cached rows of a table: only the given keys, or all of them"""
+    _data_changed()
+    with _cache_lock:
+        if keys is None:
+            _table_versions[table] += 1
+            return
+        for key in keys:
+            _stripe_versions[hash((table, key)) % _CACHE_STRIPES] += 1
+
+def clear_cache():
+    """Drop every cached row"""
+    _data_changed()
+    with _cache_lock:
+        _cache.clear()
+        for table in _table_versions:
+            _table_versions[table] += 1
+
+def cache_stats():
+    """Get cache hit/miss counters"""
+    with _cache_lock:
+        hits = _cache_counters['hits']
+        misses = _cache_counters['misses']
+        size = len(_cache)
+    lookups = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'size': size,
+        'capacity': CACHE_SIZE,
+        'hit_rate': round(hits / lookups * 100, 1) if lookups else 0.0
+    }
+
+# Card change listeners, called with the ids of cards that were inserted,
+# deleted, moved to another deck or rescheduled, once the write is committed,
+# or with None when too many changed to list (see due_queue.py)
+_card_listeners = []
+
+def add_card_listener(listener):
+    """Register a function to call with a list of changed card ids"""
+    _card_listeners.append(listener)
+
+def _cards_changed(card_ids):
+    """Notify the card listeners about changed cards (None: any card may have changed)"""
+    if card_ids is None or card_ids:
+        _data_changed()
+        for listener in _card_listeners:
+            listener(card_ids)
+
+_EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+def local_day(epoch):
+    """Local calendar date of an epoch time, as days since 1970-01-01 (the unit of daily_rollups.day)"""
+    return datetime.fromtimestamp(epoch).toordinal() - _EPOCH_ORDINAL
+
+def day_to_date(day):
+    """datetime (local midnight) of a local_day() number"""
+    return datetime.fromordinal(day + _EPOCH_ORDINAL)
+
+def now_epoch():
+    """Current time as integer epoch seconds (the unit of cards.due_at)"""
+    return int(time.time())
+
+def to_epoch(timestamp):
+    """Convert a local 'YYYY-MM-DD HH:MM:SS' string or datetime to epoch seconds"""
+    if isinstance(timestamp, str):
+        timestamp = datetime.strptime(timestamp[:19], '%Y-%m-%d %H:%M:%S')
+    return int(timestamp.timestamp())
+
+def due_count_params():
+    """Named parameters for DECK_DUE_COUNT_SQL"""
+    now = now_epoch()
+    return {'today': now // SECONDS_PER_DAY, 'now': now}
+
+# Hot queries, shared with the query plan check below
+# Due count from the counters: whole-day buckets before today, plus an index
+# range count for the cards due so far today
+DECK_DUE_COUNT_SQL = '''
+    COALESCE((SELECT SUM(b.card_count) FROM deck_due_buckets b
+              WHERE b.deck_id = d.id AND b.due_day < :today), 0)
+    + (SELECT COUNT(*) FROM cards c
+       WHERE c.deck_id = d.id AND c.due_at >= :today * 86400 AND c.due_at <= :now)
+'''
+
+ALL_DECKS_SQL = f'''
+    SELECT d.id, d.name, d.created_at, COALESCE(dc.card_count, 0) as card_count,
+           {DECK_DUE_COUNT_SQL} as due_count
+    FROM decks d
+    LEFT JOIN deck_counters dc ON dc.deck_id = d.id
+    ORDER BY d.created_at DESC
+'''
+
+DECKS_SQL = '''
+    SELECT d.id, d.name, d.created_at, COALESCE(dc.card_count, 0) as card_count
+    FROM decks d
+    LEFT JOIN deck_counters dc ON dc.deck_id = d.id
+    ORDER BY d.created_at DESC
+'''
+
+# Card columns as the application reads them. next_review is derived from
+# due_at (local time, like the scheduler writes it), so bulk rescheduling
+# only has to move due_at.
+CARD_COLUMNS = '''
+    id, deck_id, question, answer, easiness_factor, interval, repetitions,
+    datetime(due_at, 'unixepoch', 'localtime') as next_review, created_at, due_at,
+    content_hash, stability, difficulty, last_review
+'''
+
+CARDS_BY_DECK_SQL = f'''
+    SELECT {CARD_COLUMNS} FROM cards WHERE deck_id = ?
+    ORDER BY created_at DESC
+'''
+
+# Keyset pagination: rows strictly after the (created_at, id) cursor
+CARDS_PAGE_SQL = f'''
+    SELECT {CARD_COLUMNS} FROM cards
+    WHERE deck_id = ? AND (created_at, id) < (?, ?)
+    ORDER BY created_at DESC, id DESC
+    LIMIT ?
+'''
+
+COUNT_DUE_CARDS_SQL = 'SELECT COUNT(*) FROM cards WHERE deck_id = ? AND due_at <= ?'
+
+DUE_CARDS_SQL = f'''
+    SELECT {CARD_COLUMNS} FROM cards
+    WHERE deck_id = ? AND due_at <= ?
+    ORDER BY due_at ASC
+'''
+
+# Reviews due per day across all decks (load balancing)
+DUE_LOAD_SQL = '''
+    SELECT due_day, SUM(card_count) FROM deck_due_buckets
+    WHERE due_day BETWEEN ? AND ?
+    GROUP BY due_day
+'''
+
+# name -> (sql, params, index the query must use)
+HOT_QUERIES = {
+    'get_all_decks': (ALL_DECKS_SQL, {'today': 0, 'now': 0}, 'idx_cards_deck_due'),
+    'get_cards_by_deck': (CARDS_BY_DECK_SQL, (1,), 'idx_cards_deck_created'),
+    'get_due_cards': (DUE_CARDS_SQL, (1, 0), 'idx_cards_deck_due'),
+    'get_cards_page': (CARDS_PAGE_SQL, (1, '', 0, 1), 'idx_cards_deck_created'),
+    'count_due_cards': (COUNT_DUE_CARDS_SQL, (1, 0), 'idx_cards_deck_due'),
+    'due_range': ('SELECT COUNT(*) FROM cards WHERE due_at >= ? AND due_at < ?', (0, 0), 'idx_cards_due'),
+    'due_load': (DUE_LOAD_SQL, (0, 0), 'idx_due_buckets_day'),
+}
+
+def explain_query_plan(sql, params=()):
+    """Get the EXPLAIN QUERY PLAN detail lines for a query"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+    plan = [row['detail'] for row in cursor.fetchall()]
+    conn.close()
+    return plan
+
+def check_query_plans():
+    """
+    Check that every hot query is served by its index
+
+    Returns:
+        dict: query name -> (ok, plan detail lines)
+    """
+    results = {}
+    for name, (sql, params, index_name) in HOT_QUERIES.items():
+        plan = explain_query_plan(sql, params)
+        ok = any('INDEX ' + index_name in line for line in plan)
+        results[name] = (ok, plan)
+    return results
+
 # Deck operations
 def create_deck(name):
     """Create a new deck"""
@@ -73,115 +1072,303 @@ def create_deck(name):
         cursor.execute('INSERT INTO decks (name) VALUES (?)', (name,))
         deck_id = cursor.lastrowid
         conn.commit()
+        _data_changed()
         return deck_id
     except sqlite3.IntegrityError:
         return None
     finally:
         conn.close()
 
-def get_all_decks():
-    """Get all decks with card counts"""
+def get_all_decks(with_due_counts=True):
+    """Get all decks with card counts (and due counts unless with_due_counts is False)"""
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute('''
-        SELECT d.id, d.name, d.created_at, COUNT(c.id) as card_count,
-               SUM(CASE WHEN c.next_review <= datetime('now') THEN 1 ELSE 0 END) as due_count
-        FROM decks d
-        LEFT JOIN cards c ON d.id = c.deck_id
-        GROUP BY d.id
-        ORDER BY d.created_at DESC
-    ''')
+    if with_due_counts:
+        cursor.execute(ALL_DECKS_SQL, due_count_params())
+    else:
+        cursor.execute(DECKS_SQL)
     decks = cursor.fetchall()
     conn.close()
     return decks
 
 def get_deck_by_id(deck_id):
-    """Get deck by ID"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM decks WHERE id = ?', (deck_id,))
-    deck = cursor.fetchone()
-    conn.close()
-    return deck
+    """Get deck by ID (cached)"""
+    def load():
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM decks WHERE id = ?', (deck_id,))
+        deck = cursor.fetchone()
+        conn.close()
+        return deck
+    return _cached('decks', deck_id, load)
 
 def delete_deck(deck_id):
     """Delete a deck and all its cards"""
     conn = get_connection()
     cursor = conn.cursor()
+    cursor.execute('SELECT id FROM cards WHERE deck_id = ?', (deck_id,))
+    card_ids = [row[0] for row in cursor.fetchall()]
     cursor.execute('DELETE FROM decks WHERE id = ?', (deck_id,))
     conn.commit()
     conn.close()
+    _invalidate('decks', [deck_id])
+    _invalidate('cards')
+    _cards_changed(card_ids)
 
 # Card operations
 def add_card(deck_id, question, answer):
-    """Add a new card to a deck"""
+    """Add a new card to a deck (returns None if the deck already has this card)"""
     conn = get_connection()
     cursor = conn.cursor()
     cursor.execute('''
-        INSERT INTO cards (deck_id, question, answer)
-        VALUES (?, ?, ?)
-    ''', (deck_id, question, answer))
-    card_id = cursor.lastrowid
+        INSERT INTO cards (deck_id, question, answer, due_at, content_hash)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (deck_id, content_hash) DO NOTHING
+    ''', (deck_id, question, answer, now_epoch(), content_hash(question, answer)))
+    card_id = cursor.lastrowid if cursor.rowcount else None
     conn.commit()
     conn.close()
+    if card_id:
+        _cards_changed([card_id])
     return card_id
 
-def add_cards_bulk(deck_id, cards_list):
-    """Add multiple cards to a deck"""
-    conn = get_connection()
+def _chunks(iterable, size):
+    """Yield lists of at most size items from any iterable"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# Conflict clauses for add_cards_bulk(on_duplicate=...)
+DUPLICATE_MODES = {
+    # Keep the existing card untouched
+    'skip': 'DO NOTHING',
+    # Keep the existing card and its review progress, take the new wording
+    'merge': 'DO UPDATE SET question = excluded.question, answer = excluded.answer',
+}
+
+
+# Bulk reads go through NumPy in chunks of this many rows, copied into
+# reused buffers, so no query result is ever held as a list of Python rows
+CHUNK_ROWS = 65536
+
+def iter_chunks(cursor, columns, chunk_rows=CHUNK_ROWS):
+    """
+    Yield an executed query's rows as float64 arrays of shape (rows, columns)
+    
+    The same buffer is reused for every chunk: copy out anything needed
+    before asking for the next one.
+    """
+    buffer = np.empty((chunk_rows, columns), dtype=np.float64)
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            return
+        chunk = buffer[:len(rows)]
+        chunk[:] = rows
+        yield chunk
+
+def raw_cursor(conn):
+    """Cursor returning plain tuples, which NumPy copies fastest"""
     cursor = conn.cursor()
-    for card in cards_list:
-        cursor.execute('''
-            INSERT INTO cards (deck_id, question, answer)
-            VALUES (?, ?, ?)
-        ''', (deck_id, card['question'], card['answer']))
-    conn.commit()
-    conn.close()
+    cursor.row_factory = None
+    return cursor
+
+def read_columns(cursor, dtypes, expected_rows=0):
+    """
+    Read an executed query into one NumPy array per column
+    
+    The arrays are allocated once for expected_rows (e.g. from deck_counters)
+    and filled chunk by chunk; they grow if more rows come and are cut to the
+    rows read. Integer columns must fit in a float64 exactly (< 2**53).
+    
+    Returns:
+        list: One array per column, of the given dtypes
+    """
+    columns = [np.empty(max(int(expected_rows), 1), dtype=dtype) for dtype in dtypes]
+    filled = 0
+    for chunk in iter_chunks(cursor, len(dtypes)):
+        end = filled + len(chunk)
+        if end > len(columns[0]):
+            columns = [np.resize(column, max(end, 2 * len(column))) for column in columns]
+        for column, values in zip(columns, chunk.T):
+            column[filled:end] = values
+        filled = end
+    return [column[:filled] for column in columns]
+
+def add_cards_bulk(deck_id, cards_list, on_duplicate='skip'):
+    """
+    Add multiple cards to a deck in a single transaction
+    
+    Cards whose normalized question and answer already exist in the deck (or
+    earlier in cards_list) are detected through the unique content hash index.
+    
+    Args:
+        deck_id: Deck to add the cards to
+        cards_list: Iterable of dicts with 'question' and 'answer' keys
+        on_duplicate: 'skip' to drop duplicates, 'merge' to update the existing
+                      card's text in place
+    
+    Returns:
+        list: IDs of the new cards, in insertion order (duplicates not included)
+    """
+    conflict = DUPLICATE_MODES[on_duplicate]
+    due_at = now_epoch()
+    with transaction() as conn:
+        cursor = conn.cursor()
+        # New AUTOINCREMENT ids are always above the current maximum, and the
+        # write lock keeps other inserts out until we commit
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM cards')
+        last_id = cursor.fetchone()[0]
+        for chunk in _chunks(cards_list, BULK_CHUNK_SIZE):
+            cursor.executemany(f'''
+                INSERT INTO cards (deck_id, question, answer, due_at, content_hash)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (deck_id, content_hash) {conflict}
+            ''', [(deck_id, card['question'], card['answer'], due_at,
+                   content_hash(card['question'], card['answer'])) for card in chunk])
+        cursor.execute('SELECT id FROM cards WHERE id > ? ORDER BY id', (last_id,))
+        new_ids = [row[0] for row in cursor.fetchall()]
+    if on_duplicate == 'merge':
+        _invalidate('cards')
+    _cards_changed(new_ids)
+    return new_ids
 
 def get_cards_by_deck(deck_id):
     """Get all cards in a deck"""
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute('''
-        SELECT * FROM cards WHERE deck_id = ?
-        ORDER BY created_at DESC
-    ''', (deck_id,))
+    cursor.execute(CARDS_BY_DECK_SQL, (deck_id,))
     cards = cursor.fetchall()
     conn.close()
     return cards
 
+def get_cards_page(deck_id, limit=CARDS_PAGE_SIZE, after=None):
+    """
+    Get one page of a deck's cards, newest first (keyset pagination)
+    
+    Args:
+        deck_id: Deck ID
+        limit: Maximum number of cards to return
+        after: (created_at, id) cursor of the previous page, None for the first page
+    
+    Returns:
+        tuple: (cards, next_cursor) - next_cursor is None on the last page
+    """
+    # Starting above every real (created_at, id) pair gives the first page
+    created_at, card_id = after if after else ('9999-12-31', 0)
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(CARDS_PAGE_SQL, (deck_id, created_at, card_id, limit + 1))
+    cards = cursor.fetchall()
+    conn.close()
+    
+    if len(cards) <= limit:
+        return cards, None
+    cards = cards[:limit]
+    return cards, (cards[-1]['created_at'], cards[-1]['id'])
+
+def count_cards(deck_id):
+    """Count the cards in a deck"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*) FROM cards WHERE deck_id = ?', (deck_id,))
+    count = cursor.fetchone()[0]
+    conn.close()
+    return count
+
+def count_due_cards(deck_id):
+    """Count the cards in a deck that are due for review"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(COUNT_DUE_CARDS_SQL, (deck_id, now_epoch()))
+    count = cursor.fetchone()[0]
+    conn.close()
+    return count
+
 def get_due_cards(deck_id):
     """Get cards that are due for review"""
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute('''
-        SELECT * FROM cards
-        WHERE deck_id = ? AND next_review <= datetime('now')
-        ORDER BY next_review ASC
-    ''', (deck_id,))
+    cursor.execute(DUE_CARDS_SQL, (deck_id, now_epoch()))
     cards = cursor.fetchall()
     conn.close()
     return cards
 
 def get_card_by_id(card_id):
-    """Get a card by ID"""
+    """Get a card by ID (cached)"""
+    def load():
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT {CARD_COLUMNS} FROM cards WHERE id = ?', (card_id,))
+        card = cursor.fetchone()
+        conn.close()
+        return card
+    return _cached('cards', card_id, load)
+
+def get_cards_by_ids(card_ids):
+    """Get many cards by ID, in the order given (missing cards are skipped)"""
+    cards = {}
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM cards WHERE id = ?', (card_id,))
-    card = cursor.fetchone()
+    for chunk in _chunks(card_ids, 500):
+        cursor.execute(f'SELECT {CARD_COLUMNS} FROM cards WHERE id IN ({",".join("?" * len(chunk))})', chunk)
+        cards.update((card['id'], card) for card in cursor.fetchall())
     conn.close()
-    return card
+    return [cards[card_id] for card_id in card_ids if card_id in cards]
+
+def get_due_entries(card_ids=None):
+    """
+    (card_id, deck_id, due_at) of the given cards, or of every card
+    
+    Returns:
+        list: Tuples for the cards that exist
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    if card_ids is None:
+        cursor.execute('SELECT id, deck_id, due_at FROM cards')
+        entries = cursor.fetchall()
+    else:
+        entries = []
+        for chunk in _chunks(card_ids, 500):
+            cursor.execute(f'SELECT id, deck_id, due_at FROM cards WHERE id IN ({",".join("?" * len(chunk))})',
+                           chunk)
+            entries.extend(cursor.fetchall())
+    conn.close()
+    return [tuple(entry) for entry in entries]
+
+def _unique_hash_sql(deck_sql, hash_sql):
+    """
+    SQL for the content_hash of an updated card: NULL (not deduplicated) if
+    another card in the target deck already has it, so edits and moves never
+    violate the unique index
+    """
+    return f'''
+        CASE WHEN EXISTS (
+            SELECT 1 FROM cards other
+            WHERE other.deck_id = {deck_sql} AND other.content_hash = {hash_sql} AND other.id != cards.id
+        ) THEN NULL ELSE {hash_sql} END
+    '''
 
 def update_card(card_id, question, answer):
     """Update a card's question and answer"""
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE cards SET question = ?, answer = ?
-        WHERE id = ?
-    ''', (question, answer, card_id))
+    cursor.execute(f'''
+        UPDATE cards
+        SET question = :question, answer = :answer,
+            content_hash = {_unique_hash_sql('cards.deck_id', ':hash')}
+        WHERE id = :card_id
+    ''', {'question': question, 'answer': answer,
+          'hash': content_hash(question, answer), 'card_id': card_id})
     conn.commit()
     conn.close()
+    _invalidate('cards', [card_id])
 
 def delete_card(card_id):
     """Delete a card"""
@@ -190,37 +1377,846 @@ def delete_card(card_id):
     cursor.execute('DELETE FROM cards WHERE id = ?', (card_id,))
     conn.commit()
     conn.close()
+    _invalidate('cards', [card_id])
+    _cards_changed([card_id])
 
-def update_card_review(card_id, easiness_factor, interval, repetitions, next_review):
-    """Update card's SM-2 parameters after review"""
+def update_card_review(card_id, easiness_factor, interval, repetitions, next_review, due_at=None):
+    """Update card's SM-2 parameters after review (due_at defaults to next_review in epoch seconds)"""
+    if due_at is None:
+        due_at = to_epoch(next_review)
     conn = get_connection()
     cursor = conn.cursor()
     cursor.execute('''
         UPDATE cards
-        SET easiness_factor = ?, interval = ?, repetitions = ?, next_review = ?
+        SET easiness_factor = ?, interval = ?, repetitions = ?, next_review = ?, due_at = ?,
+            last_review = ?
         WHERE id = ?
-    ''', (easiness_factor, interval, repetitions, next_review, card_id))
+    ''', (easiness_factor, interval, repetitions, next_review, due_at, now_epoch(), card_id))
     conn.commit()
     conn.close()
+    _invalidate('cards', [card_id])
+    _cards_changed([card_id])
 
-# Settings operations
-def get_settings():
-    """Get application settings"""
+def bulk_update_card_review(reviews):
+    """
+    Update SM-2 parameters of many cards in a single transaction
+    
+    Args:
+        reviews: Iterable of (card_id, easiness_factor, interval, repetitions,
+                 next_review[, due_at]) tuples, as for update_card_review()
+    
+    Returns:
+        int: Number of cards updated
+    """
+    card_ids = []
+    reviewed_at = now_epoch()
+    def rows(chunk):
+        for review in chunk:
+            card_id, easiness_factor, interval, repetitions, next_review = review[:5]
+            card_ids.append(card_id)
+            due_at = review[5] if len(review) > 5 and review[5] is not None else to_epoch(next_review)
+            yield (easiness_factor, interval, repetitions, next_review, due_at, reviewed_at, card_id)
+    
+    updated = 0
+    with transaction() as conn:
+        cursor = conn.cursor()
+        for chunk in _chunks(reviews, BULK_CHUNK_SIZE):
+            cursor.executemany('''
+                UPDATE cards
+                SET easiness_factor = ?, interval = ?, repetitions = ?, next_review = ?, due_at = ?,
+                    last_review = ?
+                WHERE id = ?
+            ''', rows(chunk))
+            updated += cursor.rowcount
+    _invalidate('cards')
+    _cards_changed(card_ids)
+    return updated
+
+def bulk_delete_cards(card_ids):
+    """Delete many cards in a single transaction, returns the number deleted"""
+    card_ids = list(card_ids)
+    deleted = 0
+    with transaction() as conn:
+        cursor = conn.cursor()
+        for chunk in _chunks(card_ids, BULK_CHUNK_SIZE):
+            cursor.executemany('DELETE FROM cards WHERE id = ?', [(card_id,) for card_id in chunk])
+            deleted += cursor.rowcount
+    _invalidate('cards')
+    _cards_changed(card_ids)
+    return deleted
+
+def bulk_move_cards(card_ids, deck_id):
+    """Move many cards to another deck in a single transaction, returns the number moved"""
+    card_ids = list(card_ids)
+    moved = 0
+    with transaction() as conn:
+        cursor = conn.cursor()
+        for chunk in _chunks(card_ids, BULK_CHUNK_SIZE):
+            cursor.executemany(f'''
+                UPDATE cards
+                SET deck_id = :deck_id,
+                    content_hash = {_unique_hash_sql(':deck_id', 'cards.content_hash')}
+                WHERE id = :card_id
+            ''', [{'deck_id': deck_id, 'card_id': card_id} for card_id in chunk])
+            moved += cursor.rowcount
+    _invalidate('cards')
+    _cards_changed(card_ids)
+    return moved
+
+def record_reviews(reviews):
+    """
+    Apply a batch of reviews: update each card, append to review_log and
+    add to daily_rollups, all in one transaction
+    
+    Args:
+        reviews: List of dicts with card_id, deck_id, reviewed_at (epoch seconds),
+                 rating (quality 0-3), old_ef, new_ef, old_interval, new_interval,
+                 repetitions, next_review, due_at, stability and difficulty (None
+                 under SM-2) and latency_ms (may be None)
+    """
+    if not reviews:
+        return
+    with transaction() as conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            UPDATE cards
+            SET easiness_factor = :new_ef, interval = :new_interval, repetitions = :repetitions,
+                next_review = :next_review, due_at = :due_at, last_review = :reviewed_at,
+                stability = :stability, difficulty = :difficulty
+            WHERE id = :card_id
+        ''', reviews)
+        cursor.executemany('''
+            INSERT INTO review_log (card_id, deck_id, reviewed_at, rating, old_ef, new_ef,
+                                    old_interval, new_interval, latency_ms)
+            VALUES (:card_id, :deck_id, :reviewed_at, :rating, :old_ef, :new_ef,
+                    :old_interval, :new_interval, :latency_ms)
+        ''', reviews)
+        cursor.executemany(DAILY_ROLLUP_UPSERT_SQL, _rollup_rows(reviews))
+    card_ids = [review['card_id'] for review in reviews]
+    _invalidate('cards', card_ids)
+    _cards_changed(card_ids)
+
+def _rollup_rows(reviews):
+    """Sum a batch of reviews into daily_rollups rows, one per (local day, deck)"""
+    rollups = {}
+    for review in reviews:
+        key = (local_day(review['reviewed_at']), review['deck_id'])
+        row = rollups.setdefault(key, [0] * 7)
+        row[0] += 1
+        row[1 + review['rating']] += 1
+        row[5] += review['old_interval'] == 0
+        row[6] += min(review['latency_ms'] or 0, MAX_REVIEW_TIME_MS)
+    return [key + tuple(row) for key, row in rollups.items()]
+
+def rebuild_daily_rollups():
+    """Recompute daily_rollups from review_log"""
+    with transaction() as conn:
+        conn.execute('DELETE FROM daily_rollups')
+        for statement in DAILY_ROLLUPS_REBUILD:
+            conn.execute(statement)
+    _data_changed()
+
+def get_daily_rollups(first_day, last_day, deck_id=None):
+    """
+    Review activity per day, summed over decks unless deck_id is given
+    
+    Args:
+        first_day, last_day: Inclusive range of local_day() numbers
+    
+    Returns:
+        list: (day, reviews, again, hard, good, easy, new_cards, time_ms) tuples
+              for the days with any reviews
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT day, SUM(reviews), SUM(again_count), SUM(hard_count), SUM(good_count),
+               SUM(easy_count), SUM(new_cards), SUM(time_ms)
+        FROM daily_rollups
+        WHERE day BETWEEN ? AND ? {'AND deck_id = ?' if deck_id else ''}
+        GROUP BY day
+    ''', (first_day, last_day, deck_id) if deck_id else (first_day, last_day))
+    rows = [tuple(row) for row in cursor.fetchall()]
+    conn.close()
+    return rows
+
+def get_review_history():
+    """
+    The whole review log as NumPy arrays, sorted by card and then time
+    
+    Returns:
+        tuple: (card_ids, reviewed_at, ratings) arrays
+    """
+    conn = get_connection()
+    cursor = raw_cursor(conn)
+    cursor.execute('SELECT COUNT(*) FROM review_log')
+    count = cursor.fetchone()[0]
+    cursor.execute('SELECT card_id, reviewed_at, rating FROM review_log ORDER BY card_id, reviewed_at')
+    card_ids, reviewed_at, ratings = read_columns(cursor, (np.int64,) * 3, count)
+    conn.close()
+    return card_ids, reviewed_at, ratings
+
+# Search
+# Markers wrapped around matched terms in search snippets
+SNIPPET_START = '\x02'
+SNIPPET_END = '\x03'
+
+SEARCH_PAGE_SIZE = 20
+
+def _fts_query(text, deck_id=None):
+    """
+    Turn free text into an FTS5 query: every word must match the question or
+    answer, last word as a prefix, and the deck token must match when deck_id is given
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    query = f'{{question answer}} : ({" ".join(terms)})'
+    if deck_id:
+        query += f' AND deck : "{FTS_DECK_TOKEN}{int(deck_id)}"'
+    return query
+
+def search_cards(text, deck_id=None, limit=SEARCH_PAGE_SIZE, after=None):
+    """
+    Full-text search over card questions and answers, best matches first
+    (keyset pagination)
+    
+    Args:
+        text: Free-text query
+        deck_id: Restrict to one deck (None searches all decks)
+        limit: Page size
+        after: (rank, id) cursor of the previous page, None for the first page
+    
+    Returns:
+        tuple: (results, next_cursor) - results are dicts with id, deck_id, deck_name,
+               rank, question and answer snippets (matches wrapped in
+               SNIPPET_START/END); next_cursor is None on the last page
+    """
+    query = _fts_query(text, deck_id)
+    if query is None:
+        return [], None
+    
+    # Starting below every real (rank, id) pair gives the first page
+    rank, card_id = after if after else (float('-inf'), 0)
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT c.id, c.deck_id, d.name as deck_name, cards_fts.rank as rank,
+               snippet(cards_fts, 0, ?, ?, '…', 24) as question,
+               snippet(cards_fts, 1, ?, ?, '…', 24) as answer
+        FROM cards_fts
+        JOIN cards c ON c.id = cards_fts.rowid
+        JOIN decks d ON d.id = c.deck_id
+        WHERE cards_fts MATCH ? AND (cards_fts.rank, cards_fts.rowid) > (?, ?)
+        ORDER BY cards_fts.rank, cards_fts.rowid
+        LIMIT ?
+    ''', (SNIPPET_START, SNIPPET_END, SNIPPET_START, SNIPPET_END,
+          query, rank, card_id, limit + 1))
+    results = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    
+    if len(results) <= limit:
+        return results, None
+    results = results[:limit]
+    return results, (results[-1]['rank'], results[-1]['id'])
+
+# Counter maintenance
+def check_deck_counters():
+    """
+    Compare deck_counters/deck_due_buckets with a full aggregate over cards
+    
+    Returns:
+        list: IDs of decks whose counters are out of date
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT d.id
+        FROM decks d
+        LEFT JOIN deck_counters dc ON dc.deck_id = d.id
+        LEFT JOIN (
+            SELECT deck_id, COUNT(*) as card_count, SUM(repetitions > 0) as studied_count,
+                   TOTAL(easiness_factor) as sum_ef, SUM(repetitions) as total_reviews
+            FROM cards GROUP BY deck_id
+        ) c ON c.deck_id = d.id
+        WHERE COALESCE(dc.card_count, 0) != COALESCE(c.card_count, 0)
+           OR COALESCE(dc.studied_count, 0) != COALESCE(c.studied_count, 0)
+           OR COALESCE(dc.total_reviews, 0) != COALESCE(c.total_reviews, 0)
+           OR ABS(COALESCE(dc.sum_ef, 0) - COALESCE(c.sum_ef, 0)) > 1e-6
+        UNION
+        SELECT deck_id FROM (
+            SELECT deck_id, due_day, SUM(n) as diff FROM (
+                SELECT deck_id, due_day, card_count as n FROM deck_due_buckets
+                UNION ALL
+                SELECT deck_id, due_at / {SECONDS_PER_DAY}, -1 FROM cards
+            ) GROUP BY deck_id, due_day
+        ) WHERE diff != 0 AND deck_id IN (SELECT id FROM decks)
+    """)
+    stale = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return stale
+
+def rebuild_deck_counters():
+    """Recompute deck_counters and deck_due_buckets from the cards table"""
+    with transaction() as conn:
+        conn.execute('DELETE FROM deck_counters')
+        conn.execute('DELETE FROM deck_due_buckets')
+        for statement in DECK_COUNTERS_REBUILD:
+            conn.execute(statement)
+    _data_changed()
+
+def check_analytics_snapshot():
+    """
+    Compare analytics_moments/analytics_histogram with a full aggregate over cards
+    
+    Returns:
+        list: IDs of decks whose analytics snapshot is out of date
+    """
+    names = list(_analytics_terms('cards'))
+    conn = get_connection()
+    cursor = conn.cursor()
+    # Sums drift by float rounding as cards change, so compare them relatively
+    cursor.execute(f"""
+        SELECT d.id
+        FROM decks d
+        LEFT JOIN analytics_moments am ON am.deck_id = d.id
+        LEFT JOIN ({ANALYTICS_MOMENTS_SQL}) c ON c.deck_id = d.id
+        WHERE {' OR '.join(f'ABS(COALESCE(am.{name}, 0) - COALESCE(c.{name}, 0)) > '
+                           f'1e-6 * MAX(1, ABS(COALESCE(c.{name}, 0)))' for name in names)}
+        UNION
+        SELECT deck_id FROM (
+            SELECT deck_id, kind, bucket, SUM(n) as diff FROM (
+                SELECT deck_id, kind, bucket, card_count as n FROM analytics_histogram
+                UNION ALL
+                SELECT deck_id, kind, bucket, -card_count FROM ({ANALYTICS_HISTOGRAM_SQL})
+            ) GROUP BY deck_id, kind, bucket
+        ) WHERE diff != 0 AND deck_id IN (SELECT id FROM decks)
+    """)
+    stale = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return stale
+
+def rebuild_analytics_snapshot():
+    """Recompute analytics_moments and analytics_histogram from the cards table"""
+    with transaction() as conn:
+        conn.execute('DELETE FROM analytics_moments')
+        conn.execute('DELETE FROM analytics_histogram')
+        for statement in ANALYTICS_SNAPSHOT_REBUILD:
+            conn.execute(statement)
+    _data_changed()
+
+# Load balancing
+def get_due_load(first_day, last_day):
+    """
+    Reviews due per day across all decks, from deck_due_buckets
+    
+    Args:
+        first_day, last_day: Inclusive range of day numbers (days since the Unix epoch)
+    
+    Returns:
+        dict: Day number -> number of cards due that day (days without cards are absent)
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(DUE_LOAD_SQL, (first_day, last_day))
+    loads = dict(cursor.fetchall())
+    conn.close()
+    return loads
+
+def rebalance_due_dates(deck_id=None):
+    """
+    Spread already-scheduled reviews over quieter days in one pass
+    
+    Every future review is moved to the least-loaded day within its fuzz
+    window (see spaced_repetition.fuzz_window); the interval moves with it.
+    Overdue and today's reviews are left alone.
+    
+    Args:
+        deck_id: Only move this deck's cards (load is still counted across all decks)
+    
+    Returns:
+        int: Number of cards moved
+    """
+    today = now_epoch() // SECONDS_PER_DAY
+    with transaction() as conn:
+        cursor = raw_cursor(conn)
+        deck_sql = 'AND deck_id = ?' if deck_id else ''
+        deck_params = (deck_id,) if deck_id else ()
+        # The future due buckets bound the number of cards read; when that is
+        # most of the cards, a table scan beats looking each up from the index
+        cursor.execute(f'''
+            SELECT TOTAL(CASE WHEN due_day > ? THEN card_count END), TOTAL(card_count)
+            FROM deck_due_buckets WHERE 1 {deck_sql}
+        ''', (today,) + deck_params)
+        expected, total = cursor.fetchone()
+        scan = 'NOT INDEXED' if expected >= SCAN_SHARE * total else ''
+        cursor.execute(f'''
+            SELECT id, interval, due_at / 86400 FROM cards {scan}
+            WHERE due_at >= ? AND interval >= ? {deck_sql}
+        ''', ((today + 1) * SECONDS_PER_DAY, sr.LOAD_BALANCE_MIN_INTERVAL) + deck_params)
+        card_ids, intervals, due_days = read_columns(cursor, (np.int64,) * 3, expected)
+        if len(card_ids) == 0:
+            return 0
+        
+        first_day = today + 1
+        last_day = int(due_days.max()) + sr.LOAD_BALANCE_MAX_FUZZ
+        day_loads = np.zeros(last_day - first_day + 1, dtype=np.int64)
+        cursor.execute(DUE_LOAD_SQL, (first_day, last_day))
+        for day, count in cursor.fetchall():
+            day_loads[day - first_day] = count
+        
+        new_days = sr.balance_due_days(due_days, intervals, day_loads, first_day, first_day)
+        moved = np.flatnonzero(new_days != due_days)
+        shifts = list(zip((new_days[moved] - due_days[moved]).tolist(), card_ids[moved].tolist()))
+        for chunk in _chunks(shifts, BULK_CHUNK_SIZE):
+            cursor.executemany('''
+                UPDATE cards
+                SET interval = interval + ?1, due_at = due_at + ?1 * 86400, next_review = NULL
+                WHERE id = ?2
+            ''', chunk)
+    
+    _invalidate('cards')
+    _cards_changed([card_id for _, card_id in shifts])
+    return len(shifts)
+
+# Bulk rescheduling. Each operation is a single UPDATE over the selected
+# cards, run with the per-row UPDATE triggers switched off (see bulk_update):
+# the aggregates it changes are moved or recounted afterwards, in the same
+# transaction. next_review is cleared - card reads derive it from due_at.
+# What remains is SQLite rewriting the rows and their due_at index entries.
+
+# Time allowed per operation over BENCHMARK_CARDS cards in one deck (check.py
+# and benchmark-reschedule time them with benchmark_reschedule())
+RESCHEDULE_SECONDS = 1.0
+BENCHMARK_CARDS = 100000
+
+# Operations over more cards than this tell the card listeners that any card
+# may have changed (None) instead of returning every id
+LISTED_CHANGES_LIMIT = 20000
+
+# Recount a deck by scanning the cards table when it holds at least this
+# share of all cards (rather than random row lookups through a deck index)
+SCAN_SHARE = 0.5
+
+# Aggregates an operation can recount: ((table, extra condition), ...) to
+# clear for the deck, and the rebuild statements refilling them
+RECOUNTS = {
+    'due': ((('deck_due_buckets', ''),), DECK_COUNTERS_REBUILD[1:]),
+    'intervals': ((('analytics_moments', ''), ('analytics_histogram', "kind = 'interval'")), [
+        ANALYTICS_SNAPSHOT_REBUILD[0],
+        f'''
+            INSERT INTO analytics_histogram (deck_id, kind, bucket, card_count)
+            {ANALYTICS_HISTOGRAM_QUERIES['interval']}
+        ''',
+    ]),
+}
+
+# Card fields reset_deck() sets, as counted in the aggregates
+RESET_CARD = (('easiness_factor', 2.5), ('interval', 0), ('repetitions', 0))
+
+# A reset deck as a one-row 'cards' relation carrying its card_count
+RESET_CARDS_SQL = f'''
+    (SELECT deck_id, card_count, {', '.join(f'{value!r} as {column}' for column, value in RESET_CARD)}
+     FROM deck_counters WHERE deck_id = :deck_id AND card_count > 0) AS cards
+'''
+
+def _recount(cursor, group, deck_id=None, scan=False):
+    """
+    Recount one RECOUNTS group of aggregates for a deck (or every deck)
+    
+    With scan set, a deck's cards are read by scanning the table rather than
+    through a deck_id index.
+    """
+    tables, statements = RECOUNTS[group]
+    for table, condition in tables:
+        where = ' AND '.join(filter(None, ('deck_id = ?' if deck_id else '', condition)))
+        cursor.execute(f'DELETE FROM {table}' + (f' WHERE {where}' if where else ''),
+                       (deck_id,) if deck_id else ())
+    for statement in statements:
+        if deck_id:
+            parameters = (deck_id,) * statement.count(ALL_DECKS_FILTER)
+            statement = statement.replace(ALL_DECKS_FILTER, 'deck_id = ?')
+            if scan:
+                statement = statement.replace('FROM cards WHERE', 'FROM cards NOT INDEXED WHERE')
+            cursor.execute(statement, parameters)
+        else:
+            cursor.execute(statement)
+
+def _scope_size(cursor, deck_id):
+    """(cards in the deck or collection, whether that is SCAN_SHARE of all cards)"""
+    cursor.execute('''
+        SELECT TOTAL(card_count), TOTAL(CASE WHEN deck_id = ? THEN card_count END)
+        FROM deck_counters
+    ''', (deck_id,))
+    total, in_deck = cursor.fetchone()
+    if not deck_id:
+        return int(total), True
+    return int(in_deck), in_deck >= SCAN_SHARE * total
+
+def _reschedule(sql, params, deck_id=None, aggregates=None, conn=None):
+    """
+    Run a rescheduling UPDATE in one transaction, per-row triggers off
+    
+    The statement's WHERE clause ends in {deck_filter}, which becomes
+    'AND cards.deck_id = :deck_id' when deck_id is given, and the statement
+    ends in {returning}.
+    
+    Args:
+        aggregates: Function (cursor, deck_id, scan) bringing the aggregates
+                    the statement changed up to date
+        conn: Run on this connection instead of the application database
+              (no cache invalidation or card listeners)
+    
+    Returns:
+        int: Number of cards changed
+    """
+    params = dict(params, deck_id=deck_id)
+    deck_filter = 'AND cards.deck_id = :deck_id' if deck_id else ''
+    with transaction(conn) as write_conn:
+        cursor = write_conn.cursor()
+        cards, scan = _scope_size(cursor, deck_id)
+        listed = cards <= LISTED_CHANGES_LIMIT
+        cursor.execute('INSERT INTO bulk_update (active) VALUES (1)')
+        cursor.execute(sql.format(deck_filter=deck_filter,
+                                  returning='RETURNING cards.id' if listed else ''), params)
+        if listed:
+            card_ids = [row[0] for row in cursor.fetchall()]
+            count = len(card_ids)
+        else:
+            count = cursor.rowcount
+            card_ids = None if count else []
+        if aggregates and count:
+            aggregates(cursor, deck_id, scan)
+        cursor.execute('DELETE FROM bulk_update')
+    if conn is None:
+        _invalidate('cards')
+        _cards_changed(card_ids)
+    return count
+
+def shift_due_dates(days, deck_id=None, conn=None):
+    """
+    Move every card's due date by a number of days (e.g. after a vacation)
+    
+    Args:
+        days: Days to shift by (negative moves reviews earlier)
+        deck_id: Only this deck's cards (None for the whole collection)
+        conn: Connection to run on (default: the application database)
+    
+    Returns:
+        int: Number of cards moved
+    """
+    days = int(days)
+    
+    def move_due_buckets(cursor, deck_id, scan):
+        cursor.execute(f'''
+            DELETE FROM deck_due_buckets {'WHERE deck_id = ?' if deck_id else ''}
+            RETURNING deck_id, due_day, card_count
+        ''', (deck_id,) if deck_id else ())
+        buckets = cursor.fetchall()
+        cursor.executemany('INSERT INTO deck_due_buckets (deck_id, due_day, card_count) VALUES (?, ?, ?)',
+                           [(bucket_deck, due_day + days, count) for bucket_deck, due_day, count in buckets])
+    
+    return _reschedule('''
+        UPDATE cards
+        SET due_at = due_at + :days * 86400, next_review = NULL
+        WHERE 1 {deck_filter}
+        {returning}
+    ''', {'days': days}, deck_id, move_due_buckets, conn)
+
+def spread_overdue(days, deck_id=None, conn=None):
+    """
+    Spread the overdue backlog evenly over the next days
+    
+    Overdue cards keep their order: the most overdue stay due today, the
+    rest are assigned to the following days in equal shares.
+    
+    Args:
+        days: Number of days to spread over (today included)
+        deck_id: Only this deck's cards (None for the whole collection)
+        conn: Connection to run on (default: the application database)
+    
+    Returns:
+        int: Number of overdue cards rescheduled
+    """
+    days = max(int(days), 1)
+    now = now_epoch()
+    last_day = now // SECONDS_PER_DAY + days - 1
+    
+    def recount_spread_days(cursor, deck_id, scan):
+        # Only buckets up to the last day spread over change; the cards due
+        # by then are a range of the due_at indexes
+        deck_filter = 'AND deck_id = :deck_id' if deck_id else ''
+        params = {'deck_id': deck_id, 'last_day': last_day}
+        cursor.execute(f'DELETE FROM deck_due_buckets WHERE due_day <= :last_day {deck_filter}', params)
+        cursor.execute(f'''
+            INSERT INTO deck_due_buckets (deck_id, due_day, card_count)
+            SELECT deck_id, due_at / 86400, COUNT(*) FROM cards
+            WHERE due_at < (:last_day + 1) * 86400 {deck_filter}
+            GROUP BY deck_id, due_at / 86400
+        ''', params)
+    
+    return _reschedule('''
+        WITH backlog AS (
+            SELECT id, (ROW_NUMBER() OVER (ORDER BY due_at, id) - 1) * :days / COUNT(*) OVER () AS day
+            FROM cards
+            WHERE due_at <= :now {deck_filter}
+        )
+        UPDATE cards
+        SET due_at = :now + backlog.day * 86400, next_review = NULL
+        FROM backlog
+        WHERE cards.id = backlog.id
+        {returning}
+    ''', {'days': days, 'now': now}, deck_id, recount_spread_days, conn)
+
+def reset_deck(deck_id, conn=None):
+    """
+    Forget a deck's review progress: every card becomes new and due now
+    (the review log is kept)
+    
+    Args:
+        conn: Connection to run on (default: the application database)
+    
+    Returns:
+        int: Number of cards reset
+    """
+    now = now_epoch()
+    
+    def count_reset_cards(cursor, deck_id, scan):
+        # Every card is now the same, so each aggregate is card_count times
+        # one reset card
+        params = {'deck_id': deck_id, 'now': now}
+        terms = _analytics_terms('cards')
+        for table in ('deck_due_buckets', 'analytics_moments', 'analytics_histogram'):
+            cursor.execute(f'DELETE FROM {table} WHERE deck_id = :deck_id', params)
+        cursor.execute(f'''
+            INSERT INTO deck_due_buckets (deck_id, due_day, card_count)
+            SELECT deck_id, :now / 86400, card_count FROM {RESET_CARDS_SQL}
+        ''', params)
+        cursor.execute(f'''
+            INSERT INTO analytics_moments (deck_id, {', '.join(terms)})
+            SELECT deck_id, {', '.join(f'card_count * {term}' for term in terms.values())}
+            FROM {RESET_CARDS_SQL}
+        ''', params)
+        for kind, bucket in _analytics_buckets('cards').items():
+            cursor.execute(f'''
+                INSERT INTO analytics_histogram (deck_id, kind, bucket, card_count)
+                SELECT deck_id, '{kind}', {bucket}, card_count FROM {RESET_CARDS_SQL}
+                {'WHERE repetitions > 0' if kind == 'easiness' else ''}
+            ''', params)
+        cursor.execute(f'''
+            UPDATE deck_counters SET
+                studied_count = card_count * (cards.repetitions > 0),
+                sum_ef = card_count * cards.easiness_factor,
+                total_reviews = card_count * cards.repetitions
+            FROM (SELECT {', '.join(f'{value!r} as {column}' for column, value in RESET_CARD)}) AS cards
+            WHERE deck_id = :deck_id
+        ''', params)
+    
+    return _reschedule(f'''
+        UPDATE cards
+        SET {', '.join(f'{column} = {value!r}' for column, value in RESET_CARD)},
+            stability = NULL, difficulty = NULL, last_review = NULL, due_at = :now, next_review = NULL
+        WHERE 1 {{deck_filter}}
+        {{returning}}
+    ''', {'now': now}, deck_id, count_reset_cards, conn)
+
+# New interval of scale_intervals(), at least one day
+SCALED_INTERVAL_SQL = 'MAX(1, CAST(ROUND(cards.interval * :factor) AS INTEGER))'
+
+def scale_intervals(factor, deck_id=None, conn=None):
+    """
+    Multiply the interval of every reviewed card, keeping its last review date
+    
+    Args:
+        factor: Interval multiplier (e.g. 0.8 for more reviews, 1.5 for fewer)
+        deck_id: Only this deck's cards (None for the whole collection)
+        conn: Connection to run on (default: the application database)
+    
+    Returns:
+        int: Number of cards rescheduled
+    """
+    def recount(cursor, deck_id, scan):
+        _recount(cursor, 'due', deck_id, scan)
+        _recount(cursor, 'intervals', deck_id, scan)
+    
+    # The scaled interval is computed once per card, in the row-value subquery
+    return _reschedule(f'''
+        UPDATE cards
+        SET (interval, due_at, next_review) = (
+            SELECT scaled, cards.due_at + (scaled - cards.interval) * 86400, NULL
+            FROM (SELECT {SCALED_INTERVAL_SQL} AS scaled)
+        )
+        WHERE repetitions > 0 AND interval > 0 {{deck_filter}}
+        {{returning}}
+    ''', {'factor': float(factor)}, deck_id, recount, conn)
+
+def benchmark_reschedule(card_count=BENCHMARK_CARDS, path=None):
+    """
+    Time every bulk rescheduling operation on a scratch database
+    
+    Builds a database at path (default: a temporary file) with one deck of
+    card_count reviewed cards and runs each operation on it once, through
+    its own connection; the application database is never touched.
+    
+    Returns:
+        dict: Operation name -> seconds
+    """
+    timings = {}
+    with tempfile.TemporaryDirectory() as directory:
+        conn = _open_connection(path or os.path.join(directory, 'benchmark.db'))
+        try:
+            _create_schema(conn)
+            now = now_epoch()
+            with transaction(conn):
+                deck_id = conn.execute("INSERT INTO decks (name) VALUES ('Benchmark')").lastrowid
+                conn.execute('''
+                    WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :count)
+                    INSERT INTO cards (deck_id, question, answer, content_hash, easiness_factor,
+                                       interval, repetitions, due_at)
+                    SELECT :deck_id, 'Question ' || i, 'Answer ' || i, 'benchmark' || i,
+                           1.3 + i % 170 / 100.0, 1 + i % 300, 1 + i % 8,
+                           :now + (i % 400 - 30) * 86400
+                    FROM n
+                ''', {'count': card_count, 'deck_id': deck_id, 'now': now})
+            operations = [
+                ('shift_due_dates', lambda: shift_due_dates(3, deck_id, conn)),
+                ('spread_overdue', lambda: spread_overdue(7, deck_id, conn)),
+                ('scale_intervals', lambda: scale_intervals(1.2, deck_id, conn)),
+                ('reset_deck', lambda: reset_deck(deck_id, conn))
+            ]
+            for name, operation in operations:
+                start = time.perf_counter()
+                operation()
+                timings[name] = time.perf_counter() - start
+        finally:
+            conn.close()
+    return timings
+
+# Schedulers
+def set_deck_scheduler(deck_id, scheduler):
+    """Choose the scheduler a deck's cards are reviewed with"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('UPDATE decks SET scheduler = ? WHERE id = ?', (scheduler, deck_id))
+    conn.commit()
+    conn.close()
+    _invalidate('decks', [deck_id])
+
+def get_scheduler_params(name):
+    """
+    Fitted parameters of a scheduler (cached)
+    
+    Returns:
+        dict: params (list), review_count, log_loss and updated_at, or None if never fitted
+    """
+    def load():
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM scheduler_params WHERE name = ?', (name,))
+        row = cursor.fetchone()
+        conn.close()
+        if row is None:
+            return None
+        fitted = dict(row)
+        fitted['params'] = json.loads(fitted['params'])
+        return fitted
+    return _cached('scheduler_params', name, load)
+
+def save_scheduler_params(name, params, review_count, log_loss):
+    """Store fitted scheduler parameters"""
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM settings WHERE id = 1')
-    settings = cursor.fetchone()
+    cursor.execute('''
+        INSERT INTO scheduler_params (name, params, review_count, log_loss, updated_at)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (name) DO UPDATE SET
+            params = excluded.params, review_count = excluded.review_count,
+            log_loss = excluded.log_loss, updated_at = excluded.updated_at
+    ''', (name, json.dumps(params), review_count, log_loss))
+    conn.commit()
     conn.close()
-    return settings
+    _invalidate('scheduler_params', [name])
 
-def update_settings(api_provider, api_key, hotkey_again, hotkey_hard, hotkey_good, hotkey_easy):
+# Settings operations
+def get_settings():
+    """Get application settings (cached)"""
+    def load():
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM settings WHERE id = 1')
+        settings = cursor.fetchone()
+        conn.close()
+        return settings
+    return _cached('settings', 1, load)
+
+def update_settings(api_provider, api_key, hotkey_again, hotkey_hard, hotkey_good, hotkey_easy,
+                    load_balance=False):
     """Update application settings"""
     conn = get_connection()
     cursor = conn.cursor()
     cursor.execute('''
         UPDATE settings
-        SET api_provider = ?, api_key = ?, hotkey_again = ?, hotkey_hard = ?, hotkey_good = ?, hotkey_easy = ?
+        SET api_provider = ?, api_key = ?, hotkey_again = ?, hotkey_hard = ?, hotkey_good = ?, hotkey_easy = ?,
+            load_balance = ?
         WHERE id = 1
-    ''', (api_provider, api_key, hotkey_again, hotkey_hard, hotkey_good, hotkey_easy))
+    ''', (api_provider, api_key, hotkey_again, hotkey_hard, hotkey_good, hotkey_easy, int(bool(load_balance))))
     conn.commit()
-    conn.close()
\ No newline at end of file
+    conn.close()
+    _invalidate('settings')
+
+if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='LazyStudy database maintenance')
+    parser.add_argument('command', choices=['migrate', 'check-plans', 'check-counters',
+                                            'rebuild-counters', 'check-analytics',
+                                            'rebuild-analytics', 'rebuild-rollups', 'rebalance',
+                                            'benchmark-reschedule'])
+    args = parser.parse_args()
+    
+    init_db()
+    if args.command == 'migrate':
+        conn = get_connection()
+        print(f"Schema version: {get_schema_version(conn)}")
+        conn.close()
+    elif args.command == 'check-plans':
+        failures = 0
+        for name, (ok, plan) in check_query_plans().items():
+            print(f"{'OK  ' if ok else 'FAIL'} {name}")
+            for line in plan:
+                print(f"       {line}")
+            failures += not ok
+        raise SystemExit(1 if failures else 0)
+    elif args.command == 'check-counters':
+        stale = check_deck_counters()
+        if stale:
+            print(f"Deck counters out of date for decks: {', '.join(map(str, stale))}")
+            print("Run: python database.py rebuild-counters")
+            raise SystemExit(1)
+        print("Deck counters are consistent")
+    elif args.command == 'rebuild-counters':
+        rebuild_deck_counters()
+        print("Deck counters rebuilt")
+    elif args.command == 'check-analytics':
+        stale = check_analytics_snapshot()
+        if stale:
+            print(f"Analytics snapshot out of date for decks: {', '.join(map(str, stale))}")
+            print("Run: python database.py rebuild-analytics")
+            raise SystemExit(1)
+        print("Analytics snapshot is consistent")
+    elif args.command == 'rebuild-analytics':
+        rebuild_analytics_snapshot()
+        print("Analytics snapshot rebuilt")
+    elif args.command == 'rebuild-rollups':
+        rebuild_daily_rollups()
+        print("Daily rollups rebuilt")
+    elif args.command == 'rebalance':
+        print(f"Moved {rebalance_due_dates()} reviews to quieter days")
+    elif args.command == 'benchmark-reschedule':
+        timings = benchmark_reschedule()
+        for name, seconds in timings.items():
+            print(f"{'OK  ' if seconds <= RESCHEDULE_SECONDS else 'SLOW'} {name}: "
+                  f"{seconds:.2f}s for {BENCHMARK_CARDS} cards")
+        raise SystemExit(1 if max(timings.values()) > RESCHEDULE_SECONDS else 0)
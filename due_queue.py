@@ -0,0 +1,185 @@
+"""
+In-memory index of due cards
+Per-deck heaps keyed on due time answer "how many cards are due" and "which
+cards are due next" without querying SQLite. The index is built from the
+cards table at startup and kept current through database.add_card_listener()
+"""
+
+import heapq
+import threading
+import database as db
+
+# Rebuild a deck's heaps once stale entries outnumber live ones by this much
+COMPACT_SLACK = 1024
+
+# Changes touching more cards than this reload the whole index (one table
+# scan is cheaper than that many lookups by id)
+RELOAD_THRESHOLD = 20000
+
+
+class DueQueue:
+    """
+    Due cards per deck
+
+    Each deck has a heap of cards not yet due and a "ready" heap of cards
+    that are due. As time passes, cards move from the first heap to the
+    second. Updates push a new entry and leave the old one in place; stale
+    entries are recognised (they no longer match the card's current due
+    time and deck) and dropped when they reach the top of a heap.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cards = {}        # card_id -> (deck_id, due_at), the live entry
+        self._deck_cards = {}   # deck_id -> set of card ids
+        self._future = {}       # deck_id -> heap of (due_at, card_id) not yet due
+        self._ready = {}        # deck_id -> heap of (due_at, card_id) already due
+        self._ready_ids = {}    # deck_id -> set of live card ids in the ready heap
+        db.add_card_listener(self.refresh)
+
+    def load(self):
+        """(Re)build the index from the cards table"""
+        entries = db.get_due_entries()
+        with self._lock:
+            self._cards = {}
+            self._deck_cards = {}
+            self._future = {}
+            self._ready = {}
+            self._ready_ids = {}
+            for card_id, deck_id, due_at in entries:
+                self._cards[card_id] = (deck_id, due_at)
+                self._deck(deck_id).add(card_id)
+                self._future[deck_id].append((due_at, card_id))
+            for heap in self._future.values():
+                heapq.heapify(heap)
+
+    def update(self, card_id, deck_id, due_at):
+        """Record a card's current deck and due time (epoch seconds)"""
+        with self._lock:
+            self._update(card_id, deck_id, due_at)
+
+    def remove(self, card_id):
+        """Drop a deleted card"""
+        with self._lock:
+            self._remove(card_id)
+
+    def refresh(self, card_ids):
+        """Re-read changed cards from the database (card listener; None reloads every card)"""
+        if card_ids is None or len(card_ids) > RELOAD_THRESHOLD:
+            self.load()
+            return
+        entries = db.get_due_entries(card_ids)
+        with self._lock:
+            found = set()
+            for card_id, deck_id, due_at in entries:
+                self._update(card_id, deck_id, due_at)
+                found.add(card_id)
+            for card_id in card_ids:
+                if card_id not in found:
+                    self._remove(card_id)
+
+    def due_count(self, deck_id, now=None):
+        """Number of cards in a deck due at now (defaults to the current time)"""
+        with self._lock:
+            self._advance(deck_id, db.now_epoch() if now is None else now)
+            return len(self._ready_ids.get(deck_id, ()))
+
+    def due_counts(self, now=None):
+        """Dict of deck_id -> number of due cards, for every deck with cards"""
+        now = db.now_epoch() if now is None else now
+        with self._lock:
+            counts = {}
+            for deck_id in self._deck_cards:
+                self._advance(deck_id, now)
+                counts[deck_id] = len(self._ready_ids[deck_id])
+            return counts
+
+    def next_due(self, deck_id, limit=None, now=None):
+        """
+        Ids of a deck's due cards, most overdue first
+
+        Args:
+            deck_id: Deck to look in
+            limit: Return at most this many (None for all due cards)
+            now: Time in epoch seconds, defaults to the current time
+
+        Returns:
+            list: Card ids
+        """
+        with self._lock:
+            self._advance(deck_id, db.now_epoch() if now is None else now)
+            ready = self._ready.get(deck_id, [])
+            if limit is None:
+                return [card_id for _, card_id in sorted(set(entry for entry in ready
+                                                             if self._is_ready(deck_id, entry)))]
+            taken = []
+            while ready and len(taken) < limit:
+                entry = heapq.heappop(ready)
+                if self._is_ready(deck_id, entry) and (not taken or entry != taken[-1]):
+                    taken.append(entry)
+            for entry in taken:
+                heapq.heappush(ready, entry)
+            return [card_id for _, card_id in taken]
+
+    def _deck(self, deck_id):
+        """Card id set of a deck, creating its heaps on first use (caller holds the lock)"""
+        if deck_id not in self._deck_cards:
+            self._deck_cards[deck_id] = set()
+            self._future[deck_id] = []
+            self._ready[deck_id] = []
+            self._ready_ids[deck_id] = set()
+        return self._deck_cards[deck_id]
+
+    def _update(self, card_id, deck_id, due_at):
+        current = self._cards.get(card_id)
+        if current == (deck_id, due_at):
+            return
+        if current is not None:
+            self._remove(card_id)
+        self._cards[card_id] = (deck_id, due_at)
+        self._deck(deck_id).add(card_id)
+        heapq.heappush(self._future[deck_id], (due_at, card_id))
+        self._compact(deck_id)
+
+    def _remove(self, card_id):
+        current = self._cards.pop(card_id, None)
+        if current is not None:
+            deck_id = current[0]
+            self._deck_cards[deck_id].discard(card_id)
+            self._ready_ids[deck_id].discard(card_id)
+            if not self._deck_cards[deck_id]:
+                # Last card gone (e.g. deck deleted): forget the deck
+                del self._deck_cards[deck_id], self._future[deck_id]
+                del self._ready[deck_id], self._ready_ids[deck_id]
+
+    def _is_live(self, deck_id, entry):
+        due_at, card_id = entry
+        return self._cards.get(card_id) == (deck_id, due_at)
+
+    def _is_ready(self, deck_id, entry):
+        return entry[1] in self._ready_ids[deck_id] and self._is_live(deck_id, entry)
+
+    def _advance(self, deck_id, now):
+        """Move cards that have come due from the future heap to the ready heap"""
+        future = self._future.get(deck_id)
+        if not future:
+            return
+        ready, ready_ids = self._ready[deck_id], self._ready_ids[deck_id]
+        while future and future[0][0] <= now:
+            entry = heapq.heappop(future)
+            if self._is_live(deck_id, entry) and entry[1] not in ready_ids:
+                heapq.heappush(ready, entry)
+                ready_ids.add(entry[1])
+
+    def _compact(self, deck_id):
+        """Rebuild a deck's heaps without stale entries once they pile up"""
+        live = len(self._deck_cards[deck_id])
+        future, ready = self._future[deck_id], self._ready[deck_id]
+        if len(future) + len(ready) <= 2 * live + COMPACT_SLACK:
+            return
+        ready_ids = self._ready_ids[deck_id]
+        self._ready[deck_id] = [(self._cards[card_id][1], card_id) for card_id in ready_ids]
+        self._future[deck_id] = [(self._cards[card_id][1], card_id)
+                                 for card_id in self._deck_cards[deck_id] - ready_ids]
+        heapq.heapify(self._ready[deck_id])
+        heapq.heapify(self._future[deck_id])
@@ -0,0 +1,99 @@
+"""
+Write-behind queue for card reviews
+Ratings are applied to the database in batches by a background thread, so
+the HTTP response for a rating never waits on a disk sync
+"""
+
+import threading
+import atexit
+import database as db
+import logger
+
+# Flush pending reviews at least this often (seconds)
+FLUSH_INTERVAL = 0.5
+
+# Flush immediately once this many reviews are pending
+MAX_BATCH_SIZE = 100
+
+
+class ReviewQueue:
+    """Buffers reviews in memory and writes them with db.record_reviews()"""
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, max_batch_size=MAX_BATCH_SIZE):
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+        atexit.register(self.close)
+
+    def submit(self, review):
+        """
+        Queue a review for writing
+
+        Args:
+            review: Dict in the format expected by db.record_reviews()
+        """
+        with self._lock:
+            if self._stopped:
+                # Shutting down: write straight through
+                self._pending.append(review)
+                flush_now = True
+            else:
+                self._pending.append(review)
+                flush_now = False
+                self._ensure_thread()
+                if len(self._pending) >= self.max_batch_size:
+                    self._wakeup.set()
+        if flush_now:
+            self.flush()
+
+    def pending_count(self):
+        """Number of reviews not yet written"""
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Write all pending reviews in one transaction"""
+        with self._flush_lock:
+            with self._lock:
+                batch = self._pending
+                self._pending = []
+            if not batch:
+                return
+            try:
+                db.record_reviews(batch)
+            except Exception as e:
+                # Keep the reviews (ahead of any newer ones) for the next flush
+                with self._lock:
+                    self._pending[:0] = batch
+                logger.log_database_error("record_reviews", e)
+
+    def close(self):
+        """Stop the background thread and write everything still pending"""
+        with self._lock:
+            self._stopped = True
+            thread = self._thread
+        self._wakeup.set()
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def _ensure_thread(self):
+        """Start the flusher thread on first use (caller holds self._lock)"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='review-queue', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        """Background loop: flush on the timer or when a batch fills up"""
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            with self._lock:
+                if self._stopped:
+                    return
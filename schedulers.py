@@ -0,0 +1,351 @@
+"""
+Pluggable review schedulers
+SM-2 (the default) and an FSRS-style memory model whose parameters can be
+fitted to the user's own review history
+"""
+
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+import time
+import numpy as np
+import database as db
+from spaced_repetition import calculate_next_review
+
+# FSRS memory model: retrievability R(t, S) = (1 + FACTOR * t / S) ** DECAY,
+# so a card is recalled with probability 0.9 after S days
+DECAY = -0.5
+FACTOR = 19 / 81
+DESIRED_RETENTION = 0.9
+
+# FSRS-4.5 default parameters
+DEFAULT_FSRS_PARAMS = (0.4872, 1.4003, 3.7145, 13.8206, 5.1618, 1.2298, 0.8975, 0.031,
+                       1.6474, 0.1367, 1.0461, 2.1072, 0.0793, 0.3246, 1.587, 0.2272, 2.8755)
+
+# Range each parameter is kept in while fitting
+FSRS_PARAM_BOUNDS = np.array([
+    (0.1, 100), (0.1, 100), (0.1, 100), (0.1, 100),
+    (1, 10), (0.1, 5), (0.1, 5), (0, 0.5),
+    (0, 3), (0, 0.8), (0.01, 2.5), (0.5, 5),
+    (0.01, 0.2), (0.01, 0.9), (0.01, 2), (0, 1), (1, 4)
+])
+
+MAX_STABILITY = 36500
+
+
+class Scheduler(ABC):
+    """Turns a rating into a card's next scheduling state"""
+
+    name = None
+    label = None
+
+    @abstractmethod
+    def schedule(self, card, quality):
+        """
+        Schedule a rated card
+
+        Args:
+            card: Card row (easiness_factor, interval, repetitions, due_at, stability, difficulty)
+            quality: 0 (Again), 1 (Hard), 2 (Good), 3 (Easy)
+
+        Returns:
+            dict: easiness_factor, interval, repetitions, next_review, stability, difficulty
+        """
+
+
+class SM2Scheduler(Scheduler):
+    """Classic SM-2 with fixed constants (spaced_repetition.calculate_next_review)"""
+
+    name = 'sm2'
+    label = 'SM-2'
+
+    def schedule(self, card, quality):
+        new_ef, new_interval, new_reps, next_review = calculate_next_review(
+            quality,
+            card['easiness_factor'],
+            card['interval'],
+            card['repetitions']
+        )
+        return {
+            'easiness_factor': new_ef,
+            'interval': new_interval,
+            'repetitions': new_reps,
+            'next_review': next_review,
+            'stability': None,
+            'difficulty': None
+        }
+
+
+class FSRSScheduler(Scheduler):
+    """FSRS-style scheduler: tracks each card's memory stability and difficulty"""
+
+    name = 'fsrs'
+    label = 'FSRS (memory model)'
+
+    def __init__(self, params=DEFAULT_FSRS_PARAMS, desired_retention=DESIRED_RETENTION):
+        self.params = np.asarray(params, dtype=np.float64)
+        self.desired_retention = desired_retention
+
+    def schedule(self, card, quality):
+        w = self.params
+        grade = quality + 1
+        now = db.now_epoch()
+        stability, difficulty = card['stability'], card['difficulty']
+
+        if stability is None and card['repetitions'] > 0 and card['interval'] > 0:
+            # Card last reviewed under SM-2: its interval is a fair stability estimate
+            stability, difficulty = float(card['interval']), float(w[4])
+
+        if stability is None:
+            stability = float(initial_stability(w, grade))
+            difficulty = float(initial_difficulty(w, grade))
+        else:
+            # due_at - interval is only a guess: bulk rescheduling moves due_at alone
+            last_review = card['last_review']
+            if last_review is None:
+                last_review = card['due_at'] - card['interval'] * db.SECONDS_PER_DAY
+            elapsed_days = max(now - last_review, 0) / db.SECONDS_PER_DAY
+            r = retrievability(elapsed_days, stability)
+            stability, difficulty = next_state(w, stability, difficulty, r, grade)
+            stability, difficulty = float(stability), float(difficulty)
+
+        interval = max(1, int(round(next_interval(stability, self.desired_retention))))
+        next_review = datetime.now() + timedelta(days=interval)
+        return {
+            'easiness_factor': card['easiness_factor'],
+            'interval': interval,
+            'repetitions': card['repetitions'] + 1 if grade > 1 else 0,
+            'next_review': next_review.strftime('%Y-%m-%d %H:%M:%S'),
+            'stability': stability,
+            'difficulty': difficulty
+        }
+
+
+SCHEDULERS = {scheduler.name: scheduler for scheduler in (SM2Scheduler, FSRSScheduler)}
+DEFAULT_SCHEDULER = SM2Scheduler.name
+
+def get_scheduler(name):
+    """Scheduler instance by name, FSRS with the fitted parameters if there are any"""
+    if name == FSRSScheduler.name:
+        fitted = db.get_scheduler_params(name)
+        return FSRSScheduler(fitted['params']) if fitted else FSRSScheduler()
+    return SCHEDULERS.get(name, SM2Scheduler)()
+
+def for_deck(deck):
+    """Scheduler chosen for a deck"""
+    return get_scheduler(deck['scheduler'] if deck else DEFAULT_SCHEDULER)
+
+# FSRS model. Parameters are indexed on the first axis, so w may be a plain
+# vector (one card) or shaped (17, P, 1) to evaluate P parameter sets at once.
+def retrievability(elapsed_days, stability):
+    """Probability of recalling a card elapsed_days after its last review"""
+    return (1 + FACTOR * elapsed_days / stability) ** DECAY
+
+def next_interval(stability, desired_retention=DESIRED_RETENTION):
+    """Days until retrievability falls to desired_retention"""
+    return stability / FACTOR * (desired_retention ** (1 / DECAY) - 1)
+
+def initial_stability(w, grade):
+    """Stability after the first review"""
+    return sum(w[g - 1] * (grade == g) for g in range(1, 5))
+
+def initial_difficulty(w, grade):
+    """Difficulty after the first review (1 easiest to 10 hardest)"""
+    return np.clip(w[4] - (grade - 3) * w[5], 1, 10)
+
+def next_state(w, stability, difficulty, r, grade):
+    """
+    Stability and difficulty after a review
+
+    Args:
+        w: FSRS parameters
+        stability, difficulty: State before the review
+        r: Retrievability at the time of the review
+        grade: 1 (Again) to 4 (Easy)
+
+    Returns:
+        tuple: (new_stability, new_difficulty)
+    """
+    hard_penalty = np.where(grade == 2, w[15], 1)
+    easy_bonus = np.where(grade == 4, w[16], 1)
+    recalled = stability * (1 + np.exp(w[8]) * (11 - difficulty) * stability ** -w[9]
+                            * (np.exp((1 - r) * w[10]) - 1) * hard_penalty * easy_bonus)
+    forgotten = np.minimum(w[11] * difficulty ** -w[12] * ((stability + 1) ** w[13] - 1)
+                           * np.exp((1 - r) * w[14]), stability)
+    new_stability = np.clip(np.where(grade > 1, recalled, forgotten), 0.01, MAX_STABILITY)
+
+    new_difficulty = difficulty - w[6] * (grade - 3)
+    new_difficulty = w[7] * initial_difficulty(w, 4) + (1 - w[7]) * new_difficulty
+    return new_stability, np.clip(new_difficulty, 1, 10)
+
+# Optimizer
+# Longer histories are truncated to their first MAX_HISTORY reviews
+MAX_HISTORY = 256
+
+def pack_histories(card_ids, reviewed_at, ratings):
+    """
+    Turn a review log into padded per-card arrays for vectorized replay
+
+    Args:
+        card_ids, reviewed_at, ratings: Review log arrays sorted by card, then time
+
+    Returns:
+        tuple: (grades, elapsed_days, lengths) with one row per card (cards with
+               at least two reviews only), longest history first
+    """
+    card_ids = np.asarray(card_ids)
+    starts = np.flatnonzero(np.r_[True, card_ids[1:] != card_ids[:-1]])
+    lengths = np.diff(np.r_[starts, len(card_ids)])
+    position = np.arange(len(card_ids)) - np.repeat(starts, lengths)
+
+    keep = np.repeat(lengths >= 2, lengths) & (position < MAX_HISTORY)
+    lengths = np.minimum(lengths[lengths >= 2], MAX_HISTORY)
+    order = np.argsort(-lengths, kind='stable')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    rows = np.repeat(rank, lengths) if len(lengths) else np.zeros(0, dtype=np.int64)
+
+    elapsed = np.r_[0, np.diff(np.asarray(reviewed_at, dtype=np.float64))] / db.SECONDS_PER_DAY
+    max_len = int(lengths.max()) if len(lengths) else 0
+    grades = np.zeros((len(lengths), max_len), dtype=np.int64)
+    elapsed_days = np.zeros((len(lengths), max_len))
+    grades[rows, position[keep]] = np.asarray(ratings)[keep] + 1
+    elapsed_days[rows, position[keep]] = np.maximum(elapsed[keep], 0)
+    return grades, elapsed_days, lengths[order]
+
+def log_loss(w, grades, elapsed_days, lengths):
+    """
+    Mean log loss of predicted recall over every review after a card's first
+
+    Args:
+        w: Parameters, a vector or shaped (17, P, 1) for P parameter sets at once
+        grades, elapsed_days, lengths: Histories from pack_histories()
+
+    Returns:
+        Loss (one per parameter set)
+    """
+    s = initial_stability(w, grades[:, 0])
+    d = initial_difficulty(w, grades[:, 0])
+    total = 0
+    # Rows are longest first, so the cards still active at step j are a prefix
+    active = np.searchsorted(-lengths, -np.arange(grades.shape[1]), side='left')
+    for j in range(1, grades.shape[1]):
+        n = active[j]
+        s, d = s[..., :n], d[..., :n]
+        grade = grades[:n, j]
+        r = np.clip(retrievability(elapsed_days[:n, j], s), 1e-6, 1 - 1e-6)
+        total = total - np.where(grade > 1, np.log(r), np.log(1 - r)).sum(axis=-1)
+        s, d = next_state(w, s, d, r, grade)
+    return total / max(int(lengths.sum() - len(lengths)), 1)
+
+def fit_fsrs_params(grades, elapsed_days, lengths, initial=DEFAULT_FSRS_PARAMS,
+                    steps=150, batch_size=1024, learning_rate=0.03, seed=0):
+    """
+    Fit FSRS parameters to review histories with Adam
+
+    Gradients are central finite differences: every perturbed parameter set
+    is evaluated in the same vectorized replay of a mini-batch of cards.
+    Parameters are optimized rescaled to [0, 1] within FSRS_PARAM_BOUNDS,
+    with a cosine-decayed learning rate.
+
+    Returns:
+        numpy array: Fitted parameters
+    """
+    rng = np.random.default_rng(seed)
+    low, high = FSRS_PARAM_BOUNDS[:, 0], FSRS_PARAM_BOUNDS[:, 1]
+    x = (np.asarray(initial, dtype=np.float64) - low) / (high - low)
+    k = len(x)
+    step = 1e-4
+    perturb = np.vstack([np.eye(k), -np.eye(k)]) * step
+    m, v = np.zeros(k), np.zeros(k)
+    beta1, beta2 = 0.9, 0.999
+
+    for t in range(1, steps + 1):
+        if len(lengths) > batch_size:
+            # Sorted indices keep the batch longest first
+            batch = np.sort(rng.choice(len(lengths), size=batch_size, replace=False))
+            batch_lengths = lengths[batch]
+            width = int(batch_lengths[0])
+            batch_data = (grades[batch, :width], elapsed_days[batch, :width], batch_lengths)
+        else:
+            batch_data = (grades, elapsed_days, lengths)
+
+        candidates = np.clip(x + perturb, 0, 1) * (high - low) + low
+        losses = log_loss(candidates.T[:, :, None], *batch_data)
+        gradient = (losses[:k] - losses[k:]) / (2 * step)
+
+        m = beta1 * m + (1 - beta1) * gradient
+        v = beta2 * v + (1 - beta2) * gradient ** 2
+        rate = learning_rate * 0.5 * (1 + np.cos(np.pi * (t - 1) / steps))
+        x -= rate * (m / (1 - beta1 ** t)) / (np.sqrt(v / (1 - beta2 ** t)) + 1e-8)
+        x = np.clip(x, 0, 1)
+
+    return x * (high - low) + low
+
+def optimize_fsrs(min_reviews=1000, **kwargs):
+    """
+    Fit FSRS to the whole review log and store the parameters
+
+    Returns:
+        dict: review_count, log_loss before and after, or None when the log has
+              fewer than min_reviews reviews
+    """
+    card_ids, reviewed_at, ratings = db.get_review_history()
+    if len(card_ids) < min_reviews:
+        return None
+    histories = pack_histories(card_ids, reviewed_at, ratings)
+
+    current = db.get_scheduler_params(FSRSScheduler.name)
+    initial = current['params'] if current else DEFAULT_FSRS_PARAMS
+    before = float(log_loss(np.asarray(initial), *histories))
+    params = fit_fsrs_params(*histories, initial=initial, **kwargs)
+    after = float(log_loss(params, *histories))
+    if after > before:
+        params, after = np.asarray(initial), before
+
+    db.save_scheduler_params(FSRSScheduler.name, params.tolist(), len(card_ids), after)
+    return {'review_count': len(card_ids), 'log_loss_before': before, 'log_loss': after}
+
+def simulate_histories(cards, reviews_per_card, params=DEFAULT_FSRS_PARAMS, seed=0):
+    """Synthetic review log from an FSRS model, for benchmarking the optimizer"""
+    rng = np.random.default_rng(seed)
+    w = np.asarray(params, dtype=np.float64)
+    grades = np.zeros((cards, reviews_per_card), dtype=np.int64)
+    elapsed_days = np.zeros((cards, reviews_per_card))
+    grades[:, 0] = rng.integers(1, 5, cards)
+    s = initial_stability(w, grades[:, 0])
+    d = initial_difficulty(w, grades[:, 0])
+    for j in range(1, reviews_per_card):
+        elapsed_days[:, j] = np.maximum(np.round(next_interval(s) * rng.uniform(0.5, 2.0, cards)), 1)
+        r = retrievability(elapsed_days[:, j], s)
+        recalled = rng.random(cards) < r
+        grades[:, j] = np.where(recalled, rng.choice([2, 3, 4], cards, p=[0.15, 0.7, 0.15]), 1)
+        s, d = next_state(w, s, d, r, grades[:, j])
+    return grades, elapsed_days, np.full(cards, reviews_per_card)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='LazyStudy schedulers')
+    parser.add_argument('command', choices=['fit', 'benchmark'])
+    args = parser.parse_args()
+
+    if args.command == 'fit':
+        db.init_db()
+        result = optimize_fsrs()
+        if result is None:
+            print("Not enough reviews in the log to fit FSRS yet")
+        else:
+            print(f"Fitted FSRS on {result['review_count']} reviews: "
+                  f"log loss {result['log_loss_before']:.4f} -> {result['log_loss']:.4f}")
+    else:
+        true_params = np.array(DEFAULT_FSRS_PARAMS) * np.random.default_rng(1).uniform(0.7, 1.3, 17)
+        true_params = np.clip(true_params, FSRS_PARAM_BOUNDS[:, 0], FSRS_PARAM_BOUNDS[:, 1])
+        histories = simulate_histories(30000, 10, true_params)
+        reviews = int(histories[2].sum())
+        start = time.perf_counter()
+        params = fit_fsrs_params(*histories)
+        elapsed = time.perf_counter() - start
+        print(f"Fitted {reviews} reviews in {elapsed:.1f}s")
+        print(f"Log loss: defaults {log_loss(np.array(DEFAULT_FSRS_PARAMS), *histories):.4f}, "
+              f"fitted {log_loss(params, *histories):.4f}, true {log_loss(true_params, *histories):.4f}")
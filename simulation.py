@@ -0,0 +1,215 @@
+"""
+Monte Carlo review workload simulator
+Replays SM-2 day by day over the whole collection to predict how many
+reviews each future day will bring once reviews cascade into new intervals
+"""
+
+import atexit
+import os
+import threading
+import numpy as np
+import spaced_repetition as sr
+import workers
+
+# Probability of each rating: Again, Hard, Good, Easy
+DEFAULT_RATING_PROBABILITIES = (0.10, 0.15, 0.60, 0.15)
+
+MIN_DAYS = 30
+MAX_DAYS = 365
+DEFAULT_RUNS = 20
+DEFAULT_PERCENTILES = (5, 95)
+
+# Larger collections are simulated on a random sample of this many cards
+# and the counts scaled back up, which keeps a request to a few seconds
+DEFAULT_SAMPLE_SIZE = 200000
+
+# Below this many cards a worker pool costs more than it saves
+PARALLEL_MIN_CARDS = 50000
+
+# Runs are spread over one worker pool that lives as long as the process.
+# The server starts it with start_pool() before any thread exists; workers
+# come from a forkserver (spawned where there is none), never forked from
+# the threaded server.
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _bucket_by_day(card_ids, due_days, days, calendar):
+    """Append card ids to the calendar queue slot of their due day (days beyond the horizon are dropped)"""
+    keep = due_days < days
+    card_ids = card_ids[keep]
+    due_days = due_days[keep]
+    if len(card_ids) == 0:
+        return
+    order = np.argsort(due_days, kind='stable')
+    card_ids = card_ids[order]
+    due_days = due_days[order]
+    slot_days, starts = np.unique(due_days, return_index=True)
+    for day, ids in zip(slot_days, np.split(card_ids, starts[1:])):
+        calendar[day].append(ids)
+
+def simulate_run(state, days, rating_probabilities, seed):
+    """
+    Simulate one possible future of the collection
+
+    Args:
+        state: Dict of arrays: easiness_factor, interval, repetitions, due_day
+               (due_day relative to today, overdue cards at 0)
+        days: Number of days to simulate
+        rating_probabilities: Probabilities of Again, Hard, Good, Easy
+        seed: Random seed for this run
+
+    Returns:
+        numpy array: Number of reviews on each simulated day
+    """
+    rng = np.random.default_rng(seed)
+    cumulative = np.cumsum(rating_probabilities)[:-1]
+    easiness_factor = np.array(state['easiness_factor'], dtype=np.float64)
+    interval = np.array(state['interval'], dtype=np.int64)
+    repetitions = np.array(state['repetitions'], dtype=np.int64)
+    due_day = np.maximum(np.asarray(state['due_day'], dtype=np.int64), 0)
+
+    # Calendar queue: one list of card id arrays per day. Every card sits in
+    # exactly one slot, since a review always moves it at least a day ahead.
+    calendar = [[] for _ in range(days)]
+    _bucket_by_day(np.arange(len(due_day)), due_day, days, calendar)
+
+    counts = np.zeros(days, dtype=np.int64)
+    for day in range(days):
+        slot = calendar[day]
+        if not slot:
+            continue
+        ids = np.concatenate(slot) if len(slot) > 1 else slot[0]
+        calendar[day] = None
+        counts[day] = len(ids)
+
+        quality = np.searchsorted(cumulative, rng.random(len(ids)), side='right')
+        new_ef, new_interval, new_reps, new_due = sr.calculate_next_review_batch(
+            quality, easiness_factor[ids], interval[ids], repetitions[ids], today=day)
+        easiness_factor[ids] = new_ef
+        interval[ids] = new_interval
+        repetitions[ids] = new_reps
+        _bucket_by_day(ids, new_due, days, calendar)
+
+    return counts
+
+def _simulate_runs(args):
+    """Pool worker: simulate several runs and stack their daily counts"""
+    state, days, rating_probabilities, seeds = args
+    return np.stack([simulate_run(state, days, rating_probabilities, seed) for seed in seeds])
+
+def _get_pool(processes):
+    """The shared worker pool, started with this many processes on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = workers.pool_context().Pool(processes)
+        return _pool
+
+def start_pool(processes=None):
+    """Start the worker pool ahead of the first simulation (None: one process per CPU)"""
+    processes = processes or os.cpu_count() or 1
+    if processes > 1:
+        _get_pool(processes)
+
+def close_pool():
+    """Stop the worker pool, letting running simulations finish"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool.join()
+            _pool = None
+
+atexit.register(close_pool)
+
+def sample_state(state, sample_size, seed=None):
+    """
+    Draw a random subset of cards from a collection state
+
+    Returns:
+        tuple: (sampled state, factor to scale simulated counts by)
+    """
+    total = len(state['due_day'])
+    if sample_size is None or total <= sample_size:
+        return state, 1.0
+    rng = np.random.default_rng(seed)
+    picked = rng.choice(total, size=sample_size, replace=False)
+    sampled = {key: np.asarray(values)[picked] for key, values in state.items()}
+    return sampled, total / sample_size
+
+def simulate_workload(state, days=90, runs=DEFAULT_RUNS, rating_probabilities=None,
+                      percentiles=DEFAULT_PERCENTILES, processes=None, seed=None,
+                      sample_size=DEFAULT_SAMPLE_SIZE):
+    """
+    Predict daily review counts with Monte Carlo runs of SM-2
+
+    Args:
+        state: Dict of arrays as returned by analytics.get_scheduling_state()
+        days: Days to simulate (30 to 365)
+        runs: Number of independent runs
+        rating_probabilities: Probabilities of Again, Hard, Good, Easy
+        percentiles: Lower and upper percentile of the confidence band
+        processes: Number of parts to split the runs into for the worker pool
+                   (started with this many processes if it is not running yet),
+                   None or 1 to run in-process
+        seed: Base random seed, None for a fresh one
+        sample_size: Simulate at most this many cards and scale up, None for all
+
+    Returns:
+        dict: days, runs, mean, lower and upper per-day review counts and percentiles
+    """
+    days = min(max(int(days), MIN_DAYS), MAX_DAYS)
+    runs = max(int(runs), 1)
+    if rating_probabilities is None:
+        rating_probabilities = DEFAULT_RATING_PROBABILITIES
+    rating_probabilities = np.asarray(rating_probabilities, dtype=np.float64)
+    rating_probabilities = rating_probabilities / rating_probabilities.sum()
+
+    seeds = np.random.SeedSequence(seed).generate_state(runs + 1)
+    state, scale = sample_state(state, sample_size, seeds[-1])
+    seeds = seeds[:-1]
+    parallel = len(state['due_day']) >= PARALLEL_MIN_CARDS
+    if parallel and processes and processes > 1 and runs > 1:
+        processes = min(processes, runs)
+        tasks = [(state, days, rating_probabilities, chunk)
+                 for chunk in np.array_split(seeds, processes)]
+        counts = np.concatenate(_get_pool(processes).map(_simulate_runs, tasks))
+    else:
+        counts = _simulate_runs((state, days, rating_probabilities, seeds))
+    counts = counts * scale
+
+    lower, upper = np.percentile(counts, percentiles, axis=0)
+    return {
+        'days': days,
+        'runs': runs,
+        'sampled': scale != 1.0,
+        'percentiles': list(percentiles),
+        'mean': np.round(counts.mean(axis=0), 1).tolist(),
+        'lower': lower.tolist(),
+        'upper': upper.tolist()
+    }
+
+
+if __name__ == '__main__':
+    import time
+
+    n = 1000000
+    rng = np.random.default_rng(0)
+    state = {
+        'easiness_factor': rng.uniform(1.3, 3.0, n),
+        'interval': rng.integers(1, 120, n),
+        'repetitions': rng.integers(0, 10, n),
+        'due_day': rng.integers(-30, 120, n)
+    }
+    start = time.perf_counter()
+    result = simulate_workload(state, days=365, runs=8, processes=4, seed=0, sample_size=None)
+    elapsed = time.perf_counter() - start
+    print(f"Simulated {n} cards x 365 days x 8 runs in {elapsed:.1f}s")
+    print(f"Day 1: {result['mean'][0]:.0f} reviews, day 30: {result['mean'][29]:.0f} "
+          f"({result['lower'][29]:.0f}-{result['upper'][29]:.0f})")
+    start = time.perf_counter()
+    sampled = simulate_workload(state, days=365, runs=8, seed=0)
+    elapsed = time.perf_counter() - start
+    print(f"Sampled {DEFAULT_SAMPLE_SIZE} of {n} cards x 365 days x 8 runs in {elapsed:.1f}s "
+          f"(day 30: {sampled['mean'][29]:.0f})")
@@ -7,9 +7,189 @@ import matplotlib
 matplotlib.use('Agg')  # Use non-interactive backend for Flask
 import matplotlib.pyplot as plt
 import io
+import os
+import atexit
 import base64
+import multiprocessing
+import hashlib
+import inspect
+import pickle
+import threading
+from collections import OrderedDict
+from functools import wraps
+import numpy as np
+import logger
+import workers
 from analytics import *
 
+# Chart cache. A rendered chart is stored under a hash of its kind and the
+# input fields it plots, so an unchanged chart comes back without touching
+# matplotlib (even when other fields of the same statistics have changed).
+# Entries live in an in-memory LRU and, when LAZYSTUDY_CHART_CACHE_DIR is set,
+# also as files in that directory, which survive restarts. The key includes a
+# hash of this file and the matplotlib version, so editing a chart (or
+# upgrading matplotlib) never serves an old picture.
+CHART_CACHE_ENABLED = os.environ.get('LAZYSTUDY_CHART_CACHE', '1') != '0'
+CHART_CACHE_SIZE = 64
+CHART_CACHE_DIR = os.environ.get('LAZYSTUDY_CHART_CACHE_DIR')
+CHART_DISK_CACHE_FILES = 512
+
+with open(__file__, 'rb') as _source:
+    _RENDER_VERSION = hashlib.sha256(_source.read() + matplotlib.__version__.encode()).hexdigest()
+
+_chart_cache = OrderedDict()
+_chart_cache_lock = threading.Lock()
+_chart_cache_counters = {'hits': 0, 'disk_hits': 0, 'misses': 0}
+
+def chart_key(kind, arguments):
+    """
+    Content hash of a chart: its kind plus everything it is drawn from
+    
+    Equal inputs pickle to equal bytes (a dict built in another order may
+    not, which only costs a cache miss). Returns None for inputs that cannot
+    be pickled, which are then rendered without caching.
+    """
+    try:
+        payload = pickle.dumps((_RENDER_VERSION, kind, arguments), protocol=4)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return None
+    return hashlib.sha256(payload).hexdigest()
+
+def _disk_path(key):
+    return os.path.join(CHART_CACHE_DIR, key + '.b64')
+
+def _remember(key, image):
+    """Put a chart in the memory LRU (caller holds _chart_cache_lock)"""
+    _chart_cache[key] = image
+    _chart_cache.move_to_end(key)
+    while len(_chart_cache) > CHART_CACHE_SIZE:
+        _chart_cache.popitem(last=False)
+
+def get_cached_chart(key):
+    """Rendered chart for a key from memory or disk, None on a miss"""
+    with _chart_cache_lock:
+        image = _chart_cache.get(key)
+        if image is not None:
+            _chart_cache.move_to_end(key)
+            _chart_cache_counters['hits'] += 1
+            return image
+    
+    if CHART_CACHE_DIR:
+        try:
+            with open(_disk_path(key), encoding='ascii') as f:
+                image = f.read()
+            os.utime(_disk_path(key))  # Mark as recently used for disk eviction
+        except OSError:
+            image = None
+    
+    with _chart_cache_lock:
+        if image:
+            _chart_cache_counters['disk_hits'] += 1
+            _remember(key, image)
+            return image
+        _chart_cache_counters['misses'] += 1
+    return None
+
+def put_cached_chart(key, image):
+    """Store a rendered chart in memory and, if configured, on disk"""
+    with _chart_cache_lock:
+        _remember(key, image)
+    if CHART_CACHE_DIR:
+        try:
+            _write_disk_entry(key, image)
+        except OSError as e:
+            logger.log_warning(f"Could not write chart cache file: {e}")
+
+def _write_disk_entry(key, image):
+    """Write a cache file atomically, then drop the least recently used files over the limit"""
+    os.makedirs(CHART_CACHE_DIR, exist_ok=True)
+    temp_path = f'{_disk_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'w', encoding='ascii') as f:
+        f.write(image)
+    os.replace(temp_path, _disk_path(key))
+    
+    entries = [entry for entry in os.scandir(CHART_CACHE_DIR) if entry.name.endswith('.b64')]
+    if len(entries) > CHART_DISK_CACHE_FILES:
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - CHART_DISK_CACHE_FILES]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+def clear_chart_cache(disk=False):
+    """Drop every chart from memory (and from the cache directory if disk is set)"""
+    with _chart_cache_lock:
+        _chart_cache.clear()
+    if disk and CHART_CACHE_DIR and os.path.isdir(CHART_CACHE_DIR):
+        for entry in os.scandir(CHART_CACHE_DIR):
+            if entry.name.endswith('.b64'):
+                os.remove(entry.path)
+
+def chart_cache_stats():
+    """Get chart cache hit/miss counters"""
+    with _chart_cache_lock:
+        hits = _chart_cache_counters['hits']
+        disk_hits = _chart_cache_counters['disk_hits']
+        misses = _chart_cache_counters['misses']
+        size = len(_chart_cache)
+    lookups = hits + disk_hits + misses
+    return {
+        'hits': hits,
+        'disk_hits': disk_hits,
+        'misses': misses,
+        'size': size,
+        'capacity': CHART_CACHE_SIZE,
+        'hit_rate': round((hits + disk_hits) / lookups * 100, 1) if lookups else 0.0
+    }
+
+def _plotted_fields(value, fields):
+    """The given keys of a dict, or of every dict in a list"""
+    if isinstance(value, dict):
+        return tuple(value[field] for field in fields)
+    return [_plotted_fields(item, fields) for item in value]
+
+def cached_chart(render=None, **plotted):
+    """
+    Decorator: serve a chart function's result from the chart cache when its
+    inputs are unchanged
+    
+    Keyword arguments name, per parameter, the fields the chart reads from
+    it (a dict or a list of dicts); only those go into the cache key, e.g.
+    @cached_chart(deck_stats=('name', 'progress')). Other parameters are
+    keyed whole.
+    
+    The wrapper also gets a chart_key(*args, **kwargs) attribute returning the
+    cache key of a call (None when it cannot be cached), for render_charts().
+    """
+    if render is None:
+        return lambda render: cached_chart(render, **plotted)
+    signature = inspect.signature(render)
+    
+    def key_for(*args, **kwargs):
+        if not CHART_CACHE_ENABLED:
+            return None
+        # Bind to parameter names so f(x), f(x, 7) and f(x, window=7) share an entry
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = {name: _plotted_fields(value, plotted[name]) if name in plotted else value
+                     for name, value in bound.arguments.items()}
+        return chart_key(render.__name__, arguments)
+    
+    @wraps(render)
+    def wrapper(*args, **kwargs):
+        key = key_for(*args, **kwargs)
+        if key is None:
+            return render(*args, **kwargs)
+        image = get_cached_chart(key)
+        if image is None:
+            image = render(*args, **kwargs)
+            put_cached_chart(key, image)
+        return image
+    wrapper.chart_key = key_for
+    return wrapper
+
+@cached_chart(deck_stats=('name', 'progress'))
 def generate_deck_progress_chart(deck_stats):
     """Generate bar chart showing deck progress"""
     fig, ax = plt.subplots(figsize=(10, 6))
@@ -40,6 +220,7 @@ def generate_deck_progress_chart(deck_stats):
     
     return _fig_to_base64(fig)
 
+@cached_chart(data=('labels', 'values'))
 def generate_interval_distribution_chart(data):
     """Generate pie chart showing card interval distribution"""
     fig, ax = plt.subplots(figsize=(8, 8))
@@ -66,6 +247,7 @@ def generate_interval_distribution_chart(data):
     
     return _fig_to_base64(fig)
 
+@cached_chart(data=('labels', 'values'))
 def generate_difficulty_distribution_chart(data):
     """Generate horizontal bar chart showing difficulty distribution"""
     fig, ax = plt.subplots(figsize=(8, 6))
@@ -91,6 +273,7 @@ def generate_difficulty_distribution_chart(data):
     
     return _fig_to_base64(fig)
 
+@cached_chart(data=('labels', 'values'))
 def generate_upcoming_reviews_chart(data):
     """Generate line chart showing upcoming reviews"""
     fig, ax = plt.subplots(figsize=(10, 6))
@@ -118,6 +301,7 @@ def generate_upcoming_reviews_chart(data):
     
     return _fig_to_base64(fig)
 
+@cached_chart(metrics=('first_review_retention', 'second_review_retention', 'mature_card_rate'))
 def generate_retention_metrics_chart(metrics):
     """Generate bar chart showing retention metrics"""
     fig, ax = plt.subplots(figsize=(10, 6))
@@ -147,6 +331,7 @@ def generate_retention_metrics_chart(metrics):
     
     return _fig_to_base64(fig)
 
+@cached_chart(stats=('total_cards', 'studied_cards', 'unstudied_cards', 'due_cards'))
 def generate_overall_summary_chart(stats):
     """Generate summary donut chart"""
     fig, ax = plt.subplots(figsize=(8, 8))
@@ -181,6 +366,91 @@ def generate_overall_summary_chart(stats):
     
     return _fig_to_base64(fig)
 
+@cached_chart(activity=('dates', 'reviews', 'days_studied', 'streak'))
+def generate_activity_heatmap(activity):
+    """Generate calendar heatmap of reviews per day (one column per week)"""
+    fig, ax = plt.subplots(figsize=(14, 3))
+    
+    dates = activity['dates']
+    reviews = np.array(activity['reviews'], dtype=float)
+    if not reviews.any():
+        ax.text(0.5, 0.5, 'No reviews yet', ha='center', va='center')
+        ax.axis('off')
+        return _fig_to_base64(fig)
+    
+    # Grid of weekday (Mon at top) x week, blank outside the range
+    offset = dates[0].weekday()
+    weeks = (offset + len(dates) + 6) // 7
+    grid = np.full(weeks * 7, np.nan)
+    grid[offset:offset + len(dates)] = reviews
+    grid = grid.reshape(weeks, 7).T
+    grid[grid == 0] = np.nan
+    
+    cmap = plt.get_cmap('Greens').copy()
+    cmap.set_bad('#ebedf0')
+    ax.imshow(np.ma.masked_invalid(grid), cmap=cmap, aspect='equal',
+              vmin=0, vmax=max(np.nanpercentile(grid, 95), 1))
+    
+    # Month names above the week each month starts in
+    ticks, labels = [], []
+    for i, date in enumerate(dates):
+        if date.day == 1 or i == 0:
+            ticks.append((offset + i) // 7)
+            labels.append(date.strftime('%b'))
+    ax.set_xticks(ticks)
+    ax.set_xticklabels(labels)
+    ax.set_yticks([0, 2, 4, 6])
+    ax.set_yticklabels(['Mon', 'Wed', 'Fri', 'Sun'])
+    ax.tick_params(length=0)
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+    ax.set_title(f"{int(reviews.sum())} reviews on {activity['days_studied']} days "
+                 f"(current streak: {activity['streak']} days)",
+                 fontsize=14, fontweight='bold')
+    plt.tight_layout()
+    
+    return _fig_to_base64(fig)
+
+@cached_chart(activity=('dates', 'reviews', 'good', 'easy', 'minutes', 'new_cards'))
+def generate_activity_trend_chart(activity, window=7):
+    """Generate daily review counts with moving averages of reviews and accuracy"""
+    fig, ax = plt.subplots(figsize=(12, 6))
+    
+    reviews = np.array(activity['reviews'], dtype=float)
+    if not reviews.any():
+        ax.text(0.5, 0.5, 'No reviews yet', ha='center', va='center')
+        return _fig_to_base64(fig)
+    
+    dates = activity['dates']
+    correct = np.array(activity['good']) + np.array(activity['easy'])
+    kernel = np.ones(window)
+    review_sum = np.convolve(reviews, kernel)[:len(reviews)]
+    correct_sum = np.convolve(correct, kernel)[:len(reviews)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        accuracy = np.where(review_sum > 0, correct_sum / review_sum * 100, np.nan)
+    
+    ax.bar(dates, reviews, color='#3498db', alpha=0.3, label='Reviews')
+    ax.plot(dates, review_sum / window, color='#3498db', linewidth=2,
+            label=f'Reviews ({window}-day average)')
+    ax.set_ylabel('Reviews per Day', fontsize=12)
+    
+    ax2 = ax.twinx()
+    ax2.plot(dates, accuracy, color='#2ecc71', linewidth=2,
+             label=f'Good/Easy rate ({window}-day)')
+    ax2.set_ylabel('Good/Easy Rate (%)', fontsize=12)
+    ax2.set_ylim(0, 105)
+    
+    lines, labels = ax.get_legend_handles_labels()
+    lines2, labels2 = ax2.get_legend_handles_labels()
+    ax.legend(lines + lines2, labels + labels2, loc='upper left')
+    ax.set_title(f"Review Trend ({sum(activity['minutes']):.0f} minutes, "
+                 f"{sum(activity['new_cards'])} new cards)", fontsize=14, fontweight='bold')
+    ax.grid(True, alpha=0.3)
+    fig.autofmt_xdate()
+    plt.tight_layout()
+    
+    return _fig_to_base64(fig)
+
 def _fig_to_base64(fig):
     """Convert matplotlib figure to base64 string for HTML embedding"""
     buf = io.BytesIO()
@@ -188,4 +458,147 @@ def _fig_to_base64(fig):
     buf.seek(0)
     img_base64 = base64.b64encode(buf.read()).decode('utf-8')
     plt.close(fig)
-    return img_base64
\ No newline at end of file
+    return img_base64
+
+# Batch rendering. Charts missing from the cache are drawn in a pool of
+# worker processes that stays up between requests, so a page of charts takes
+# about as long as its slowest chart and concurrent requests use every core
+# instead of queueing on the GIL. Set LAZYSTUDY_CHART_WORKERS=1 to render in
+# the calling thread instead.
+#
+# Workers are never forked from the server itself (it runs threads): they
+# come from a forkserver (or are spawned on platforms without one), which
+# imports the main module under another name, so app.py keeps its startup
+# work in init_app(). The server calls start_render_pool() before starting
+# any threads.
+CHART_WORKERS = int(os.environ.get('LAZYSTUDY_CHART_WORKERS', min(os.cpu_count() or 1, 8)))
+
+# Seconds to wait for a worker before drawing the chart in-process
+RENDER_TIMEOUT = 60
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+def _init_render_worker():
+    """Pool initializer: load matplotlib's font cache and draw a throwaway chart"""
+    from matplotlib import font_manager
+    font_manager.findfont(font_manager.FontProperties())
+    fig, ax = plt.subplots(figsize=(2, 2))
+    ax.plot([0, 1], [0, 1])
+    ax.set_title('Warm-up', fontweight='bold')
+    plt.tight_layout()
+    _fig_to_base64(fig)
+
+def _render_job(job):
+    """Pool worker: draw one chart (bypassing the worker's own cache, the caller keeps it)"""
+    name, args = job
+    return globals()[name].__wrapped__(*args)
+
+def _get_render_pool():
+    """The shared worker pool, started on first use"""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = workers.pool_context().Pool(CHART_WORKERS, initializer=_init_render_worker)
+        return _render_pool
+
+def start_render_pool():
+    """Start the worker pool ahead of the first batch (no-op when rendering in-process)"""
+    if CHART_WORKERS > 1:
+        _get_render_pool()
+
+def close_render_pool(terminate=False):
+    """Stop the worker pool, letting running charts finish unless terminate is set"""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is not None:
+            if terminate:
+                _render_pool.terminate()
+            else:
+                _render_pool.close()
+            _render_pool.join()
+            _render_pool = None
+
+atexit.register(close_render_pool)
+
+def render_charts(jobs):
+    """
+    Render a batch of charts, in parallel where they are not cached
+    
+    Args:
+        jobs: Dict of name -> (chart function, *args), e.g.
+              {'summary': (generate_overall_summary_chart, stats)}
+    
+    Returns:
+        dict: name -> base64 PNG, in the order of jobs
+    """
+    images = {}
+    pending = {}
+    for name, (chart, *args) in jobs.items():
+        key = chart.chart_key(*args)
+        image = get_cached_chart(key) if key else None
+        if image is None:
+            pending[name] = key
+        else:
+            images[name] = image
+    
+    # A single chart is not worth the round trip to a worker
+    if CHART_WORKERS > 1 and len(pending) > 1:
+        pool = _get_render_pool()
+        results = {name: pool.apply_async(_render_job, ((jobs[name][0].__name__, jobs[name][1:]),))
+                   for name in pending}
+        for name, result in results.items():
+            try:
+                images[name] = result.get(RENDER_TIMEOUT)
+            except multiprocessing.TimeoutError:
+                logger.log_warning(f"Chart worker timed out on {name}, restarting the pool")
+                close_render_pool(terminate=True)
+                break
+            except Exception as e:
+                logger.log_error(f"Chart worker failed on {name}", e)
+    
+    # Whatever was not rendered by a worker is drawn here
+    for name, key in pending.items():
+        if name not in images:
+            chart, *args = jobs[name]
+            images[name] = chart.__wrapped__(*args)
+        if key:
+            put_cached_chart(key, images[name])
+    return {name: images[name] for name in jobs}
+
+
+if __name__ == '__main__':
+    import time
+    from datetime import datetime, timedelta
+    
+    rng = np.random.default_rng(0)
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    reviews = rng.poisson(40, 365) * (rng.random(365) < 0.8)
+    good = rng.binomial(reviews, 0.7)
+    activity = {
+        'dates': [today - timedelta(days=364 - i) for i in range(365)],
+        'reviews': reviews.tolist(), 'good': good.tolist(), 'easy': [0] * 365,
+        'minutes': (reviews * 0.2).tolist(), 'new_cards': (reviews // 5).tolist(),
+        'days_studied': int((reviews > 0).sum()), 'streak': 3
+    }
+    deck_stats = [{'name': f'Deck {i}', 'progress': float(p)}
+                  for i, p in enumerate(rng.uniform(0, 100, 12))]
+    upcoming = {'labels': [f'Day {i}' for i in range(7)], 'values': rng.integers(0, 50, 7).tolist()}
+    jobs = {
+        'deck_progress': (generate_deck_progress_chart, deck_stats),
+        'upcoming': (generate_upcoming_reviews_chart, upcoming),
+        'activity_heatmap': (generate_activity_heatmap, activity),
+        'activity_trend': (generate_activity_trend_chart, activity)
+    }
+    CHART_CACHE_ENABLED = False
+    
+    start = time.perf_counter()
+    for chart, *args in jobs.values():
+        chart(*args)
+    print(f"Serial: {len(jobs)} charts in {time.perf_counter() - start:.2f}s")
+    start_render_pool()
+    render_charts(jobs)  # Let the workers finish starting up
+    start = time.perf_counter()
+    render_charts(jobs)
+    print(f"Batch ({CHART_WORKERS} workers): {len(jobs)} charts in "
+          f"{time.perf_counter() - start:.2f}s")
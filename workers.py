@@ -0,0 +1,20 @@
+"""
+Process pools shared setup
+Chart rendering (visualizations.py) and workload simulation (simulation.py)
+each keep a worker pool; both start their workers from one forkserver
+"""
+
+import multiprocessing
+
+# Modules the forkserver imports once, so every worker forked from it starts
+# with them loaded. The server starts with the first pool and keeps the list
+# it started with, so it covers every pool's worker module.
+FORKSERVER_PRELOAD = ['__main__', 'visualizations', 'simulation']
+
+def pool_context():
+    """Multiprocessing context for worker pools: forkserver where available, else spawn"""
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(FORKSERVER_PRELOAD)
+        return context
+    return multiprocessing.get_context('spawn')